@@ -0,0 +1,279 @@
+"""
+Rutinas numéricas vectorizadas para los análisis de correlación del dashboard.
+Solo dependen de NumPy, así que se pueden importar sin cargar scikit-learn.
+"""
+import numpy as np
+
+
+def ajustar_polinomio(x, y, grado=1):
+    """
+    Ajuste por mínimos cuadrados de y = c0 + c1*x + ... + cg*x^g.
+
+    Los coeficientes se obtienen de los estadísticos suficientes (sumas de potencias de x y
+    de x^k * y) resolviendo las ecuaciones normales; x se centra y escala antes para que el
+    sistema quede bien condicionado. En la misma pasada se calculan las predicciones, R² y RMSE.
+
+    Devuelve {'coeficientes': [c0, ..., cg], 'prediccion': array, 'r2': float, 'rmse': float}.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    if n == 0:
+        raise ValueError("No hay datos para ajustar")
+
+    media = x.mean()
+    escala = x.std() or 1.0
+    z = (x - media) / escala
+
+    # potencias[k] = z**k para k = 0..2g (filas), con sus sumas forman la matriz de Hankel
+    potencias = z[None, :] ** np.arange(2 * grado + 1)[:, None]
+    sumas = potencias.sum(axis=1)
+    indices = np.arange(grado + 1)
+    matriz = sumas[indices[:, None] + indices[None, :]]
+    vector = potencias[:grado + 1] @ y
+    coef_z = np.linalg.lstsq(matriz, vector, rcond=None)[0]
+
+    prediccion = coef_z @ potencias[:grado + 1]
+    residuos = y - prediccion
+    sse = float(residuos @ residuos)
+    sst = float(((y - y.mean()) ** 2).sum())
+    if sst > 0:
+        r2 = 1.0 - sse / sst
+    else:
+        # Igual que sklearn.metrics.r2_score con y constante
+        r2 = 1.0 if sse == 0 else 0.0
+
+    # Volver de z = (x - media) / escala a coeficientes sobre x
+    polinomio = np.polynomial.Polynomial(coef_z, domain=[media - escala, media + escala], window=[-1, 1])
+    coeficientes = polinomio.convert().coef
+    coeficientes = np.pad(coeficientes, (0, grado + 1 - len(coeficientes)))
+
+    return {
+        'coeficientes': coeficientes,
+        'prediccion': prediccion,
+        'r2': r2,
+        'rmse': float(np.sqrt(sse / n)),
+    }
+
+
+def evaluar_polinomio(coeficientes, x):
+    """Evalúa c0 + c1*x + ... en los puntos x"""
+    return np.polynomial.polynomial.polyval(np.asarray(x, dtype=float), coeficientes)
+
+
+def pearson_enmascarado(matriz):
+    """
+    Pearson de todos los pares de columnas de `matriz` (n x k) en una sola pasada, usando para
+    cada par solo las filas donde ambas columnas tienen dato (NaN = faltante).
+
+    Las sumas por par se obtienen como productos matriciales con la máscara de datos válidos.
+    Devuelve (r, n) con r de forma (k, k) (NaN si hay menos de 3 pares o varianza nula) y
+    n el número de pares usados.
+    """
+    matriz = np.asarray(matriz, dtype=float)
+    validos = ~np.isnan(matriz)
+    mascara = validos.astype(float)
+    # Centrar cada columna reduce la cancelación numérica; Pearson no cambia con traslaciones
+    conteo = mascara.sum(axis=0)
+    medias = np.where(validos, matriz, 0.0).sum(axis=0) / np.maximum(conteo, 1)
+    valores = np.where(validos, matriz - medias, 0.0)
+
+    n = mascara.T @ mascara
+    suma_x = valores.T @ mascara           # suma_x[i, j] = Σ x_i en filas válidas para i y j
+    suma_xx = (valores ** 2).T @ mascara
+    suma_xy = valores.T @ valores
+    suma_y, suma_yy = suma_x.T, suma_xx.T
+
+    covarianza = n * suma_xy - suma_x * suma_y
+    varianza_x = n * suma_xx - suma_x ** 2
+    varianza_y = n * suma_yy - suma_y ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = covarianza / np.sqrt(varianza_x * varianza_y)
+    r[(n < 3) | ~(varianza_x > 0) | ~(varianza_y > 0)] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(int)
+
+
+def rangos(valores):
+    """Rangos promedio (1..n, empates promediados) de un vector sin NaN, como scipy.stats.rankdata"""
+    _, inverso, conteos = np.unique(valores, return_inverse=True, return_counts=True)
+    fin = np.cumsum(conteos)
+    return ((fin - conteos + 1 + fin) / 2.0)[inverso]
+
+
+def spearman_enmascarado(matriz):
+    """
+    Spearman de todos los pares de columnas de `matriz` (n x k), NaN-aware: para cada par se
+    toman las filas con dato en ambas columnas y se rankean ahí (no sobre toda la columna),
+    así el resultado es el rho de Spearman de ese par. Devuelve r de forma (k, k).
+    """
+    matriz = np.asarray(matriz, dtype=float)
+    validos = ~np.isnan(matriz)
+    k = matriz.shape[1]
+    r = np.full((k, k), np.nan)
+    for i in range(k):
+        for j in range(i, k):
+            mascara = validos[:, i] & validos[:, j]
+            if mascara.sum() < 3:
+                continue
+            pares = np.column_stack((rangos(matriz[mascara, i]), rangos(matriz[mascara, j])))
+            r[i, j] = r[j, i] = pearson_enmascarado(pares)[0][0, 1]
+    return r
+
+
+def matriz_correlaciones(matriz):
+    """
+    Pearson y Spearman de todos los pares de columnas, NaN-aware (cada par usa solo las filas
+    donde ambas columnas tienen dato). Pearson sale de una pasada matricial; Spearman re-rankea
+    cada par dentro de su máscara.
+    """
+    pearson, n = pearson_enmascarado(matriz)
+    spearman = spearman_enmascarado(matriz)
+    return {'n': n, 'pearson': pearson, 'spearman': spearman}
+
+
+def _correlacion_fft(a, b, largo_fft, lag_max):
+    """c[k] = Σ_t a[t] * b[t + k] para k = 0..lag_max, vía FFT con relleno de ceros"""
+    espectro = np.conj(np.fft.rfft(a, largo_fft)) * np.fft.rfft(b, largo_fft)
+    return np.fft.irfft(espectro, largo_fft)[:lag_max + 1]
+
+
+def correlacion_cruzada_enmascarada(x, y, lag_max):
+    """
+    Pearson entre x[t] e y[t + k] para cada retardo k = 0..lag_max, sobre dos series en la
+    misma rejilla regular donde NaN marca los huecos.
+
+    Cada estadístico suficiente por retardo (n, Σx, Σy, Σx², Σy², Σxy restringidos a los
+    pares con dato en ambos lados) es una correlación cruzada entre series o máscaras, así
+    que todos salen de FFT en O(n log n) en lugar de un merge desplazado por retardo.
+
+    Devuelve (r, n): arrays de largo lag_max + 1, r NaN donde hay menos de 3 pares o
+    varianza nula.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    lag_max = int(min(lag_max, len(x) - 1))
+    mascara_x = ~np.isnan(x)
+    mascara_y = ~np.isnan(y)
+    # Centrar reduce la cancelación en n*Σxy - Σx*Σy; Pearson no cambia con traslaciones
+    x = np.where(mascara_x, x - x[mascara_x].mean(), 0.0) if mascara_x.any() else np.zeros_like(x)
+    y = np.where(mascara_y, y - y[mascara_y].mean(), 0.0) if mascara_y.any() else np.zeros_like(y)
+    mascara_x = mascara_x.astype(float)
+    mascara_y = mascara_y.astype(float)
+
+    largo_fft = 1 << int(2 * len(x) - 1).bit_length()
+    n = np.rint(_correlacion_fft(mascara_x, mascara_y, largo_fft, lag_max))
+    suma_x = _correlacion_fft(x, mascara_y, largo_fft, lag_max)
+    suma_y = _correlacion_fft(mascara_x, y, largo_fft, lag_max)
+    suma_xx = _correlacion_fft(x ** 2, mascara_y, largo_fft, lag_max)
+    suma_yy = _correlacion_fft(mascara_x, y ** 2, largo_fft, lag_max)
+    suma_xy = _correlacion_fft(x, y, largo_fft, lag_max)
+
+    covarianza = n * suma_xy - suma_x * suma_y
+    varianza_x = n * suma_xx - suma_x ** 2
+    varianza_y = n * suma_yy - suma_y ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = covarianza / np.sqrt(varianza_x * varianza_y)
+    # La FFT deja residuos de redondeo: una varianza despreciable frente a n*Σx² cuenta como nula
+    nula = (varianza_x <= 1e-10 * n * suma_xx) | (varianza_y <= 1e-10 * n * suma_yy)
+    r[(n < 3) | nula] = np.nan
+    return np.clip(r, -1.0, 1.0), n.astype(int)
+
+
+def regresion_movil(x, y, ventana):
+    """
+    Pearson r, pendiente y R² de y ~ x en cada ventana de `ventana` pares consecutivos.
+
+    Las sumas por ventana salen de sumas acumuladas (diferencia de dos prefijos), así que el
+    costo es O(n) para cualquier tamaño de ventana. Los datos se centran antes para que las
+    diferencias de prefijos no pierdan precisión. Devuelve arrays de largo n - ventana + 1
+    (NaN donde la varianza de la ventana es nula).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x = x - x.mean()
+    y = y - y.mean()
+
+    def suma_ventana(v):
+        acumulada = np.concatenate(([0.0], np.cumsum(v)))
+        return acumulada[ventana:] - acumulada[:-ventana]
+
+    suma_x, suma_y = suma_ventana(x), suma_ventana(y)
+    sxx = suma_ventana(x * x) - suma_x ** 2 / ventana
+    syy = suma_ventana(y * y) - suma_y ** 2 / ventana
+    sxy = suma_ventana(x * y) - suma_x * suma_y / ventana
+    # Sumas acumuladas arrastran redondeo: varianzas despreciables frente al total se anulan
+    sxx[sxx <= 1e-12 * (x * x).sum()] = np.nan
+    syy[syy <= 1e-12 * (y * y).sum()] = np.nan
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+        pendiente = sxy / sxx
+    return {'r': r, 'pendiente': pendiente, 'r2': r ** 2}
+
+
+def _estadisticos_filas(xs, ys):
+    """Pearson r, pendiente y R² de cada fila de xs/ys (una regresión por fila)"""
+    xs = xs - xs.mean(axis=1, keepdims=True)
+    ys = ys - ys.mean(axis=1, keepdims=True)
+    sxx = np.einsum('ij,ij->i', xs, xs)
+    syy = np.einsum('ij,ij->i', ys, ys)
+    sxy = np.einsum('ij,ij->i', xs, ys)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        r = np.clip(sxy / np.sqrt(sxx * syy), -1.0, 1.0)
+        pendiente = sxy / sxx
+    return r, pendiente
+
+
+def bootstrap_bloque(x, y, remuestreos, semilla, max_elementos=2_000_000):
+    """
+    Evalúa `remuestreos` remuestras bootstrap de los pares (x, y) con un generador sembrado
+    por `semilla` (entero o np.random.SeedSequence). Las remuestras son matrices de índices
+    (filas = remuestra) evaluadas en lote, en tramos de a lo sumo `max_elementos` celdas.
+    Devuelve {'r', 'pendiente', 'r2'} con un valor por remuestra.
+
+    Es una función de módulo para poder enviarla a un ProcessPoolExecutor.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n = len(x)
+    rng = np.random.default_rng(semilla)
+    filas = max(1, max_elementos // max(n, 1))
+    r = np.empty(remuestreos)
+    pendiente = np.empty(remuestreos)
+    for inicio in range(0, remuestreos, filas):
+        fin = min(inicio + filas, remuestreos)
+        indices = rng.integers(0, n, size=(fin - inicio, n))
+        r[inicio:fin], pendiente[inicio:fin] = _estadisticos_filas(x[indices], y[indices])
+    return {'r': r, 'pendiente': pendiente, 'r2': r ** 2}
+
+
+def bootstrap_regresion(x, y, remuestreos, semilla=0, ic=95, bloques=1, ejecutor=None):
+    """
+    Intervalos de confianza bootstrap (percentiles) de r, pendiente y R² de y ~ x.
+
+    Las remuestras se reparten en `bloques` con semillas hijas de SeedSequence(semilla), así
+    el resultado depende solo de (datos, remuestreos, semilla, bloques) y no de si los bloques
+    se evalúan en serie o en `ejecutor` (p. ej. un ProcessPoolExecutor).
+    """
+    bloques = max(1, min(bloques, remuestreos))
+    tamanos = np.diff(np.linspace(0, remuestreos, bloques + 1).astype(int))
+    semillas = np.random.SeedSequence(semilla).spawn(bloques)
+    argumentos = ([x] * bloques, [y] * bloques, tamanos.tolist(), semillas)
+    mapa = ejecutor.map if ejecutor is not None else map
+    partes = list(mapa(bootstrap_bloque, *argumentos))
+
+    alfa = (100.0 - ic) / 2.0
+    intervalos = {}
+    for clave in ('r', 'pendiente', 'r2'):
+        valores = np.concatenate([parte[clave] for parte in partes])
+        valores = valores[~np.isnan(valores)]
+        if len(valores) == 0:
+            intervalos[clave] = {'inferior': None, 'superior': None, 'error_estandar': None}
+            continue
+        inferior, superior = np.percentile(valores, [alfa, 100.0 - alfa])
+        intervalos[clave] = {
+            'inferior': float(inferior),
+            'superior': float(superior),
+            'error_estandar': float(valores.std(ddof=1)) if len(valores) > 1 else 0.0,
+        }
+    return intervalos
@@ -1,16 +1,63 @@
-from flask import Flask, render_template, jsonify, request
-import pandas as pd
+import gc
 import json
+import multiprocessing
 import os
+import sqlite3
+import stat
+import tempfile
+import io
+import hashlib
+import threading
+import queue
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
-import numpy as np
-from scipy import stats
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.metrics import r2_score, mean_squared_error
+from multiprocessing import shared_memory, resource_tracker
+
+try:
+    import fcntl  # Lock de publicación de la memoria compartida (solo POSIX)
+except ImportError:
+    fcntl = None
+
+# === Tiempos de arranque ===
+# Cuánto tarda cada import pesado; los diferidos (scipy.stats, backend IA) se registran
+# cuando los necesita la primera petición. Se consultan en /api/arranque.
+_INICIO_ARRANQUE = time.perf_counter()
+TIEMPOS_ARRANQUE = OrderedDict()
+
+
+@contextmanager
+def medir_importacion(nombre, diferido=False):
+    """Registra en TIEMPOS_ARRANQUE cuánto tarda el bloque (la primera vez que se mide `nombre`)"""
+    inicio = time.perf_counter()
+    yield
+    if nombre not in TIEMPOS_ARRANQUE:
+        TIEMPOS_ARRANQUE[nombre] = {'ms': (time.perf_counter() - inicio) * 1000, 'diferido': diferido}
+
+
+with medir_importacion('flask'):
+    from flask import Flask, render_template, jsonify, request, stream_with_context, g, has_request_context
+with medir_importacion('pandas'):
+    import pandas as pd
+with medir_importacion('numpy'):
+    import numpy as np
+with medir_importacion('analisis_numerico'):
+    from analisis_numerico import (
+        ajustar_polinomio, evaluar_polinomio, matriz_correlaciones, correlacion_cruzada_enmascarada,
+        regresion_movil, bootstrap_regresion
+    )
 # --- Nuevas importaciones para el chatbot ---
-from google import genai
-from dotenv import load_dotenv # <-- Importar load_dotenv
+# modelos_llm es liviano: google-genai se importa recién al crear el backend de Gemini
+with medir_importacion('modelos_llm'):
+    from modelos_llm import crear_backend, ErrorLLM
+with medir_importacion('metricas'):
+    from metricas import RegistroMetricas, BUCKETS_LATENCIA, BUCKETS_BYTES
+with medir_importacion('dotenv'):
+    from dotenv import load_dotenv # <-- Importar load_dotenv
 
 app = Flask(__name__)
 
@@ -19,31 +66,51 @@ load_dotenv() # <-- Carga las variables del archivo .env
 # ----------------------------------------------
 # Configuración de la aplicación
 app.config['SECRET_KEY'] = 'tu_clave_secreta_aqui'
-
-try:
-    # Intenta obtener la clave API desde las variables de entorno
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        raise ValueError("La variable de entorno GEMINI_API_KEY no está definida en el archivo .env")
-
-    # Configura el cliente de Gemini con la clave obtenida
-    genai_client = genai.Client(api_key=api_key)  # Se crea una instancia del cliente
-
-    # Selecciona el modelo (verifica que esté disponible)
-    MODEL_NAME = "gemini-2.0-flash"  # O el modelo que prefieras
-
-    print("Cliente de Gemini configurado correctamente.")  # Log de confirmación
-
-except ValueError as ve:
-    # Error específico si la variable no está en .env
-    print(f"ADVERTENCIA: {ve}. El análisis con IA no estará disponible.")
-    genai_client = None
-    MODEL_NAME = None
-except Exception as e:
-    # Otros errores de configuración
-    print(f"ADVERTENCIA: Error al configurar el cliente de Gemini: {e}. El análisis con IA no estará disponible.")
-    genai_client = None
-    MODEL_NAME = None
+# Usar la caché columnar binaria (.col) en lugar de parsear los CSV
+app.config['CACHE_COLUMNAR'] = os.getenv('HIDRO_CACHE_COLUMNAR', '1') != '0'
+# Publicar los datasets en memoria compartida, una copia por host para todos los procesos
+app.config['MEMORIA_COMPARTIDA'] = os.getenv('HIDRO_MEMORIA_COMPARTIDA', '0') == '1'
+if app.config['MEMORIA_COMPARTIDA'] and fcntl is None:
+    print("⚠️ HIDRO_MEMORIA_COMPARTIDA requiere fcntl (Linux/macOS); se usará la caché columnar por proceso.")
+    app.config['MEMORIA_COMPARTIDA'] = False
+# Hilos por worker de gunicorn (el mismo HIDRO_THREADS que usa gunicorn.conf.py): los streams SSE
+# y los análisis IA ocupan un hilo mientras duran, así que sus cupos se derivan de este valor
+# para que siempre queden hilos libres para las rutas de datos
+HILOS_POR_WORKER = int(os.getenv('HIDRO_THREADS', 16))
+
+# Backend del análisis IA (Gemini, o el stub local con LLM_BACKEND=stub), creado en la primera
+# petición de análisis para no pagar el import de google-genai al arrancar
+_llm = None
+_llm_iniciado = False
+_LLM_LOCK = threading.Lock()
+
+
+def obtener_llm():
+    """Devuelve el backend de IA (None si no está disponible), creándolo una sola vez entre hilos"""
+    global _llm, _llm_iniciado
+    if not _llm_iniciado:
+        with _LLM_LOCK:
+            if not _llm_iniciado:
+                with medir_importacion(f"backend IA ({os.getenv('LLM_BACKEND', 'gemini')})", diferido=True):
+                    _llm = crear_backend()
+                _llm_iniciado = True
+    return _llm
+
+
+_scipy_stats = None
+
+
+def modulo_stats():
+    """scipy.stats, importado en la primera correlación que lo necesita (es el import más lento)"""
+    global _scipy_stats
+    if _scipy_stats is None:
+        inicio = time.perf_counter()
+        with medir_importacion('scipy.stats', diferido=True):
+            import scipy.stats
+        _scipy_stats = scipy.stats
+        # En la petición que paga el import, ese tiempo no se carga a la etapa en curso
+        etapa_aparte('importar', inicio)
+    return _scipy_stats
 # -------------------------------------------------------------------------------------
 
 # Coordenadas del Rio Quijos (ejemplo extendido)
@@ -66,69 +133,720 @@ RIO_QUIJOS_COORDS = [
 ]
 
 
-def safe_read_csv(filename):
-    """Lee un archivo CSV de forma segura, manejando errores"""
+# === Métricas de peticiones y cachés (GET /metrics, formato Prometheus) ===
+# Las rutas se etiquetan con su plantilla (p. ej. /api/correlacion/<estacion>) para acotar
+# la cantidad de series; los métodos HTTP fuera de los habituales se agrupan como 'otro'. En los
+# streams la latencia es la del primer byte y no se mide el tamaño. Con HIDRO_METRICAS_DIR
+# (gunicorn.conf.py lo define) /metrics suma las métricas de todos los workers.
+METRICAS = RegistroMetricas(os.getenv('HIDRO_METRICAS_DIR') or None)
+_METODOS_METRICAS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'HEAD', 'OPTIONS'}
+_METRICA_PETICIONES = METRICAS.contador(
+    'hidro_peticiones_total', 'Peticiones atendidas por ruta, método y código de estado',
+    ('ruta', 'metodo', 'estado'))
+_METRICA_ERRORES = METRICAS.contador(
+    'hidro_errores_total', 'Respuestas 5xx (incluye excepciones no controladas) por ruta', ('ruta',))
+_METRICA_LATENCIA = METRICAS.histograma(
+    'hidro_latencia_segundos', 'Tiempo hasta devolver la respuesta', BUCKETS_LATENCIA, ('ruta', 'metodo'))
+_METRICA_BYTES = METRICAS.histograma(
+    'hidro_respuesta_bytes', 'Tamaño del cuerpo de las respuestas', BUCKETS_BYTES, ('ruta',))
+_METRICA_CACHE = METRICAS.contador(
+    'hidro_cache_consultas_total', 'Consultas a las cachés de la aplicación por resultado',
+    ('cache', 'resultado'))
+
+
+def registrar_cache(cache, acierto):
+    """Cuenta un acierto o un fallo de la caché `cache` (solo en peticiones: la precarga no cuenta)"""
+    if has_request_context():
+        _METRICA_CACHE.inc(cache, 'acierto' if acierto else 'fallo')
+
+
+def _ruta_metricas():
+    regla = request.url_rule
+    return regla.rule if regla is not None else 'sin_ruta'
+
+
+def _metodo_metricas():
+    return request.method if request.method in _METODOS_METRICAS else 'otro'
+
+
+def _registrar_peticion(status_code, response=None):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is None:
+        return
+    ruta = _ruta_metricas()
+    metodo = _metodo_metricas()
+    _METRICA_LATENCIA.observar(time.perf_counter() - inicio, ruta, metodo)
+    _METRICA_PETICIONES.inc(ruta, metodo, str(status_code))
+    if status_code >= 500:
+        _METRICA_ERRORES.inc(ruta)
+    if response is not None and not response.is_streamed and response.content_length is not None:
+        _METRICA_BYTES.observar(response.content_length, ruta)
+
+
+@app.before_request
+def _iniciar_metricas():
+    g.inicio_peticion = time.perf_counter()
+    METRICAS.iniciar_volcado()
+
+
+@app.after_request
+def _metricas_respuesta(response):
+    _registrar_peticion(response.status_code, response)
+    return response
+
+
+@app.teardown_request
+def _metricas_excepcion(exc):
+    # Si la excepción se propagó (modo debug) after_request no llegó a ejecutarse
+    if exc is not None:
+        _registrar_peticion(500)
+
+
+@app.route('/metrics')
+def metrics():
+    """Métricas (de todos los workers con HIDRO_METRICAS_DIR) en el formato de texto de Prometheus"""
+    return app.response_class(METRICAS.exponer(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+# === Tiempos por etapa de los análisis (cabecera Server-Timing) ===
+# Las rutas decoradas con @medir_etapas reparten su tiempo entre etapas con marcar_etapa():
+# cada marca asigna a la etapa indicada el tiempo transcurrido desde la marca anterior, y lo
+# que queda hasta la respuesta se cuenta como 'serializar'. Con ?debug_timing=1 los tiempos
+# también se agregan al JSON como '_timings'.
+def medir_etapas(vista):
+    """Decorador: activa la medición por etapas de la petición"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        g.etapas = OrderedDict()
+        g.marca_etapa = time.perf_counter()
+        return vista(*args, **kwargs)
+    return envoltura
+
+
+def marcar_etapa(nombre):
+    """Suma a la etapa `nombre` el tiempo desde la marca anterior (no hace nada fuera de @medir_etapas)"""
+    if not has_request_context() or 'etapas' not in g:
+        return
+    ahora = time.perf_counter()
+    g.etapas[nombre] = g.etapas.get(nombre, 0.0) + (ahora - g.marca_etapa) * 1000
+    g.marca_etapa = ahora
+
+
+def etapa_aparte(nombre, inicio):
+    """Cuenta como etapa `nombre` el tiempo desde `inicio` y lo descuenta de la etapa en curso"""
+    if not has_request_context() or 'etapas' not in g:
+        return
+    duracion = time.perf_counter() - inicio
+    g.etapas[nombre] = g.etapas.get(nombre, 0.0) + duracion * 1000
+    g.marca_etapa += duracion
+
+
+@app.after_request
+def _cabecera_server_timing(response):
+    if 'etapas' not in g:
+        return response
+    marcar_etapa('serializar')
+    tiempos = OrderedDict((nombre, round(ms, 3)) for nombre, ms in g.pop('etapas').items())
+    if 'inicio_peticion' in g:
+        tiempos['total'] = round((time.perf_counter() - g.inicio_peticion) * 1000, 3)
+    response.headers['Server-Timing'] = ', '.join(f"{nombre};dur={ms}" for nombre, ms in tiempos.items())
+
+    if request.args.get('debug_timing') == '1' and response.is_json and not response.is_streamed:
+        datos = response.get_json(silent=True)
+        if isinstance(datos, dict):
+            datos['_timings'] = tiempos
+            response.set_data(app.json.dumps(datos))
+    return response
+
+
+# === Almacén de datasets en memoria ===
+# Cada CSV se parsea una sola vez por proceso; la entrada se invalida cuando
+# cambia la firma (mtime, tamaño) del archivo en disco.
+_DATASETS = {}
+_DATASETS_LOCK = threading.Lock()
+
+
+def _firma_archivo(filename):
+    """Devuelve (mtime_ns, tamaño) del archivo; lanza OSError si no existe"""
+    st = os.stat(filename)
+    return st.st_mtime_ns, st.st_size
+
+
+def _parsear_csv(filename, contenido=None):
+    """
+    Parsea el CSV y deja 'Fecha' como DatetimeIndex ordenado (sin fechas inválidas)
+    si la columna existe, para poder recortar rangos con búsqueda binaria.
+    """
+    if contenido is None:
+        with open(filename, 'rb') as archivo:
+            contenido = archivo.read()
+    df = pd.read_csv(io.BytesIO(contenido))
+    if 'Fecha' in df.columns:
+        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
+        df = df.dropna(subset=['Fecha']).set_index('Fecha')
+        if not df.index.is_monotonic_increasing:
+            df = df.sort_index(kind='stable')
+    return df
+
+
+# === Caché columnar binaria de los CSV ===
+# Junto a cada CSV se compila un archivo <nombre>.col con este formato:
+#   8 bytes   b'HIDROCOL'
+#   4 bytes   longitud del encabezado JSON (uint32 little-endian)
+#   N bytes   encabezado JSON: filas, firma/hash del CSV y offset/dtype de cada columna
+#   columnas  contiguas y alineadas a 64 bytes: 'Fecha' (datetime64[ns], ordenada) y un float64 por sensor
+# Los .col se mapean en memoria de solo lectura, así que varios procesos comparten las páginas.
+COLUMNAR_MAGIC = b'HIDROCOL'
+COLUMNAR_VERSION = 2
+_COLUMNAR_ALINEACION = 64
+
+ARCHIVOS_DATOS = [
+    'precipitacion_quijos.csv',
+    'caudal_quijos.csv',
+    'nivel_quijos.csv',
+    'temperatura_quijos.csv',
+    'precipitacion_papallacta.csv',
+    'caudal_papallacta.csv',
+    'nivel_papallacta.csv',
+]
+
+
+def ruta_columnar(filename):
+    """Ruta del archivo columnar compilado a partir de un CSV"""
+    return os.path.splitext(filename)[0] + '.col'
+
+
+def _inicio_datos_columnar(largo_encabezado):
+    """Offset (alineado) donde empiezan las columnas, dado el largo del encabezado"""
+    inicio = len(COLUMNAR_MAGIC) + 4 + largo_encabezado
+    return inicio + (-inicio % _COLUMNAR_ALINEACION)
+
+
+def _leer_encabezado_columnar(ruta):
+    """Devuelve el encabezado JSON de un archivo .col, o None si no es válido"""
     try:
-        if os.path.exists(filename):
-            df = pd.read_csv(filename)
-            # Convertir fecha a datetime si existe la columna
-            if 'Fecha' in df.columns:
-                df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce')
-            return df
-        else:
+        with open(ruta, 'rb') as archivo:
+            inicio = archivo.read(len(COLUMNAR_MAGIC) + 4)
+            if len(inicio) < len(COLUMNAR_MAGIC) + 4 or not inicio.startswith(COLUMNAR_MAGIC):
+                return None
+            largo = int.from_bytes(inicio[len(COLUMNAR_MAGIC):], 'little')
+            encabezado = json.loads(archivo.read(largo).decode('utf-8'))
+    except (OSError, ValueError):
+        return None
+    if encabezado.get('version') != COLUMNAR_VERSION:
+        return None
+    encabezado['inicio_datos'] = _inicio_datos_columnar(largo)
+    return encabezado
+
+
+def serializar_columnar(filename):
+    """
+    Parsea el CSV y devuelve (contenido, encabezado): los bytes completos en el formato .col
+    y su encabezado (con 'inicio_datos'). Lo usan el archivo .col y la memoria compartida.
+    """
+    firma = _firma_archivo(filename)
+    with open(filename, 'rb') as archivo:
+        contenido = archivo.read()
+    df = _parsear_csv(filename, contenido)
+    if df.index.name != 'Fecha':
+        raise ValueError(f"{filename} no tiene columna 'Fecha'")
+
+    columnas = [('Fecha', df.index.values.astype('datetime64[ns]'))]
+    for col in df.columns:
+        columnas.append((str(col), pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='<f8')))
+
+    # Primero se calculan los offsets relativos al inicio de la zona de datos
+    descriptores = []
+    offset = 0
+    for nombre, arr in columnas:
+        descriptores.append({'nombre': nombre, 'dtype': arr.dtype.str, 'offset': offset})
+        offset += arr.nbytes
+        offset += -offset % _COLUMNAR_ALINEACION
+
+    encabezado = {
+        'version': COLUMNAR_VERSION,
+        'filas': len(df),
+        'fuente': {'mtime_ns': firma[0], 'tamano': firma[1],
+                   'sha1': hashlib.sha1(contenido).hexdigest()},
+        'columnas': descriptores,
+    }
+    encabezado_bytes = json.dumps(encabezado).encode('utf-8')
+    inicio_datos = _inicio_datos_columnar(len(encabezado_bytes))
+    encabezado['inicio_datos'] = inicio_datos
+
+    fin_datos = max(desc['offset'] + arr.nbytes for (nombre, arr), desc in zip(columnas, descriptores))
+    salida = bytearray(inicio_datos + fin_datos)
+    salida[:len(COLUMNAR_MAGIC)] = COLUMNAR_MAGIC
+    salida[len(COLUMNAR_MAGIC):len(COLUMNAR_MAGIC) + 4] = len(encabezado_bytes).to_bytes(4, 'little')
+    salida[len(COLUMNAR_MAGIC) + 4:len(COLUMNAR_MAGIC) + 4 + len(encabezado_bytes)] = encabezado_bytes
+    for (nombre, arr), desc in zip(columnas, descriptores):
+        desde = inicio_datos + desc['offset']
+        salida[desde:desde + arr.nbytes] = arr.tobytes()
+    return salida, encabezado
+
+
+def compilar_columnar(filename):
+    """
+    Compila el CSV a su archivo .col y devuelve el encabezado escrito.
+    La escritura es atómica (archivo temporal + os.replace).
+    """
+    contenido, encabezado = serializar_columnar(filename)
+    ruta = ruta_columnar(filename)
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    try:
+        with open(temporal, 'wb') as archivo:
+            archivo.write(contenido)
+        os.replace(temporal, ruta)
+    finally:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+    print(f"🗜️ Caché columnar compilada: {ruta} ({encabezado['filas']} filas)")
+    return encabezado
+
+
+def columnar_vigente(filename, encabezado=None):
+    """Indica si el .col corresponde a la versión actual del CSV"""
+    if encabezado is None:
+        encabezado = _leer_encabezado_columnar(ruta_columnar(filename))
+    if encabezado is None:
+        return False
+    mtime_ns, tamano = _firma_archivo(filename)
+    fuente = encabezado['fuente']
+    return fuente['mtime_ns'] == mtime_ns and fuente['tamano'] == tamano
+
+
+def _mapear_columnar(filename, encabezado):
+    """Mapea el .col en memoria y arma un DataFrame de solo lectura sin copiar los datos"""
+    return _dataframe_columnar(np.memmap(ruta_columnar(filename), dtype=np.uint8, mode='r'), encabezado)
+
+
+def _dataframe_columnar(buffer, encabezado):
+    """DataFrame con vistas (sin copia) sobre un buffer uint8 en formato .col"""
+    filas = encabezado['filas']
+    inicio = encabezado['inicio_datos']
+    arrays = {}
+    for desc in encabezado['columnas']:
+        dtype = np.dtype(desc['dtype'])
+        desde = inicio + desc['offset']
+        arrays[desc['nombre']] = buffer[desde:desde + filas * dtype.itemsize].view(dtype)
+    fechas = pd.DatetimeIndex(arrays.pop('Fecha'), name='Fecha', copy=False)
+    return pd.DataFrame(arrays, index=fechas, copy=False)
+
+
+# === Datasets en memoria compartida entre procesos (HIDRO_MEMORIA_COMPARTIDA=1) ===
+# Cada versión de un CSV se publica una sola vez por host en un segmento de
+# multiprocessing.shared_memory con el mismo formato que los .col. Un manifiesto JSON
+# (escrito de forma atómica) indica el segmento vigente de cada CSV; un lock de archivo
+# (fcntl) garantiza que un solo proceso construya cada versión. Los demás procesos se
+# adjuntan al segmento sin copiar los datos y cambian de versión al cambiar el archivo.
+DIRECTORIO_MEMORIA_COMPARTIDA = os.getenv('HIDRO_SHM_DIR', os.path.join(tempfile.gettempdir(), 'hidrologia_shm'))
+_SEGMENTOS_ADJUNTOS = {}  # nombre de segmento -> SharedMemory abierto en este proceso
+_SEGMENTOS_LOCK = threading.Lock()
+
+
+def _ruta_manifiesto():
+    return os.path.join(DIRECTORIO_MEMORIA_COMPARTIDA, 'manifiesto.json')
+
+
+def _preparar_directorio_compartido():
+    """
+    Crea el directorio del manifiesto (modo 0700) y comprueba que sea un directorio real de
+    este usuario sin permisos para otros: su ruta por defecto en /tmp es predecible y otro
+    usuario podría haberlo creado antes para servir segmentos propios.
+    """
+    os.makedirs(DIRECTORIO_MEMORIA_COMPARTIDA, mode=0o700, exist_ok=True)
+    estado = os.lstat(DIRECTORIO_MEMORIA_COMPARTIDA)
+    if not stat.S_ISDIR(estado.st_mode):
+        raise PermissionError(f"{DIRECTORIO_MEMORIA_COMPARTIDA} no es un directorio")
+    if estado.st_uid != os.getuid() or estado.st_mode & 0o077:
+        raise PermissionError(f"{DIRECTORIO_MEMORIA_COMPARTIDA} debe pertenecer a este usuario con modo 0700")
+
+
+def leer_manifiesto():
+    """Manifiesto {ruta absoluta del CSV: {'segmento', 'firma', 'sha1', 'bytes'}} o {} si no existe"""
+    try:
+        with open(_ruta_manifiesto(), 'r', encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+
+def _escribir_manifiesto(manifiesto):
+    """Reemplaza el manifiesto de forma atómica (archivo temporal + os.replace)"""
+    ruta = _ruta_manifiesto()
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(manifiesto, archivo, indent=1)
+    os.replace(temporal, ruta)
+
+
+@contextmanager
+def _lock_publicacion():
+    """Lock exclusivo del host para publicar segmentos (flock sobre un archivo del directorio)"""
+    with open(os.path.join(DIRECTORIO_MEMORIA_COMPARTIDA, 'publicacion.lock'), 'w') as archivo:
+        fcntl.flock(archivo, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(archivo, fcntl.LOCK_UN)
+
+
+class _Segmento(shared_memory.SharedMemory):
+    """SharedMemory que no se queja al terminar el proceso si aún hay DataFrames sobre él"""
+
+    def __del__(self):
+        try:
+            super().__del__()
+        except BufferError:
+            pass  # El mapeo se libera junto con el proceso
+
+
+def _abrir_segmento(nombre, crear=False, tamano=0):
+    """
+    Abre (o crea) un segmento sin que el resource_tracker lo borre al terminar este proceso:
+    el segmento pertenece al host, no al proceso que lo creó o se adjuntó.
+    """
+    try:
+        return _Segmento(name=nombre, create=crear, size=tamano, track=False)  # Python 3.13+
+    except TypeError:
+        segmento = _Segmento(name=nombre, create=crear, size=tamano)
+        resource_tracker.unregister(segmento._name, 'shared_memory')
+        return segmento
+
+
+def _desvincular_segmento(nombre):
+    """Borra el nombre de un segmento del host; los procesos adjuntos conservan su mapeo"""
+    try:
+        segmento = _abrir_segmento(nombre)
+    except FileNotFoundError:
+        return
+    segmento.close()
+    if getattr(segmento, '_track', True):
+        # Antes de Python 3.13 unlink() lo quita del resource_tracker, así que se vuelve a registrar
+        resource_tracker.register(segmento._name, 'shared_memory')
+    segmento.unlink()
+
+
+def _publicar_segmento(filename, firma, anterior=None):
+    """
+    Construye el segmento de la versión actual del CSV (reutilizando el .col si está al día),
+    lo registra en el manifiesto y borra el segmento de la versión anterior.
+    Se llama con el lock de publicación tomado.
+    """
+    encabezado = _leer_encabezado_columnar(ruta_columnar(filename))
+    if app.config.get('CACHE_COLUMNAR') and columnar_vigente(filename, encabezado):
+        with open(ruta_columnar(filename), 'rb') as archivo:
+            contenido = archivo.read()
+    else:
+        contenido, encabezado = serializar_columnar(filename)
+    sha1 = encabezado['fuente']['sha1']
+
+    ruta = os.path.abspath(filename)
+    nombre = 'hidro_' + hashlib.sha1(f"{ruta}:{sha1}:{firma}".encode('utf-8')).hexdigest()[:16]
+    try:
+        segmento = _abrir_segmento(nombre, crear=True, tamano=len(contenido))
+    except FileExistsError:
+        # Resto de una publicación interrumpida: se reemplaza
+        _desvincular_segmento(nombre)
+        segmento = _abrir_segmento(nombre, crear=True, tamano=len(contenido))
+    segmento.buf[:len(contenido)] = contenido
+    segmento.close()
+
+    manifiesto = leer_manifiesto()
+    manifiesto[ruta] = {'segmento': nombre, 'firma': list(firma), 'sha1': sha1, 'bytes': len(contenido)}
+    _escribir_manifiesto(manifiesto)
+    if anterior and anterior.get('segmento') != nombre:
+        _desvincular_segmento(anterior['segmento'])
+    print(f"🧠 {filename} publicado en memoria compartida ({nombre}, {len(contenido)} bytes)")
+    return manifiesto[ruta]
+
+
+def _cerrar_segmentos_sin_uso(vigente):
+    """Cierra en este proceso los segmentos de versiones viejas que ya no tienen vistas vivas"""
+    for nombre in list(_SEGMENTOS_ADJUNTOS):
+        if nombre == vigente:
+            continue
+        try:
+            _SEGMENTOS_ADJUNTOS[nombre].close()
+        except BufferError:
+            continue  # Alguna petición aún usa un DataFrame de esa versión
+        del _SEGMENTOS_ADJUNTOS[nombre]
+
+
+def _encabezado_de_buffer(buffer):
+    """Encabezado de un buffer en formato .col, o None si no es válido"""
+    prefijo = len(COLUMNAR_MAGIC) + 4
+    if len(buffer) < prefijo or bytes(buffer[:len(COLUMNAR_MAGIC)]) != COLUMNAR_MAGIC:
+        return None
+    largo = int.from_bytes(bytes(buffer[len(COLUMNAR_MAGIC):prefijo]), 'little')
+    encabezado = json.loads(bytes(buffer[prefijo:prefijo + largo]).decode('utf-8'))
+    if encabezado.get('version') != COLUMNAR_VERSION:
+        return None
+    encabezado['inicio_datos'] = _inicio_datos_columnar(largo)
+    return encabezado
+
+
+def _cargar_desde_memoria_compartida(filename):
+    """
+    Devuelve (DataFrame, hash) con vistas sobre el segmento compartido de la versión actual
+    del CSV, publicándolo primero si ningún proceso del host lo hizo todavía.
+    """
+    _preparar_directorio_compartido()
+    firma = list(_firma_archivo(filename))
+    ruta = os.path.abspath(filename)
+
+    entrada = leer_manifiesto().get(ruta)
+    segmento = None
+    if entrada is not None and entrada['firma'] == firma:
+        try:
+            segmento = _abrir_segmento(entrada['segmento'])
+        except FileNotFoundError:
+            segmento = None
+    if segmento is None:
+        with _lock_publicacion():
+            # Otro proceso pudo haberlo publicado mientras esperábamos el lock
+            entrada = leer_manifiesto().get(ruta)
+            try:
+                if entrada is None or entrada['firma'] != firma:
+                    raise FileNotFoundError
+                segmento = _abrir_segmento(entrada['segmento'])
+            except FileNotFoundError:
+                entrada = _publicar_segmento(filename, tuple(firma), anterior=entrada)
+                segmento = _abrir_segmento(entrada['segmento'])
+
+    descriptor = getattr(segmento, '_fd', -1)
+    if descriptor >= 0 and os.fstat(descriptor).st_uid != os.getuid():
+        segmento.close()
+        raise PermissionError(f"Segmento {entrada['segmento']} de otro usuario")
+    buffer = np.frombuffer(segmento.buf, dtype=np.uint8, count=entrada['bytes'])
+    buffer.flags.writeable = False  # Las vistas compartidas son de solo lectura
+    encabezado = _encabezado_de_buffer(buffer)
+    if encabezado is None or encabezado['fuente'].get('sha1') != entrada['sha1']:
+        del buffer
+        segmento.close()
+        raise ValueError(f"Segmento {entrada['segmento']} inválido o no coincide con el manifiesto")
+    with _SEGMENTOS_LOCK:
+        _SEGMENTOS_ADJUNTOS.setdefault(entrada['segmento'], segmento)
+        _cerrar_segmentos_sin_uso(entrada['segmento'])
+    return _dataframe_columnar(buffer, encabezado), encabezado['fuente']['sha1']
+
+
+def _cargar_dataset(filename):
+    """
+    Carga un dataset y devuelve (DataFrame, hash del contenido del CSV).
+    Con HIDRO_MEMORIA_COMPARTIDA=1 se adjunta al segmento compartido del host. Si no,
+    usa la caché columnar (recompilándola si el CSV cambió) y cae al parseo del CSV
+    si no se puede escribir o leer el .col.
+    """
+    if app.config.get('MEMORIA_COMPARTIDA'):
+        try:
+            return _cargar_desde_memoria_compartida(filename)
+        except Exception as e:
+            print(f"⚠️ Memoria compartida no disponible para {filename}: {e}. Se usará la caché local.")
+
+    if app.config.get('CACHE_COLUMNAR'):
+        try:
+            encabezado = _leer_encabezado_columnar(ruta_columnar(filename))
+            if not columnar_vigente(filename, encabezado):
+                encabezado = compilar_columnar(filename)
+            return _mapear_columnar(filename, encabezado), encabezado['fuente']['sha1']
+        except Exception as e:
+            print(f"⚠️ Caché columnar no disponible para {filename}: {e}. Se parseará el CSV.")
+
+    with open(filename, 'rb') as archivo:
+        contenido = archivo.read()
+    return _parsear_csv(filename, contenido), hashlib.sha1(contenido).hexdigest()
+
+
+@app.cli.command('compilar-datos')
+def compilar_datos_command():
+    """Compila (o actualiza) la caché columnar de todos los CSV de estaciones"""
+    for filename in ARCHIVOS_DATOS:
+        if not os.path.exists(filename):
             print(f"Archivo {filename} no encontrado")
-            return pd.DataFrame()
-    except Exception as e:
-        print(f"Error leyendo {filename}: {str(e)}")
+            continue
+        if columnar_vigente(filename):
+            print(f"✅ {ruta_columnar(filename)} al día")
+        else:
+            compilar_columnar(filename)
+
+
+@app.cli.command('liberar-memoria-compartida')
+def liberar_memoria_compartida_command():
+    """Borra los segmentos de memoria compartida publicados y su manifiesto"""
+    if fcntl is None:
+        print("La memoria compartida no está disponible en este sistema")
+        return
+    _preparar_directorio_compartido()
+    # Con el lock tomado ningún proceso publica mientras se borran segmentos y manifiesto
+    with _lock_publicacion():
+        manifiesto = leer_manifiesto()
+        for ruta, entrada in manifiesto.items():
+            _desvincular_segmento(entrada['segmento'])
+            print(f"🧹 {entrada['segmento']} liberado ({ruta})")
+        if os.path.exists(_ruta_manifiesto()):
+            os.remove(_ruta_manifiesto())
+
+
+def obtener_entrada_dataset(filename):
+    """
+    Devuelve la entrada del almacén {'firma', 'df', 'hash'} del archivo, cargándola
+    si no existe o si el archivo cambió. Devuelve None si no se pudo leer.
+    """
+    try:
+        firma = _firma_archivo(filename)
+    except OSError:
+        print(f"Archivo {filename} no encontrado")
+        with _DATASETS_LOCK:
+            _DATASETS.pop(filename, None)
+        return None
+
+    entrada = _DATASETS.get(filename)
+    if entrada is None or entrada['firma'] != firma:
+        with _DATASETS_LOCK:
+            # Otro hilo pudo haberlo cargado mientras esperábamos el lock
+            entrada = _DATASETS.get(filename)
+            if entrada is None or entrada['firma'] != firma:
+                registrar_cache('datasets', False)
+                try:
+                    df, contenido_hash = _cargar_dataset(filename)
+                except Exception as e:
+                    print(f"Error leyendo {filename}: {str(e)}")
+                    return None
+                entrada = {'firma': firma, 'df': df, 'hash': contenido_hash}
+                _DATASETS[filename] = entrada
+                return entrada
+    registrar_cache('datasets', True)
+    return entrada
+
+
+def obtener_dataset(filename):
+    """
+    Devuelve el DataFrame del archivo (índice 'Fecha') desde el almacén del proceso.
+    La vista devuelta es superficial: las rutas pueden añadir columnas sin afectar
+    la copia en caché, pero no deben modificar sus valores.
+    """
+    entrada = obtener_entrada_dataset(filename)
+    if entrada is None:
         return pd.DataFrame()
+    return entrada['df'].copy(deep=False)
 
 
-def process_data_for_charts(df, data_type):
-    """Procesa los datos para los gráficos, manejando valores faltantes"""
+def safe_read_csv(filename):
+    """Lee un archivo CSV de forma segura (desde el almacén), con 'Fecha' como columna"""
+    df = obtener_dataset(filename)
+    if df.index.name == 'Fecha':
+        df = df.reset_index()
+    return df
+
+
+def lttb_indices(x, valores, n_salida):
+    """
+    Largest-Triangle-Three-Buckets sobre varias series a la vez.
+    `x` es el eje (n,) y `valores` la matriz (n, k) con una columna por sensor. Se elige un
+    único índice por bucket (el que maximiza la suma de áreas normalizadas de todas las
+    columnas), de modo que las etiquetas quedan alineadas entre datasets.
+    """
+    n = len(x)
+    if n_salida >= n or n_salida < 3:
+        return np.arange(n)
+
+    # Normalizar cada columna a [0, 1] para que todos los sensores pesen igual
+    valores = np.nan_to_num(np.asarray(valores, dtype=float).reshape(n, -1))
+    minimos = valores.min(axis=0)
+    rangos = valores.max(axis=0) - minimos
+    rangos[rangos == 0] = 1.0
+    valores = (valores - minimos) / rangos
+    x = np.asarray(x, dtype=float)
+    x = (x - x[0]) / ((x[-1] - x[0]) or 1.0)
+
+    # Buckets interiores [bordes[i], bordes[i+1]); el primer y último punto se conservan
+    ancho = (n - 2) / (n_salida - 2)
+    bordes = (np.floor(np.arange(n_salida - 1) * ancho) + 1).astype(int)
+    bordes[-1] = n - 1
+    # Promedio de cada bucket (el "tercer punto" del triángulo), más el último punto
+    conteos = np.diff(np.append(bordes, n))
+    promedios_x = np.add.reduceat(x, bordes) / conteos
+    promedios_y = np.add.reduceat(valores, bordes, axis=0) / conteos[:, None]
+
+    seleccion = np.empty(n_salida, dtype=int)
+    seleccion[0], seleccion[-1] = 0, n - 1
+    a = 0
+    for i in range(n_salida - 2):
+        desde, hasta = bordes[i], bordes[i + 1]
+        xa, ya = x[a], valores[a]
+        xc, yc = promedios_x[i + 1], promedios_y[i + 1]
+        areas = np.abs((xa - xc) * (valores[desde:hasta] - ya)
+                       - (xa - x[desde:hasta, None]) * (yc - ya))
+        a = desde + int(np.argmax(areas.sum(axis=1)))
+        seleccion[i + 1] = a
+    return seleccion
+
+
+# Colores para diferentes sensores
+COLORES_SENSORES = {
+    'M5023': 'rgba(40, 30, 209, 0.8)',
+    'H31': 'rgba(35, 158, 184, 0.8)',
+    'H32': 'rgba(11, 126, 24, 0.8)',
+    'H33': 'rgba(153, 102, 255, 0.8)',
+    'H34': 'rgba(133, 157, 23, 0.8)',
+    'H36': 'rgba(53, 11, 142, 0.8)',
+    'H45': 'rgba(192, 6, 167, 0.8)',
+    'H46': 'rgba(201, 142, 5, 0.8)',
+    'P34': 'rgba(35, 158, 184, 0.8)',
+    'P38': 'rgba(11, 126, 24, 0.8)',
+    'P42': 'rgba(133, 157, 23, 0.8)',
+    'P43': 'rgba(153, 102, 255, 0.8)',
+    'P46': 'rgba(53, 11, 142, 0.8)',
+    'P55': 'rgba(192, 6, 167, 0.8)',
+    'P57': 'rgba(201, 142, 5, 0.8)',
+
+}
+
+
+def _preparar_df_grafico(df, max_points=None):
+    """Quita fechas inválidas y, si se pide, reduce las filas con LTTB"""
+    # Remover filas con fechas inválidas (el almacén ya las excluye)
+    if df.index.hasnans:
+        df = df[df.index.notna()]
+
+    if max_points and len(df) > max_points:
+        indices = lttb_indices(df.index.asi8, df.to_numpy(dtype=float), max_points)
+        df = df.iloc[indices]
+    return df
+
+
+def _estilo_dataset(column, data_type):
+    """Etiqueta y estilo Chart.js del dataset de un sensor"""
+    return {
+        'label': f'{column} ({data_type})',
+        'borderColor': COLORES_SENSORES.get(column, 'rgba(128, 128, 128, 0.8)'),
+        'backgroundColor': COLORES_SENSORES.get(column, 'rgba(128, 128, 128, 0.2)'),
+        'borderWidth': 2,
+        'fill': False
+    }
+
+
+def process_data_for_charts(df, data_type, max_points=None):
+    """
+    Procesa los datos para los gráficos, manejando valores faltantes.
+    Si se indica `max_points`, las series se reducen con LTTB manteniendo las fechas alineadas.
+    """
     if df.empty:
         return {}
 
     try:
-        # Remover filas con fechas inválidas
-        df = df.dropna(subset=['Fecha'])
+        df = _preparar_df_grafico(df, max_points)
 
         # Preparar datos para Chart.js
-        labels = df['Fecha'].dt.strftime('%Y-%m-%d').tolist()
+        labels = df.index.strftime('%Y-%m-%d').tolist()
         datasets = []
 
-        # Colores para diferentes sensores
-        colors = {
-            'M5023': 'rgba(40, 30, 209, 0.8)',
-            'H31': 'rgba(35, 158, 184, 0.8)',
-            'H32': 'rgba(11, 126, 24, 0.8)',
-            'H33': 'rgba(153, 102, 255, 0.8)',
-            'H34': 'rgba(133, 157, 23, 0.8)',
-            'H36': 'rgba(53, 11, 142, 0.8)',
-            'H45': 'rgba(192, 6, 167, 0.8)',
-            'H46': 'rgba(201, 142, 5, 0.8)',
-            'P34': 'rgba(35, 158, 184, 0.8)',
-            'P38': 'rgba(11, 126, 24, 0.8)',
-            'P42': 'rgba(133, 157, 23, 0.8)',
-            'P43': 'rgba(153, 102, 255, 0.8)',
-            'P46': 'rgba(53, 11, 142, 0.8)',
-            'P55': 'rgba(192, 6, 167, 0.8)',
-            'P57': 'rgba(201, 142, 5, 0.8)',
-
-        }
-
         for column in df.columns:
-            if column != 'Fecha':
-                # Manejar valores NaN
-                data = df[column].fillna(0).tolist()
-
-                datasets.append({
-                    'label': f'{column} ({data_type})',
-                    'data': data,
-                    'borderColor': colors.get(column, 'rgba(128, 128, 128, 0.8)'),
-                    'backgroundColor': colors.get(column, 'rgba(128, 128, 128, 0.2)'),
-                    'borderWidth': 2,
-                    'fill': False
-                })
+            # Manejar valores NaN
+            dataset = _estilo_dataset(column, data_type)
+            dataset['data'] = df[column].fillna(0).tolist()
+            datasets.append(dataset)
 
         return {
             'labels': labels,
@@ -139,52 +857,330 @@ def process_data_for_charts(df, data_type):
         return {}
 
 
+# === Formato binario (format=binary) ===
+# Disposición del cuerpo:
+#   uint32 little-endian con el largo L del encabezado
+#   encabezado JSON utf-8 de L bytes (relleno con espacios para que los datos queden alineados a 8)
+#   columnas little-endian contiguas (cada una alineada a 8 bytes)
+# encabezado['columnas'][i] = {'offset', 'longitud', 'tipo'} con offset relativo al inicio de
+# los datos (4 + L), de modo que el cliente arma `new Float32Array(buffer, 4 + L + offset, longitud)`.
+FORMATO_BINARIO_VERSION = 1
+MIMETYPE_BINARIO = 'application/octet-stream'
+_TIPOS_BINARIO = {'<i4': 'int32', '<f4': 'float32'}
+
+
+def formato_solicitado(args):
+    """Devuelve 'json' o 'binary' según ?format=; lanza ValueError si no es válido"""
+    formato = args.get('format', 'json').lower()
+    if formato not in ('json', 'binary'):
+        raise ValueError("format debe ser 'json' o 'binary'.")
+    return formato
+
+
+def codificar_binario(encabezado, columnas):
+    """Empaqueta el encabezado y las columnas (int32/float32) en el formato binario"""
+    descriptores = []
+    offset = 0
+    for arr in columnas:
+        descriptores.append({'offset': offset, 'longitud': len(arr), 'tipo': _TIPOS_BINARIO[arr.dtype.str]})
+        offset += arr.nbytes
+        offset += -offset % 8
+
+    encabezado = dict(encabezado, version=FORMATO_BINARIO_VERSION, columnas=descriptores)
+    texto = app.json.dumps(encabezado, separators=(',', ':')).encode('utf-8')
+    texto += b' ' * (-(4 + len(texto)) % 8)
+
+    partes = [len(texto).to_bytes(4, 'little'), texto]
+    for arr in columnas:
+        partes.append(arr.tobytes())
+        partes.append(b'\0' * (-arr.nbytes % 8))
+    return b''.join(partes)
+
+
+def series_binario(df, data_type, max_points=None):
+    """
+    Series en formato binario: 'fechas' es una columna int32 de días desde 1970-01-01 y cada
+    dataset apunta a su columna float32 (NaN se envían como 0, igual que en JSON).
+    """
+    if df.empty:
+        return codificar_binario({'filas': 0, 'fechas': None, 'datasets': []}, [])
+
+    df = _preparar_df_grafico(df, max_points)
+    columnas = [df.index.values.astype('datetime64[D]').astype('<i4')]
+    datasets = []
+    for column in df.columns:
+        columnas.append(df[column].fillna(0).to_numpy(dtype='<f4'))
+        dataset = _estilo_dataset(column, data_type)
+        dataset['columna'] = len(columnas) - 1
+        datasets.append(dataset)
+    return codificar_binario({'filas': len(df), 'fechas': 0, 'datasets': datasets}, columnas)
+
+
+def dispersion_binario(result):
+    """
+    Resultado de un análisis de correlación en formato binario: el encabezado lleva las
+    estadísticas y cada dataset de chartjs_data apunta a sus columnas float32 'x' e 'y'.
+    """
+    encabezado = {k: v for k, v in result.items() if k != 'chartjs_data'}
+    columnas = []
+    datasets = []
+    for dataset in result.get('chartjs_data', {}).get('datasets', []):
+        puntos = dataset.get('data', [])
+        columnas.append(np.fromiter((p['x'] for p in puntos), dtype='<f4', count=len(puntos)))
+        columnas.append(np.fromiter((p['y'] for p in puntos), dtype='<f4', count=len(puntos)))
+        estilo = {k: v for k, v in dataset.items() if k != 'data'}
+        estilo['x'], estilo['y'] = len(columnas) - 2, len(columnas) - 1
+        datasets.append(estilo)
+    encabezado['datasets'] = datasets
+    return codificar_binario(encabezado, columnas)
+
+
+def responder_resultado(result, formato='json'):
+    """Devuelve el resultado de un análisis como JSON o en formato binario"""
+    if formato == 'binary':
+        return app.response_class(dispersion_binario(result), mimetype=MIMETYPE_BINARIO)
+    return jsonify(result)
+
+
 @app.route('/')
 def index():
     """Página principal del dashboard"""
     return render_template('index.html')
 
 
+# === Series del dashboard: payloads JSON precalculados con ETag ===
+# id de serie -> (archivo CSV, tipo de dato mostrado en las etiquetas)
+SERIES_DASHBOARD = {
+    'precipitacion_quijos': ('precipitacion_quijos.csv', 'Precipitación (mm)'),
+    'caudal_quijos': ('caudal_quijos.csv', 'Caudal (m³/s)'),
+    'nivel_quijos': ('nivel_quijos.csv', 'Nivel (m)'),
+    'precipitacion_papallacta': ('precipitacion_papallacta.csv', 'Precipitación Papallacta (mm)'),
+    'caudal_papallacta': ('caudal_papallacta.csv', 'Caudal Papallacta (m³/s)'),
+    'nivel_papallacta': ('nivel_papallacta.csv', 'Nivel Papallacta (m)'),
+}
+
+# LRU de payloads serializados: clave -> {'hash', 'etag', 'cuerpo'}
+_PAYLOADS = OrderedDict()
+_PAYLOADS_MAX = 256
+_PAYLOADS_LOCK = threading.Lock()
+
+
+def etag_payload(contenido_hash, *clave):
+    """ETag fuerte derivado del hash del archivo fuente y de la clave del payload"""
+    return hashlib.sha1(repr((contenido_hash,) + clave).encode('utf-8')).hexdigest()
+
+
+def serializar_json(data):
+    """Serializa igual que jsonify (compacto, claves ordenadas) y devuelve bytes"""
+    return (app.json.dumps(data, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def payload_cacheado(filename, clave, construir, serializar=serializar_json, mimetype='application/json'):
+    """
+    Devuelve el payload {'etag', 'cuerpo', 'mimetype'} de `clave` para el archivo, reutilizando
+    los bytes ya serializados mientras el contenido del archivo no cambie.
+    `construir(df)` recibe la vista del dataset y devuelve el objeto a serializar.
+    """
+    entrada = obtener_entrada_dataset(filename)
+    if entrada is None:
+        return {'etag': None, 'cuerpo': serializar(construir(pd.DataFrame())), 'mimetype': mimetype}
+
+    with _PAYLOADS_LOCK:
+        payload = _PAYLOADS.get(clave)
+        if payload is not None and payload['hash'] == entrada['hash']:
+            _PAYLOADS.move_to_end(clave)
+            registrar_cache('payloads', True)
+            return payload
+    registrar_cache('payloads', False)
+
+    payload = {
+        'hash': entrada['hash'],
+        'etag': etag_payload(entrada['hash'], *clave),
+        'cuerpo': serializar(construir(entrada['df'].copy(deep=False))),
+        'mimetype': mimetype,
+    }
+    with _PAYLOADS_LOCK:
+        _PAYLOADS[clave] = payload
+        _PAYLOADS.move_to_end(clave)
+        while len(_PAYLOADS) > _PAYLOADS_MAX:
+            _PAYLOADS.popitem(last=False)
+    return payload
+
+
+def recortar_por_fechas(df, desde=None, hasta=None):
+    """
+    Recorta el DataFrame (índice 'Fecha' ordenado) al rango [desde, hasta] con búsqueda
+    binaria sobre el índice; el resultado es un slice posicional, sin copiar los datos.
+    """
+    if desde is None and hasta is None:
+        return df
+    inicio = df.index.searchsorted(desde, side='left') if desde is not None else 0
+    fin = df.index.searchsorted(hasta, side='right') if hasta is not None else len(df)
+    return df.iloc[inicio:fin]
+
+
+def payload_serie(serie_id, max_points=None, desde=None, hasta=None, formato='json'):
+    """Payload de una serie del dashboard: Chart.js {labels, datasets} o formato binario"""
+    filename, data_type = SERIES_DASHBOARD[serie_id]
+    clave = (filename, data_type, max_points,
+             desde.isoformat() if desde is not None else None,
+             hasta.isoformat() if hasta is not None else None,
+             formato)
+    if formato == 'binary':
+        return payload_cacheado(
+            filename, clave,
+            lambda df: series_binario(recortar_por_fechas(df, desde, hasta), data_type, max_points),
+            serializar=lambda cuerpo: cuerpo, mimetype=MIMETYPE_BINARIO)
+    return payload_cacheado(
+        filename, clave,
+        lambda df: process_data_for_charts(recortar_por_fechas(df, desde, hasta), data_type, max_points))
+
+
+def responder_payload(payload):
+    """Respuesta con ETag; devuelve 304 si coincide con If-None-Match"""
+    response = app.response_class(payload['cuerpo'], mimetype=payload.get('mimetype', 'application/json'))
+    if payload['etag'] is None:
+        return response
+    response.set_etag(payload['etag'])
+    # El navegador guarda la respuesta pero siempre revalida con If-None-Match
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def parametros_serie(args):
+    """Lee los parámetros opcionales de las rutas de series; lanza ValueError si son inválidos"""
+    parametros = {}
+    max_points = args.get('max_points')
+    if max_points:
+        try:
+            max_points = int(max_points)
+        except ValueError:
+            raise ValueError("max_points debe ser un entero.")
+        if max_points < 3:
+            raise ValueError("max_points debe ser mayor o igual a 3.")
+        parametros['max_points'] = max_points
+
+    for nombre in ('desde', 'hasta'):
+        valor = args.get(nombre)
+        if not valor:
+            continue
+        try:
+            fecha = pd.Timestamp(valor)
+        except ValueError:
+            fecha = pd.NaT
+        if pd.isna(fecha):  # También rechaza 'NaT' escrito en la query
+            raise ValueError(f"{nombre} debe ser una fecha válida (AAAA-MM-DD).")
+        if fecha.tzinfo is not None:
+            # Las fechas de los CSV son locales y sin zona horaria: no se pueden comparar
+            raise ValueError(f"{nombre} no debe incluir zona horaria (usa AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS).")
+        if nombre == 'hasta' and len(valor) <= 10:
+            # 'hasta' con solo fecha incluye el día completo
+            fecha = fecha + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')
+        parametros[nombre] = fecha
+    if parametros.get('desde') is not None and parametros.get('hasta') is not None \
+            and parametros['desde'] > parametros['hasta']:
+        raise ValueError("desde no puede ser posterior a hasta.")
+
+    parametros['formato'] = formato_solicitado(args)
+    return parametros
+
+
+def responder_serie(serie_id):
+    """Atiende una ruta de serie aplicando los parámetros de la query string"""
+    try:
+        parametros = parametros_serie(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    return responder_payload(payload_serie(serie_id, **parametros))
+
+
+# === Coalescencia de peticiones idénticas concurrentes (single-flight) ===
+# Si llegan varias peticiones iguales mientras la primera se calcula, solo esa ejecuta la vista;
+# las demás esperan y reciben una copia de su respuesta. Evita picos de cómputo cuando muchos
+# dashboards refrescan a la vez o tras invalidar una caché. El análisis IA tiene su propia
+# coalescencia (generaciones compartidas por clave_analisis, ver más abajo).
+VUELO_ESPERA_MAX = float(os.getenv('HIDRO_VUELO_ESPERA_MAX', 30))  # segundos
+_EN_VUELO = {}
+_EN_VUELO_LOCK = threading.Lock()
+
+
+def clave_peticion():
+    """Clave de la petición actual: endpoint, argumentos de ruta y query, y cuerpo JSON normalizado"""
+    cuerpo = request.get_json(silent=True) if request.method == 'POST' else None
+    return (
+        request.endpoint,
+        tuple(sorted((request.view_args or {}).items())),
+        tuple(sorted(request.args.items(multi=True))),
+        json.dumps(cuerpo, sort_keys=True, separators=(',', ':')) if cuerpo is not None else None,
+    )
+
+
+def vuelo_unico(vista):
+    """Decorador: peticiones idénticas simultáneas comparten una sola ejecución de la vista"""
+    @wraps(vista)
+    def envoltura(*args, **kwargs):
+        clave = clave_peticion()
+        with _EN_VUELO_LOCK:
+            vuelo = _EN_VUELO.get(clave)
+            lider = vuelo is None
+            if lider:
+                vuelo = {'listo': threading.Event(), 'respuesta': None}
+                _EN_VUELO[clave] = vuelo
+        registrar_cache('vuelo_unico', not lider)
+
+        if not lider:
+            inicio = time.perf_counter()
+            if not vuelo['listo'].wait(timeout=VUELO_ESPERA_MAX):
+                return jsonify({'error': 'La petición tardó demasiado. Inténtalo de nuevo.'}), 504
+            if vuelo['respuesta'] is not None:
+                cuerpo, status, headers = vuelo['respuesta']
+                respuesta = app.response_class(cuerpo, status=status, headers=headers)
+                # Las etapas copiadas son las del líder; esta petición solo esperó su resultado
+                respuesta.headers['Server-Timing'] = f"coalescido;dur={round((time.perf_counter() - inicio) * 1000, 3)}"
+                return respuesta
+            # La ejecución compartida falló o era un stream: atender esta petición por separado
+            return vista(*args, **kwargs)
+
+        try:
+            respuesta = app.make_response(vista(*args, **kwargs))
+            if not respuesta.is_streamed:
+                vuelo['respuesta'] = (respuesta.get_data(), respuesta.status_code, list(respuesta.headers.items()))
+            return respuesta
+        finally:
+            with _EN_VUELO_LOCK:
+                _EN_VUELO.pop(clave, None)
+            vuelo['listo'].set()
+    return envoltura
+
+
 @app.route('/api/precipitacion')
 def api_precipitacion():
     """API para datos de precipitación"""
-    df = safe_read_csv('precipitacion_quijos.csv')
-    data = process_data_for_charts(df, 'Precipitación (mm)')
-    return jsonify(data)
+    return responder_serie('precipitacion_quijos')
 
 
 @app.route('/api/caudal')
 def api_caudal():
     """API para datos de caudal"""
-    df = safe_read_csv('caudal_quijos.csv')
-    data = process_data_for_charts(df, 'Caudal (m³/s)')
-    return jsonify(data)
+    return responder_serie('caudal_quijos')
 
 
 @app.route('/api/nivel')
 def api_nivel():
     """API para datos de nivel"""
-    df = safe_read_csv('nivel_quijos.csv')
-    data = process_data_for_charts(df, 'Nivel (m)')
-    return jsonify(data)
+    return responder_serie('nivel_quijos')
 
 @app.route('/api/precipitacion_papallacta')
 def api_precipitacion_papallacta():
-    df = safe_read_csv('precipitacion_papallacta.csv')
-    data = process_data_for_charts(df, 'Precipitación Papallacta (mm)')
-    return jsonify(data)
+    return responder_serie('precipitacion_papallacta')
 
 @app.route('/api/caudal_papallacta')
 def api_caudal_papallacta():
-    df = safe_read_csv('caudal_papallacta.csv')
-    data = process_data_for_charts(df, 'Caudal Papallacta (m³/s)')
-    return jsonify(data)
+    return responder_serie('caudal_papallacta')
 
 @app.route('/api/nivel_papallacta')
 def api_nivel_papallacta():
-    df = safe_read_csv('nivel_papallacta.csv')
-    data = process_data_for_charts(df, 'Nivel Papallacta (m)')
-    return jsonify(data)
+    return responder_serie('nivel_papallacta')
 
 
 
@@ -208,11 +1204,34 @@ def leer_coords_txt(nombre_archivo):
         print(f"Error leyendo {nombre_archivo}: {e}")
     return coords
 
+
+# Coordenadas leídas de los .txt, invalidadas por mtime/tamaño como los datasets
+ARCHIVOS_COORDENADAS = ['coordquijos.txt', 'coordpapallacta.txt']
+_COORDS = {}
+
+
+def obtener_coords(nombre_archivo):
+    """Coordenadas del archivo (cacheadas mientras el archivo no cambie); [] si no existe"""
+    try:
+        firma = _firma_archivo(nombre_archivo)
+    except OSError:
+        print(f"Archivo {nombre_archivo} no encontrado")
+        _COORDS.pop(nombre_archivo, None)
+        return []
+    entrada = _COORDS.get(nombre_archivo)
+    acierto = entrada is not None and entrada['firma'] == firma
+    registrar_cache('coordenadas', acierto)
+    if not acierto:
+        entrada = {'firma': firma, 'coords': leer_coords_txt(nombre_archivo)}
+        _COORDS[nombre_archivo] = entrada
+    return entrada['coords']
+
+
 @app.route('/api/rios')
 def api_rios():
     """API que devuelve coordenadas de múltiples ríos desde archivos .txt"""
-    rio_quijos = leer_coords_txt('coordquijos.txt')
-    rio_papallacta = leer_coords_txt('coordpapallacta.txt')
+    rio_quijos = obtener_coords('coordquijos.txt')
+    rio_papallacta = obtener_coords('coordpapallacta.txt')
 
     return jsonify({
         'quijos': rio_quijos,
@@ -223,79 +1242,592 @@ def api_rios():
 def api_rio_coords():
     """Devuelve coordenadas de ambos ríos desde archivos .txt"""
     return jsonify({
-        'rio_quijos': leer_coords_txt('coordquijos.txt'),
-        'rio_papallacta': leer_coords_txt('coordpapallacta.txt')
+        'rio_quijos': obtener_coords('coordquijos.txt'),
+        'rio_papallacta': obtener_coords('coordpapallacta.txt')
     })
 
 
+def calcular_stats():
+    """Calcula las estadísticas generales (registros y sensores) de todas las estaciones"""
+    precipitacion_df = obtener_dataset('precipitacion_quijos.csv')
+    caudal_df = obtener_dataset('caudal_quijos.csv')
+    nivel_df = obtener_dataset('nivel_quijos.csv')
+    precipitacionpapallacta_df = obtener_dataset('precipitacion_papallacta.csv')
+    caudalpapallacta_df = obtener_dataset('caudal_papallacta.csv')
+    nivelpapallacta_df = obtener_dataset('nivel_papallacta.csv')
+
+    stats = {
+        'total_registros': {
+            'precipitacion': (len(precipitacion_df) if not precipitacion_df.empty  else 0)+(len(precipitacionpapallacta_df) if not precipitacionpapallacta_df.empty  else 0),
+            'caudal': (len(caudal_df) if not caudal_df.empty else 0)+(len(caudalpapallacta_df) if not caudalpapallacta_df.empty else 0),
+            'nivel': (len(nivel_df) if not nivel_df.empty else 0)+(len(nivelpapallacta_df) if not nivelpapallacta_df.empty else 0)
+        },
+        'sensores_activos': {
+            'precipitacion': (len(
+                [col for col in precipitacion_df.columns if col != 'Fecha']) if not precipitacion_df.empty else 0)+(len(
+                [col for col in precipitacionpapallacta_df.columns if col != 'Fecha']) if not precipitacionpapallacta_df.empty else 0),
+            'caudal': (len([col for col in caudal_df.columns if col != 'Fecha']) if not caudal_df.empty else 0)+(len([col for col in caudalpapallacta_df.columns if col != 'Fecha']) if not caudalpapallacta_df.empty else 0),
+            'nivel': (len([col for col in nivel_df.columns if col != 'Fecha']) if not nivel_df.empty else 0)
+        }
+    }
+
+    return stats
+
+
 @app.route('/api/stats')
 def api_stats():
     """API para estadísticas generales"""
     try:
-        precipitacion_df = safe_read_csv('precipitacion_quijos.csv')
-        caudal_df = safe_read_csv('caudal_quijos.csv')
-        nivel_df = safe_read_csv('nivel_quijos.csv')
-        precipitacionpapallacta_df = safe_read_csv('precipitacion_papallacta.csv')
-        caudalpapallacta_df = safe_read_csv('caudal_papallacta.csv')
-        nivelpapallacta_df = safe_read_csv('nivel_papallacta.csv')
-
-        stats = {
-            'total_registros': {
-                'precipitacion': (len(precipitacion_df) if not precipitacion_df.empty  else 0)+(len(precipitacionpapallacta_df) if not precipitacionpapallacta_df.empty  else 0),
-                'caudal': (len(caudal_df) if not caudal_df.empty else 0)+(len(caudalpapallacta_df) if not caudalpapallacta_df.empty else 0),
-                'nivel': (len(nivel_df) if not nivel_df.empty else 0)+(len(nivelpapallacta_df) if not nivelpapallacta_df.empty else 0)
-            },
-            'sensores_activos': {
-                'precipitacion': (len(
-                    [col for col in precipitacion_df.columns if col != 'Fecha']) if not precipitacion_df.empty else 0)+(len(
-                    [col for col in precipitacionpapallacta_df.columns if col != 'Fecha']) if not precipitacionpapallacta_df.empty else 0),
-                'caudal': (len([col for col in caudal_df.columns if col != 'Fecha']) if not caudal_df.empty else 0)+(len([col for col in caudalpapallacta_df.columns if col != 'Fecha']) if not caudalpapallacta_df.empty else 0),
-                'nivel': (len([col for col in nivel_df.columns if col != 'Fecha']) if not nivel_df.empty else 0)
-            }
-        }
-
-        return jsonify(stats)
+        return jsonify(calcular_stats())
     except Exception as e:
         return jsonify({'error': str(e)})
 
 
+@app.route('/api/series')
+def api_series():
+    """
+    API por lotes: devuelve en un solo cuerpo los payloads de varias series del dashboard.
+    Uso: /api/series?ids=precipitacion_quijos,caudal_papallacta,stats
+    (sin `ids` devuelve todas). Acepta también max_points, desde y hasta.
+    """
+    ids = [i.strip() for i in request.args.get('ids', '').split(',') if i.strip()]
+    if not ids:
+        ids = list(SERIES_DASHBOARD) + ['stats']
+    invalidos = [i for i in ids if i not in SERIES_DASHBOARD and i != 'stats']
+    if invalidos:
+        return jsonify({"error": f"Series no válidas: {', '.join(invalidos)}. "
+                                 f"Usa: {', '.join(list(SERIES_DASHBOARD) + ['stats'])}."}), 400
+    try:
+        parametros = parametros_serie(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
+    if parametros.pop('formato') != 'json':
+        return jsonify({"error": "format=binary no está disponible en /api/series; usa las rutas individuales."}), 400
+
+    # Se concatenan los cuerpos ya serializados de la caché, sin volver a codificar JSON
+    partes = []
+    etags = []
+    for serie_id in dict.fromkeys(ids):
+        if serie_id == 'stats':
+            try:
+                cuerpo = serializar_json(calcular_stats())
+            except Exception as e:
+                cuerpo = serializar_json({'error': str(e)})
+            etag = hashlib.sha1(cuerpo).hexdigest()
+        else:
+            payload = payload_serie(serie_id, **parametros)
+            cuerpo, etag = payload['cuerpo'], payload['etag']
+        partes.append(json.dumps(serie_id).encode('utf-8') + b':' + cuerpo.rstrip(b'\n'))
+        etags.append(etag)
+
+    cuerpo = b'{' + b','.join(partes) + b'}\n'
+    etag = None if None in etags else hashlib.sha1(repr(etags).encode('utf-8')).hexdigest()
+    return responder_payload({'etag': etag, 'cuerpo': cuerpo})
+
+
+
+# === Notificaciones de cambios en los datasets (Server-Sent Events) ===
+# Un único hilo vigila las firmas de los archivos y avisa a cada dashboard conectado con
+# el id de la serie que cambió y su nuevo ETag (el de la ruta sin parámetros).
+SSE_INTERVALO_REVISION = float(os.getenv('HIDRO_SSE_INTERVALO', '5'))  # segundos
+SSE_LATIDO = 15  # segundos entre comentarios keep-alive
+# Cada dashboard abierto ocupa un hilo del worker: por encima del cupo se responde 503 con
+# 'retry:' y el navegador vuelve a intentar más tarde
+SSE_MAX_SUSCRIPTORES = int(os.getenv('HIDRO_SSE_MAX_SUSCRIPTORES', max(1, HILOS_POR_WORKER // 4)))
+SSE_REINTENTO_SATURADO = 60  # segundos
+_SUSCRIPTORES = set()
+_SUSCRIPTORES_LOCK = threading.Lock()
+_VIGILANTE = None
+
+
+def etags_series():
+    """ETag actual de cada serie del dashboard"""
+    return {serie_id: payload_serie(serie_id)['etag'] for serie_id in SERIES_DASHBOARD}
+
+
+def _vigilar_datasets():
+    """Revisa periódicamente las series y publica un evento por cada una que cambió"""
+    ultimos = etags_series()
+    while True:
+        time.sleep(SSE_INTERVALO_REVISION)
+        with _SUSCRIPTORES_LOCK:
+            if not _SUSCRIPTORES:
+                continue
+        try:
+            actuales = etags_series()
+        except Exception as e:
+            print(f"⚠️ Error revisando cambios de datasets: {e}")
+            continue
+        for serie_id, etag in actuales.items():
+            if etag != ultimos.get(serie_id):
+                print(f"🔔 Serie actualizada: {serie_id}")
+                _publicar('dataset', {'id': serie_id, 'etag': etag})
+        ultimos = actuales
+
+
+def _publicar(evento, datos):
+    """Encola un evento para todos los suscriptores (descarta si la cola de uno está llena)"""
+    mensaje = f"event: {evento}\ndata: {json.dumps(datos)}\n\n"
+    with _SUSCRIPTORES_LOCK:
+        for cola in _SUSCRIPTORES:
+            try:
+                cola.put_nowait(mensaje)
+            except queue.Full:
+                pass
+
+
+def _suscribir():
+    """Registra una cola de eventos y arranca el vigilante la primera vez; None si el cupo está lleno"""
+    global _VIGILANTE
+    cola = queue.Queue(maxsize=100)
+    with _SUSCRIPTORES_LOCK:
+        if len(_SUSCRIPTORES) >= SSE_MAX_SUSCRIPTORES:
+            return None
+        _SUSCRIPTORES.add(cola)
+        if _VIGILANTE is None or not _VIGILANTE.is_alive():
+            _VIGILANTE = threading.Thread(target=_vigilar_datasets, name='vigilante-datasets', daemon=True)
+            _VIGILANTE.start()
+    return cola
+
+
+@app.route('/api/stream')
+def api_stream():
+    """
+    Stream SSE de cambios en los datos. Al conectar envía un evento 'estado' con el ETag de
+    cada serie; luego un evento 'dataset' {id, etag} por cada serie que cambie.
+    """
+    cola = _suscribir()
+    if cola is None:
+        response = app.response_class(f"retry: {SSE_REINTENTO_SATURADO * 1000}\n\n",
+                                      status=503, mimetype='text/event-stream')
+        response.headers['Retry-After'] = str(SSE_REINTENTO_SATURADO)
+        return response
+
+    def eventos():
+        try:
+            yield f"retry: 5000\nevent: estado\ndata: {json.dumps(etags_series())}\n\n"
+            while True:
+                try:
+                    yield cola.get(timeout=SSE_LATIDO)
+                except queue.Empty:
+                    # Comentario keep-alive; si el cliente se fue, la escritura falla y se cierra
+                    yield ": latido\n\n"
+        finally:
+            with _SUSCRIPTORES_LOCK:
+                _SUSCRIPTORES.discard(cola)
+
+    response = app.response_class(stream_with_context(eventos()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
 # --- Añade/Reemplaza esta nueva ruta al final del archivo, antes de if __name__ == '__main__': ---
-@app.route('/api/analizar', methods=['POST'])
-def api_analizar():
+# === Resumen estadístico de los gráficos para el prompt del análisis IA ===
+# grafico_id del dashboard -> serie del dashboard o par de correlación (estación, x, y)
+GRAFICOS_ANALISIS = {
+    'precipitacionChart': {'serie': 'precipitacion_quijos'},
+    'precipitacionPapallactaChart': {'serie': 'precipitacion_papallacta'},
+    'caudalChart': {'serie': 'caudal_quijos'},
+    'caudalPapallactaChart': {'serie': 'caudal_papallacta'},
+    'nivelChart': {'serie': 'nivel_quijos'},
+    'nivelPapallactaChart': {'serie': 'nivel_papallacta'},
+    'correlacionPapallactaChart': {'par': ('papallacta', 'nivel', 'caudal')},
+    'correlacionQuijosChart': {'par': ('quijos', 'nivel', 'caudal')},
+    'correlacionPrecipNivelPapallactaChart': {'par': ('papallacta', 'precipitacion', 'nivel')},
+    'correlacionPrecipNivelQuijosChart': {'par': ('quijos', 'precipitacion', 'nivel')},
+    'correlacionPrecipCaudalPapallactaChart': {'par': ('papallacta', 'precipitacion', 'caudal')},
+    'correlacionPrecipCaudalQuijosChart': {'par': ('quijos', 'precipitacion', 'caudal')},
+}
+MESES_ABREV = ['ene', 'feb', 'mar', 'abr', 'may', 'jun', 'jul', 'ago', 'sep', 'oct', 'nov', 'dic']
+_RESUMENES = {}
+
+
+def _resumir_sensor(valores):
+    """Tendencia, extremos con fecha, medias mensuales y huecos de una serie (Series con índice Fecha)"""
+    valores = valores.dropna()
+    if len(valores) == 0:
+        return None
+    fechas = valores.index
+    resumen = {
+        'n': len(valores),
+        'periodo': f"{fechas[0]:%Y-%m} a {fechas[-1]:%Y-%m}",
+        'media': float(valores.mean()),
+        'maximo': (float(valores.max()), f"{valores.idxmax():%Y-%m-%d}"),
+        'minimo': (float(valores.min()), f"{valores.idxmin():%Y-%m-%d}"),
+        'medias_mensuales': valores.groupby(fechas.month).mean().round(2).to_dict(),
+    }
+    if len(valores) >= 3:
+        anios = (fechas - fechas[0]) / pd.Timedelta(days=365.25)
+        resumen['tendencia_anual'] = float(ajustar_polinomio(np.asarray(anios), valores.to_numpy(), grado=1)['coeficientes'][1])
+
+    # Huecos sobre la misma rejilla regular (meses o días) que la correlación con retardo
+    unidad = _unidad_rejilla(fechas.values)
+    pasos = np.diff(_posiciones_rejilla(fechas.values, unidad))
+    resumen['huecos'] = {'unidad': unidad, 'faltantes': int((pasos - 1).clip(min=0).sum())}
+    if len(pasos) and pasos.max() > 1:
+        k = int(pasos.argmax())
+        resumen['huecos']['mayor'] = (int(pasos[k] - 1), f"{fechas[k]:%Y-%m-%d}")
+    return resumen
+
+
+def resumir_serie(serie_id):
     """
-    API para analizar datos de gráficos usando Gemini.
-    Recibe datos JSON del frontend, los procesa y devuelve un análisis.
+    Resumen compacto de una serie del dashboard: por sensor (tendencia, extremos, medias
+    mensuales, huecos) y correlaciones entre sensores. Cacheado por versión del archivo.
     """
-    # Verificar si el cliente de Gemini está configurado
-    if not genai_client or not MODEL_NAME:
-        return jsonify({
-                           'error': 'Servicio de análisis IA no disponible. Clave API no configurada o cliente no inicializado.'}), 503
+    filename, data_type = SERIES_DASHBOARD[serie_id]
+    entrada = obtener_entrada_dataset(filename)
+    if entrada is None or entrada['df'].index.name != 'Fecha':
+        return None
+    cache = _RESUMENES.get(serie_id)
+    acierto = cache is not None and cache['version'] == entrada['hash']
+    registrar_cache('resumenes', acierto)
+    if acierto:
+        return cache['resumen']
+
+    df = entrada['df']
+    sensores = {col: _resumir_sensor(df[col]) for col in df.columns}
+    correlaciones = []
+    if len(df.columns) > 1:
+        matriz = matriz_correlaciones(df.to_numpy(dtype=float))
+        for i in range(len(df.columns)):
+            for j in range(i + 1, len(df.columns)):
+                if matriz['n'][i, j] >= 5 and not np.isnan(matriz['pearson'][i, j]):
+                    correlaciones.append((df.columns[i], df.columns[j], float(matriz['pearson'][i, j]), int(matriz['n'][i, j])))
+
+    resumen = {'tipo': data_type, 'sensores': sensores, 'correlaciones': correlaciones}
+    _RESUMENES[serie_id] = {'version': entrada['hash'], 'resumen': resumen}
+    return resumen
+
+
+def _texto_resumen_serie(resumen):
+    """Texto compacto para el prompt a partir de resumir_serie()"""
+    lineas = [f"Variable: {resumen['tipo']}"]
+    for sensor, r in resumen['sensores'].items():
+        if r is None:
+            lineas.append(f"- Sensor {sensor}: sin datos")
+            continue
+        lineas.append(f"- Sensor {sensor}: {r['n']} registros ({r['periodo']}), media {r['media']:.2f}")
+        if 'tendencia_anual' in r:
+            lineas.append(f"  Tendencia lineal: {r['tendencia_anual']:+.3f} por año")
+        lineas.append(f"  Máximo {r['maximo'][0]:.2f} ({r['maximo'][1]}), mínimo {r['minimo'][0]:.2f} ({r['minimo'][1]})")
+        lineas.append("  Media por mes: " + ", ".join(
+            f"{MESES_ABREV[mes - 1]} {valor:.2f}" for mes, valor in r['medias_mensuales'].items()))
+        huecos = r['huecos']
+        texto_huecos = f"  Huecos: {huecos['faltantes']} {huecos['unidad']} sin dato"
+        if 'mayor' in huecos:
+            texto_huecos += f" (el mayor, de {huecos['mayor'][0]} {huecos['unidad']}, después de {huecos['mayor'][1]})"
+        lineas.append(texto_huecos)
+    if resumen['correlaciones']:
+        lineas.append("Correlación de Pearson entre sensores: " + "; ".join(
+            f"{a}-{b} r={r:.2f} (n={n})" for a, b, r, n in resumen['correlaciones']))
+    return "\n".join(lineas)
+
+
+def _texto_resumen_par(estacion, var_x, var_y):
+    """Texto compacto para el prompt con las estadísticas del par de correlación"""
+    datos = obtener_par_alineado(estacion, var_x, var_y)
+    if datos is None or len(datos['Fecha']) == 0:
+        return None
+    resultado = analizar_relacion(datos, var_x, var_y)
+    if 'error' in resultado:
+        return None
+    e = resultado['estadisticas']
+    fechas = pd.DatetimeIndex(datos['Fecha'])
+    lineas = [
+        f"Relación {ETIQUETA_VARIABLE[var_x]} -> {ETIQUETA_VARIABLE[var_y]} en {estacion.capitalize()}: "
+        f"{e['total_puntos']} pares ({fechas[0]:%Y-%m} a {fechas[-1]:%Y-%m})",
+        f"Pearson r={e['correlacion_pearson']:.3f} (p={e['p_valor_pearson']:.3g}), "
+        f"Spearman rho={e['correlacion_spearman']:.3f} (p={e['p_valor_spearman']:.3g})",
+        f"Regresión lineal: {e['regresion_lineal']['ecuacion']}, R²={e['regresion_lineal']['r2']:.3f}",
+    ]
+    if 'regresion_polinomica' in e:
+        lineas.append(f"Regresión cuadrática: {e['regresion_polinomica']['ecuacion']}, R²={e['regresion_polinomica']['r2']:.3f}")
+    if var_x == 'precipitacion':
+        lag = calcular_lag_correlacion(estacion, var_y)
+        if lag and lag['mejor_lag']:
+            mejor = lag['mejor_lag']
+            lineas.append(f"Mayor correlación con retardo: {mejor['lag']} {lag['unidad_lag']} (r={mejor['correlacion']:.3f})")
+    return "\n".join(lineas)
+
+
+def resumen_grafico(grafico_id):
+    """Resumen estadístico en texto del gráfico conocido `grafico_id`, o None si no se puede calcular"""
+    grafico = GRAFICOS_ANALISIS.get(grafico_id)
+    if grafico is None:
+        return None
+    if 'serie' in grafico:
+        resumen = resumir_serie(grafico['serie'])
+        return _texto_resumen_serie(resumen) if resumen else None
+    return _texto_resumen_par(*grafico['par'])
+
+
+# === Caché persistente de análisis IA (SQLite, direccionada por contenido) ===
+# Subir PROMPT_VERSION cada vez que cambie el texto del prompt para no reutilizar análisis viejos
+PROMPT_VERSION = 2
+ANALISIS_CACHE_DB = os.getenv('HIDRO_ANALISIS_CACHE_DB', 'analisis_cache.sqlite3')
+ANALISIS_CACHE_TTL = int(os.getenv('HIDRO_ANALISIS_CACHE_TTL', 7 * 24 * 3600))  # segundos
+ANALISIS_CACHE_MAX = int(os.getenv('HIDRO_ANALISIS_CACHE_MAX', 1000))  # entradas (LRU)
+_ANALISIS_CACHE_LOCK = threading.Lock()
+_analisis_cache_lista = False
+
+
+def clave_analisis(modelo, grafico_id, seccion, datos, contexto):
+    """
+    Hash SHA-256 del contenido que determina el análisis: modelo, versión del prompt y las
+    entradas normalizadas (JSON canónico con claves ordenadas, contexto sin espacios extremos).
+    `datos` es el texto de datos ya armado para el prompt.
+    """
+    canonico = json.dumps(
+        [modelo, PROMPT_VERSION, grafico_id, seccion, datos, (contexto or '').strip()],
+        sort_keys=True, separators=(',', ':'), ensure_ascii=False
+    )
+    return hashlib.sha256(canonico.encode('utf-8')).hexdigest()
+
+
+def _conexion_cache_analisis():
+    """Abre una conexión nueva (una por operación, así es segura entre hilos) y crea la tabla"""
+    global _analisis_cache_lista
+    conexion = sqlite3.connect(ANALISIS_CACHE_DB, timeout=5)
+    if not _analisis_cache_lista:
+        with _ANALISIS_CACHE_LOCK:
+            conexion.execute("PRAGMA journal_mode=WAL")
+            conexion.execute(
+                "CREATE TABLE IF NOT EXISTS analisis ("
+                " clave TEXT PRIMARY KEY, texto TEXT NOT NULL,"
+                " creado REAL NOT NULL, ultimo_acceso REAL NOT NULL)"
+            )
+            conexion.execute("CREATE INDEX IF NOT EXISTS analisis_acceso ON analisis (ultimo_acceso)")
+            conexion.commit()
+            _analisis_cache_lista = True
+    return conexion
+
 
+def leer_analisis_cacheado(clave):
+    """Devuelve el análisis guardado para `clave` si existe y no expiró, o None"""
     try:
-        # Obtener los datos JSON del cuerpo de la solicitud
-        data = request.get_json()
-        if not genai_client or not MODEL_NAME:
-            return jsonify({'error': 'No se recibieron datos en el cuerpo de la solicitud.'}), 400
-
-        # Extraer información del JSON
-        grafico_id = data.get('grafico_id')  # Ej: 'precipitacionChart'
-        seccion = data.get('seccion')  # Ej: 'precipitacion'
-        datos = data.get('datos')  # Datos del gráfico { labels: [...], datasets: [...] }
-        contexto = data.get('contexto', '')  # Información adicional opcional del usuario
-
-        if not grafico_id or not seccion or not datos:
-            return jsonify({'error': 'Datos incompletos. Se requieren grafico_id, seccion y datos.'}), 400
-
-        # 1. Formatear los datos para el prompt
-        # Creamos una representación de texto estructurada de los datos del gráfico
-        datos_texto = f"Datos del gráfico '{grafico_id}' (Sección: {seccion}):\n"
-        datos_texto += f"Fechas (Eje X): {datos.get('labels', [])}\n"
-        datos_texto += "Series de Datos (Eje Y):\n"
-        for dataset in datos.get('datasets', []):
-            datos_texto += f"  - {dataset.get('label', 'Serie sin nombre')}: {dataset.get('data', [])}\n"
+        conexion = _conexion_cache_analisis()
+        try:
+            ahora = time.time()
+            fila = conexion.execute(
+                "SELECT texto FROM analisis WHERE clave = ? AND creado >= ?",
+                (clave, ahora - ANALISIS_CACHE_TTL)
+            ).fetchone()
+            registrar_cache('analisis', fila is not None)
+            if fila is None:
+                return None
+            with conexion:
+                conexion.execute("UPDATE analisis SET ultimo_acceso = ? WHERE clave = ?", (ahora, clave))
+            return fila[0]
+        finally:
+            conexion.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ Caché de análisis no disponible: {e}")
+        return None
+
+
+def guardar_analisis(clave, texto):
+    """Guarda el análisis y aplica la expiración por TTL y el desalojo LRU"""
+    try:
+        conexion = _conexion_cache_analisis()
+        try:
+            ahora = time.time()
+            with conexion:
+                conexion.execute(
+                    "INSERT OR REPLACE INTO analisis (clave, texto, creado, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                    (clave, texto, ahora, ahora)
+                )
+                conexion.execute("DELETE FROM analisis WHERE creado < ?", (ahora - ANALISIS_CACHE_TTL,))
+                conexion.execute(
+                    "DELETE FROM analisis WHERE clave IN ("
+                    " SELECT clave FROM analisis ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?)",
+                    (ANALISIS_CACHE_MAX,)
+                )
+        finally:
+            conexion.close()
+    except sqlite3.Error as e:
+        print(f"⚠️ No se pudo guardar el análisis en caché: {e}")
+
+
+# --- Límite de concurrencia de las llamadas al modelo ---
+# Las llamadas al modelo (trabajos en cola, streaming y síncronas) comparten un cupo acotado:
+# cuando se llena se responde 429 en lugar de ocupar más hilos del servidor y dejar sin
+# atender a las rutas de datos. El modelo siempre corre en el pool de análisis; las rutas
+# síncrona y de streaming solo esperan su resultado, así que el cupo debe quedar por debajo
+# de los hilos de cada worker (HIDRO_THREADS, el mismo valor que usa gunicorn.conf.py).
+ANALISIS_MAX_PENDIENTES = int(os.getenv('HIDRO_ANALISIS_MAX_PENDIENTES', max(1, HILOS_POR_WORKER // 2)))
+if HILOS_POR_WORKER > 1 and ANALISIS_MAX_PENDIENTES >= HILOS_POR_WORKER:
+    print(f"⚠️ HIDRO_ANALISIS_MAX_PENDIENTES={ANALISIS_MAX_PENDIENTES} no deja hilos libres; se usará {HILOS_POR_WORKER - 1}.")
+    ANALISIS_MAX_PENDIENTES = HILOS_POR_WORKER - 1
+ANALISIS_TRABAJADORES = int(os.getenv('HIDRO_ANALISIS_TRABAJADORES', ANALISIS_MAX_PENDIENTES))
+if HILOS_POR_WORKER > 1 and SSE_MAX_SUSCRIPTORES + ANALISIS_MAX_PENDIENTES >= HILOS_POR_WORKER:
+    print(f"⚠️ Streams SSE ({SSE_MAX_SUSCRIPTORES}) y análisis IA ({ANALISIS_MAX_PENDIENTES}) pueden ocupar "
+          f"los {HILOS_POR_WORKER} hilos del worker; baja HIDRO_SSE_MAX_SUSCRIPTORES o HIDRO_ANALISIS_MAX_PENDIENTES.")
+ANALISIS_TIMEOUT = float(os.getenv('HIDRO_ANALISIS_TIMEOUT', 60))  # segundos por análisis
+_CUPO_ANALISIS = threading.BoundedSemaphore(ANALISIS_MAX_PENDIENTES)
+MENSAJE_SATURADO = 'Hay demasiados análisis en curso. Inténtalo de nuevo en unos segundos.'
+MENSAJE_TIMEOUT = f"El análisis superó {ANALISIS_TIMEOUT:g} s"
+
+
+def _enviar_con_cupo(funcion, *args, **kwargs):
+    """
+    Envía al pool de análisis una llamada que ya tomó el cupo. El cupo se devuelve cuando la
+    llamada termina en el pool (o se cancela sin empezar), no cuando termina la petición:
+    un 504 o un cliente desconectado no detienen una llamada en curso al modelo.
+    """
+    try:
+        futuro = obtener_pool_analisis().submit(funcion, *args, **kwargs)
+    except Exception:
+        _CUPO_ANALISIS.release()
+        raise
+    futuro.add_done_callback(lambda _: _CUPO_ANALISIS.release())
+    return futuro
+
+
+# Análisis idénticos (misma clave_analisis) pedidos mientras el modelo todavía genera comparten
+# esa generación, sea cual sea la ruta (síncrona, streaming o trabajo): solo la primera petición
+# toma el cupo y llama al modelo; las demás siguen sus fragmentos. Al terminar, el texto se
+# guarda en la caché SQLite y la generación deja de compartirse.
+_GENERACIONES = {}  # clave_analisis -> _Generacion en curso
+_GENERACIONES_LOCK = threading.Lock()
+
+
+class _Generacion:
+    """Fragmentos de una llamada al modelo en curso y su resultado, para todos los que la esperan"""
+
+    def __init__(self, clave):
+        self.clave = clave
+        self.fragmentos = []
+        self.error = None
+        self.iniciada = False
+        self.terminada = False
+        self.interesados = 1
+        self.cancelado = threading.Event()
+        self._condicion = threading.Condition()
+        self._al_terminar = []
+
+    def agregar(self, texto):
+        with self._condicion:
+            self.fragmentos.append(texto)
+            self._condicion.notify_all()
+
+    def terminar(self, error=None):
+        with self._condicion:
+            self.error = error
+            self.terminada = True
+            self._condicion.notify_all()
+            avisos, self._al_terminar = self._al_terminar, []
+        for aviso in avisos:
+            aviso(self)
+
+    def al_terminar(self, aviso):
+        """Llama a aviso(generacion) al terminar (o ya mismo si terminó)"""
+        with self._condicion:
+            if not self.terminada:
+                self._al_terminar.append(aviso)
+                return
+        aviso(self)
+
+    def texto(self):
+        return ''.join(self.fragmentos).strip()
+
+    def seguir(self, limite):
+        """
+        Devuelve los fragmentos desde el primero hasta el final de la generación. Relanza el error
+        del modelo y lanza TimeoutError si se alcanza `limite` (time.monotonic()) antes de terminar.
+        """
+        leidos = 0
+        while True:
+            with self._condicion:
+                while leidos == len(self.fragmentos) and not self.terminada:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        raise TimeoutError(MENSAJE_TIMEOUT)
+                    self._condicion.wait(restante)
+                nuevos = self.fragmentos[leidos:]
+                terminada = self.terminada
+            leidos += len(nuevos)
+            yield from nuevos
+            if terminada:
+                break
+        if self.error is not None:
+            raise self.error
+
+    def soltar(self):
+        """Un interesado deja de esperar; si era el último y no terminó, se cancela la generación"""
+        with _GENERACIONES_LOCK:
+            self.interesados -= 1
+            if self.interesados > 0 or self.terminada:
+                return
+            self.cancelado.set()
+            if _GENERACIONES.get(self.clave) is self:
+                del _GENERACIONES[self.clave]
+
+
+def _producir_generacion(generacion, llm, prompt):
+    """
+    Corre en el pool de análisis: publica los fragmentos del backend en la generación, guarda el
+    texto en la caché y la da por terminada. Si todos los interesados se van, cierra el stream.
+    """
+    generacion.iniciada = True
+    stream = None
+    error = None
+    try:
+        stream = llm.generar_stream(prompt, timeout=ANALISIS_TIMEOUT)
+        for texto in stream:
+            if generacion.cancelado.is_set():
+                break
+            generacion.agregar(texto)
+        else:
+            if generacion.texto():
+                # Antes de dejar de compartirla, para que quien llegue después la encuentre en caché
+                guardar_analisis(generacion.clave, generacion.texto())
+    except Exception as e:
+        error = e
+    finally:
+        if stream is not None:
+            stream.close()
+        with _GENERACIONES_LOCK:
+            if _GENERACIONES.get(generacion.clave) is generacion:
+                del _GENERACIONES[generacion.clave]
+        generacion.terminar(error)
+
 
-        # 2. Crear el prompt para Gemini
-        prompt = f"""
+def unirse_a_generacion(llm, clave, prompt):
+    """
+    Devuelve la generación en curso para `clave` (sumándose como interesado) o inicia una nueva
+    tomando el cupo. Devuelve None si hay que iniciarla y el cupo está lleno. Quien la recibe
+    debe llamar a soltar() cuando deja de esperarla.
+    """
+    with _GENERACIONES_LOCK:
+        generacion = _GENERACIONES.get(clave)
+        nueva = generacion is None
+        if not nueva:
+            generacion.interesados += 1
+        elif _CUPO_ANALISIS.acquire(blocking=False):
+            generacion = _GENERACIONES[clave] = _Generacion(clave)
+        else:
+            return None
+    registrar_cache('analisis_compartido', not nueva)
+    if nueva:
+        try:
+            _enviar_con_cupo(_producir_generacion, generacion, llm, prompt)
+        except Exception as e:
+            with _GENERACIONES_LOCK:
+                _GENERACIONES.pop(clave, None)
+            generacion.terminar(e)
+            raise
+    return generacion
+
+
+MENSAJE_SIN_ANALISIS = ("Lo siento, el modelo de IA no pudo generar un análisis para estos datos en este momento, "
+                        "o la respuesta no contenía texto. Por favor, inténtalo de nuevo más tarde.")
+
+
+def construir_prompt(datos_texto, contexto):
+    """Prompt de Gemini para el análisis de un gráfico (subir PROMPT_VERSION si cambia)"""
+    return f"""
         Eres un experto hidrólogo analizando datos de un dashboard sobre el Volcán Antisana.
 
         CONTEXTUALIZACIÓN:
@@ -328,747 +1860,993 @@ def api_analizar():
         {contexto if contexto else 'Ninguno proporcionado.'}
         """
 
-        # 3. Llamar a la API de Gemini usando la nueva sintaxis
-        # Usamos models.generate_content en lugar de model.generate_content
-        response = genai_client.models.generate_content(
-            model=MODEL_NAME,
-            contents=prompt  # El texto del prompt va aquí
-        )
-
-        # 4. Extraer el texto de la respuesta
-        # La estructura de la respuesta también puede ser ligeramente diferente
-        if hasattr(response, 'text') and response.text:
-            analisis_texto = response.text.strip()
-        else:
-            # Manejar el caso de una respuesta vacía o inesperada
-            # Puede que la respuesta tenga una estructura como response.candidates[0].content.parts[0].text
-            # o simplemente no tenga texto. Es mejor manejarlo con cuidado.
-            # print(f"Respuesta inesperada de Gemini: {response}") # Para depuración
-            candidate = getattr(response, 'candidates', [None])[0]
-            content = getattr(candidate, 'content', None)
-            part = getattr(content, 'parts', [None])[0]
-            analisis_texto = getattr(part, 'text', None)
-
-            if not analisis_texto:
-                analisis_texto = "Lo siento, el modelo de IA no pudo generar un análisis para estos datos en este momento, o la respuesta no contenía texto. Por favor, inténtalo de nuevo más tarde."
-            else:
-                analisis_texto = analisis_texto.strip()
 
-        # 5. Devolver la respuesta al frontend
-        return jsonify({'analisis': analisis_texto})
+def preparar_analisis(data):
+    """
+    Valida el cuerpo JSON de /api/analizar y arma el texto de datos y el prompt.
+    Devuelve (clave de caché, prompt); lanza ValueError con el mensaje para el cliente (400).
+    """
+    if not data:
+        raise ValueError('No se recibieron datos en el cuerpo de la solicitud.')
+
+    # Extraer información del JSON
+    grafico_id = data.get('grafico_id')  # Ej: 'precipitacionChart'
+    seccion = data.get('seccion')  # Ej: 'precipitacion'
+    datos = data.get('datos')  # Opcional para gráficos conocidos: { labels: [...], datasets: [...] }
+    contexto = data.get('contexto', '')  # Información adicional opcional del usuario
+
+    if not grafico_id or not seccion:
+        raise ValueError('Datos incompletos. Se requieren grafico_id y seccion.')
+
+    # 1. Formatear los datos para el prompt
+    # Gráficos conocidos: resumen estadístico calculado aquí con los datasets cacheados
+    resumen = resumen_grafico(grafico_id)
+    if resumen is not None:
+        datos_texto = f"Resumen estadístico del gráfico '{grafico_id}' (Sección: {seccion}):\n{resumen}\n"
+    elif datos:
+        # Gráfico desconocido: representación de texto de los datos enviados por el cliente
+        datos_texto = f"Datos del gráfico '{grafico_id}' (Sección: {seccion}):\n"
+        datos_texto += f"Fechas (Eje X): {datos.get('labels', [])}\n"
+        datos_texto += "Series de Datos (Eje Y):\n"
+        for dataset in datos.get('datasets', []):
+            datos_texto += f"  - {dataset.get('label', 'Serie sin nombre')}: {dataset.get('data', [])}\n"
+    else:
+        raise ValueError(f"Gráfico '{grafico_id}' desconocido: se requieren sus datos.")
+
+    # 2. Clave de caché: el texto de datos ya depende del contenido de los archivos
+    clave = clave_analisis(obtener_llm().nombre, grafico_id, seccion, datos_texto, contexto)
+    return clave, construir_prompt(datos_texto, contexto)
+
+
+@app.route('/api/analizar', methods=['POST'])
+def api_analizar():
+    """
+    API para analizar datos de gráficos usando Gemini.
+    Recibe datos JSON del frontend, los procesa y devuelve un análisis.
+    """
+    # Verificar si el backend de IA está configurado
+    llm = obtener_llm()
+    if llm is None:
+        return jsonify({
+                           'error': 'Servicio de análisis IA no disponible. Clave API no configurada o cliente no inicializado.'}), 503
 
-    except genai.api_types.ApiError as api_err:  # Capturar errores específicos de la API
-        app.logger.error(f"Error de API de Gemini en /api/analizar: {api_err}")
+    try:
+        try:
+            clave, prompt = preparar_analisis(request.get_json(silent=True))
+        except ValueError as ve:
+            return jsonify({'error': str(ve)}), 400
+
+        # Mismo modelo, prompt y entradas -> mismo análisis: responder desde la caché persistente
+        analisis_cacheado = leer_analisis_cacheado(clave)
+        if analisis_cacheado is not None:
+            return jsonify({'analisis': analisis_cacheado, 'cache': True})
+
+        # 3. Llamar al modelo dentro del cupo, o sumarse a la misma generación si ya está en curso
+        generacion = unirse_a_generacion(llm, clave, prompt)
+        if generacion is None:
+            return jsonify({'error': MENSAJE_SATURADO}), 429
+        try:
+            for _ in generacion.seguir(time.monotonic() + ANALISIS_TIMEOUT):
+                pass
+        except TimeoutError:
+            return jsonify({'error': MENSAJE_TIMEOUT}), 504
+        finally:
+            generacion.soltar()
+        analisis_texto = generacion.texto()
+
+        # 4. Sin texto en la respuesta (no se guardó en caché: el próximo intento vuelve a consultar al modelo)
+        if not analisis_texto:
+            return jsonify({'analisis': MENSAJE_SIN_ANALISIS, 'cache': False})
+
+        # 5. Devolver la respuesta al frontend (la generación ya la guardó en caché)
+        return jsonify({'analisis': analisis_texto, 'cache': False})
+
+    except ErrorLLM as api_err:  # Capturar errores específicos de la API
+        app.logger.error(f"Error del backend de IA en /api/analizar: {api_err}")
         return jsonify({
-                           'error': f'Error al comunicarse con la API de Gemini: {str(api_err)}'}), 502  # Bad Gateway indica problema upstream
+                           'error': f'Error al comunicarse con el servicio de IA: {str(api_err)}'}), 502  # Bad Gateway indica problema upstream
     except Exception as e:
         # Registrar el error en el servidor para depuración
         app.logger.error(f"Error en /api/analizar: {e}")
         # Devolver un mensaje de error genérico al usuario
         return jsonify({'error': 'Ocurrió un error interno en el servidor al procesar la solicitud de análisis.'}), 500
 
-# === Funciones para análisis de correlación caudal-nivel ===
-
-def load_level_flow_data():
-    """Cargar datos de caudal y nivel para ambas estaciones"""
-    try:
-        caudal_papallacta = safe_read_csv('caudal_papallacta.csv')
-        nivel_papallacta = safe_read_csv('nivel_papallacta.csv')
-        caudal_quijos = safe_read_csv('caudal_quijos.csv')
-        nivel_quijos = safe_read_csv('nivel_quijos.csv')
-        return caudal_papallacta, nivel_papallacta, caudal_quijos, nivel_quijos
-    except Exception as e:
-        print(f"❌ Error cargando datos para correlación: {e}")
-        return None, None, None, None
 
-def prepare_station_data(caudal_data, nivel_data, station_name):
-    """Preparar datos alineados por fecha para una estación"""
-    try:
-        # Procesar caudal - promedio de todas las estaciones
-        caudal_cols = [col for col in caudal_data.columns if col != 'Fecha']
-        if caudal_cols:
-            caudal_data['Caudal_Prom'] = caudal_data[caudal_cols].mean(axis=1)
-        else:
-            # Si no hay columnas específicas, asumir que la segunda columna en adelante son datos
-            caudal_data['Caudal_Prom'] = caudal_data.select_dtypes(include=[np.number]).mean(axis=1)
+def evento_sse(evento, datos):
+    """Formatea un evento Server-Sent Events con datos JSON"""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
 
-        # Procesar nivel - promedio de todas las estaciones
-        nivel_cols = [col for col in nivel_data.columns if col != 'Fecha']
-        if nivel_cols:
-            nivel_data['Nivel_Prom'] = nivel_data[nivel_cols].mean(axis=1)
-        else:
-             # Si no hay columnas específicas, asumir que la segunda columna en adelante son datos
-            nivel_data['Nivel_Prom'] = nivel_data.select_dtypes(include=[np.number]).mean(axis=1)
-
-        # Asegurar que la columna 'Fecha' sea datetime
-        if 'Fecha' in caudal_data.columns:
-            caudal_data['Fecha'] = pd.to_datetime(caudal_data['Fecha'], errors='coerce')
-        if 'Fecha' in nivel_data.columns:
-            nivel_data['Fecha'] = pd.to_datetime(nivel_data['Fecha'], errors='coerce')
-
-        # Eliminar filas con NaT en Fecha
-        caudal_data = caudal_data.dropna(subset=['Fecha'])
-        nivel_data = nivel_data.dropna(subset=['Fecha'])
-
-        # Merge por fecha (inner join para fechas comunes)
-        if 'Fecha' in caudal_data.columns and 'Fecha' in nivel_data.columns:
-            merged_data = pd.merge(
-                caudal_data[['Fecha', 'Caudal_Prom']],
-                nivel_data[['Fecha', 'Nivel_Prom']],
-                on='Fecha',
-                how='inner'
-            )
-            # Ordenar por fecha
-            merged_data = merged_data.sort_values('Fecha').reset_index(drop=True)
-        else:
-            # Si no hay fechas, alinear por índice (como en el script original)
-            min_len = min(len(caudal_data), len(nivel_data))
-            merged_data = pd.DataFrame({
-                'Caudal_Prom': caudal_data['Caudal_Prom'].iloc[:min_len].reset_index(drop=True),
-                'Nivel_Prom': nivel_data['Nivel_Prom'].iloc[:min_len].reset_index(drop=True)
-            })
 
-        # Eliminar filas con NaN en los valores promedio
-        merged_data = merged_data.dropna(subset=['Caudal_Prom', 'Nivel_Prom'])
-
-        print(f"📊 Datos alineados para {station_name}: {len(merged_data)} registros")
-        return merged_data
+@app.route('/api/analizar/stream', methods=['POST'])
+def api_analizar_stream():
+    """
+    Variante en streaming de /api/analizar: reenvía los fragmentos del modelo como eventos SSE
+    'fragmento' {texto} a medida que llegan y termina con 'fin' {cache} o 'error' {error}.
+    Si el cliente se desconecta y nadie más espera esa generación, se cierra el stream del
+    backend para no seguir generando.
+    """
+    llm = obtener_llm()
+    if llm is None:
+        return jsonify({
+                           'error': 'Servicio de análisis IA no disponible. Clave API no configurada o cliente no inicializado.'}), 503
+    try:
+        clave, prompt = preparar_analisis(request.get_json(silent=True))
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+
+    analisis_cacheado = leer_analisis_cacheado(clave)
+    generacion = None
+    if analisis_cacheado is None:
+        # Se inicia (o se comparte) ya: el pool es dueño del cupo aunque el generador nunca arranque
+        generacion = unirse_a_generacion(llm, clave, prompt)
+        if generacion is None:
+            return jsonify({'error': MENSAJE_SATURADO}), 429
+    limite = time.monotonic() + ANALISIS_TIMEOUT
+
+    def eventos():
+        if analisis_cacheado is not None:
+            yield evento_sse('fragmento', {'texto': analisis_cacheado})
+            yield evento_sse('fin', {'cache': True})
+            return
+
+        fragmentos = []
+        completo = False
+        try:
+            # El límite se revisa aunque el backend deje de enviar fragmentos
+            for texto in generacion.seguir(limite):
+                fragmentos.append(texto)
+                yield evento_sse('fragmento', {'texto': texto})
+            completo = True
+
+            # Con texto, la generación ya lo guardó en caché
+            if not generacion.texto():
+                yield evento_sse('fragmento', {'texto': MENSAJE_SIN_ANALISIS})
+            yield evento_sse('fin', {'cache': False})
+        except ErrorLLM as api_err:
+            app.logger.error(f"Error del backend de IA en /api/analizar/stream: {api_err}")
+            yield evento_sse('error', {'error': f'Error al comunicarse con el servicio de IA: {str(api_err)}'})
+        except TimeoutError as te:
+            yield evento_sse('error', {'error': str(te)})
+        except Exception as e:
+            app.logger.error(f"Error en /api/analizar/stream: {e}")
+            yield evento_sse('error', {'error': 'Ocurrió un error interno en el servidor al procesar la solicitud de análisis.'})
+        finally:
+            if not completo:
+                print(f"🛑 Stream de análisis interrumpido tras {len(fragmentos)} fragmentos")
+
+    response = app.response_class(stream_with_context(eventos()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    if generacion is not None:
+        # Al cerrar la respuesta (también si el generador nunca arrancó) se deja de esperar la
+        # generación; si nadie más la espera, se cancela en el backend
+        response.call_on_close(generacion.soltar)
+    return response
+
+
+# === Cola de trabajos de análisis IA ===
+# POST /api/analizar/trabajos responde de inmediato con un id; el análisis corre en un pool de
+# hilos acotado y el resultado se consulta con GET /api/analizar/trabajos/<id>.
+TRABAJOS_TTL = 15 * 60  # segundos que se conserva un trabajo terminado
+_TRABAJOS = {}
+_TRABAJOS_LOCK = threading.Lock()
+_pool_analisis = None
+
+
+def obtener_pool_analisis():
+    """ThreadPoolExecutor de análisis, creado la primera vez que se necesita"""
+    global _pool_analisis
+    with _TRABAJOS_LOCK:
+        if _pool_analisis is None:
+            _pool_analisis = ThreadPoolExecutor(max_workers=ANALISIS_TRABAJADORES, thread_name_prefix='analisis')
+        return _pool_analisis
+
+
+def _limpiar_trabajos(ahora):
+    """Descarta los trabajos terminados hace más de TRABAJOS_TTL (llamar con el lock tomado)"""
+    for id_trabajo in [i for i, t in _TRABAJOS.items() if t.get('terminado') and ahora - t['terminado'] > TRABAJOS_TTL]:
+        del _TRABAJOS[id_trabajo]
+
+
+def _actualizar_trabajo(id_trabajo, **cambios):
+    with _TRABAJOS_LOCK:
+        trabajo = _TRABAJOS.get(id_trabajo)
+        if trabajo is not None:
+            trabajo.update(cambios)
+
+
+def _registrar_fin_trabajo(id_trabajo, generacion):
+    """Copia al trabajo el resultado de la generación que esperaba"""
+    with _TRABAJOS_LOCK:
+        trabajo = _TRABAJOS.get(id_trabajo)
+        creado = trabajo['creado'] if trabajo is not None else time.time()
+    if generacion.error is None:
+        _actualizar_trabajo(id_trabajo, estado='completado', terminado=time.time(), generacion=None,
+                            analisis=generacion.texto() or MENSAJE_SIN_ANALISIS, cache=False)
+    else:
+        agotado = time.time() - creado >= ANALISIS_TIMEOUT
+        app.logger.error(f"Error en el trabajo de análisis {id_trabajo}: {generacion.error}")
+        _actualizar_trabajo(id_trabajo, estado='expirado' if agotado else 'error', terminado=time.time(), generacion=None,
+                            error=MENSAJE_TIMEOUT if agotado
+                            else f'Error al comunicarse con el servicio de IA: {str(generacion.error)}')
+    generacion.soltar()
+
+
+def _vista_trabajo(id_trabajo, trabajo):
+    """Representación JSON pública de un trabajo"""
+    estado = trabajo['estado']
+    if estado == 'en_cola' and trabajo['generacion'].iniciada:
+        estado = 'procesando'
+    vista = {'id': id_trabajo, 'estado': estado}
+    for campo in ('analisis', 'cache', 'error'):
+        if campo in trabajo:
+            vista[campo] = trabajo[campo]
+    return vista
+
+
+@app.route('/api/analizar/trabajos', methods=['POST'])
+def api_crear_trabajo_analisis():
+    """
+    Encola un análisis (mismo cuerpo que /api/analizar) y responde 202 con su id.
+    Responde 429 si ya hay ANALISIS_MAX_PENDIENTES análisis en cola o en curso.
+    """
+    llm = obtener_llm()
+    if llm is None:
+        return jsonify({
+                           'error': 'Servicio de análisis IA no disponible. Clave API no configurada o cliente no inicializado.'}), 503
+    try:
+        clave, prompt = preparar_analisis(request.get_json(silent=True))
+    except ValueError as ve:
+        return jsonify({'error': str(ve)}), 400
+
+    id_trabajo = uuid.uuid4().hex
+    ahora = time.time()
+    analisis_cacheado = leer_analisis_cacheado(clave)
+    generacion = None
+    if analisis_cacheado is not None:
+        trabajo = {'estado': 'completado', 'creado': ahora, 'terminado': ahora, 'analisis': analisis_cacheado, 'cache': True}
+    else:
+        generacion = unirse_a_generacion(llm, clave, prompt)
+        if generacion is None:
+            return jsonify({'error': MENSAJE_SATURADO}), 429
+        trabajo = {'estado': 'en_cola', 'creado': ahora, 'generacion': generacion}
+
+    with _TRABAJOS_LOCK:
+        _limpiar_trabajos(ahora)
+        _TRABAJOS[id_trabajo] = trabajo
+    if generacion is not None:
+        # El trabajo sigue interesado en la generación hasta que termina
+        generacion.al_terminar(lambda g: _registrar_fin_trabajo(id_trabajo, g))
+
+    respuesta = jsonify(_vista_trabajo(id_trabajo, trabajo))
+    respuesta.status_code = 202
+    respuesta.headers['Location'] = f'/api/analizar/trabajos/{id_trabajo}'
+    return respuesta
+
+
+@app.route('/api/analizar/trabajos/<id_trabajo>')
+def api_estado_trabajo_analisis(id_trabajo):
+    """Estado de un trabajo: en_cola, procesando, completado (con 'analisis'), error o expirado"""
+    with _TRABAJOS_LOCK:
+        trabajo = _TRABAJOS.get(id_trabajo)
+        if trabajo is None:
+            return jsonify({'error': 'Trabajo no encontrado o expirado.'}), 404
+        vista = _vista_trabajo(id_trabajo, trabajo)
+    return jsonify(vista)
+
+
+# === Series agregadas y pares alineados (caché inmutable) ===
+# Cada variable de una estación se reduce a una serie por fecha (suma de los pluviómetros o
+# promedio de los sensores) y cada par de variables se alinea por fecha una sola vez por
+# versión de los archivos fuente. Los arrays cacheados son de solo lectura.
+AGREGADO_VARIABLE = {
+    'precipitacion': 'suma',
+    'caudal': 'promedio',
+    'nivel': 'promedio',
+    'temperatura': 'promedio',
+}
+COLUMNA_VARIABLE = {
+    'precipitacion': 'Precip_Total',
+    'caudal': 'Caudal_Prom',
+    'nivel': 'Nivel_Prom',
+    'temperatura': 'Temperatura_Prom',
+}
+_SERIES_AGREGADAS = {}
+_PARES = {}
+_PARES_LOCK = threading.Lock()
+
+
+def _agregar_sensores(df, agregado):
+    """Suma o promedia las columnas de sensores por fila, ignorando NaN (como pandas con skipna)"""
+    valores = df.to_numpy(dtype=float)
+    validos = ~np.isnan(valores)
+    suma = np.where(validos, valores, 0.0).sum(axis=1)
+    if agregado == 'suma':
+        return suma
+    conteo = validos.sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(conteo > 0, suma / np.maximum(conteo, 1), np.nan)
+
+
+def _solo_lectura(arrays):
+    """Marca los arrays del dict como no escribibles y devuelve el dict"""
+    for arr in arrays.values():
+        arr.flags.writeable = False
+    return arrays
+
+
+def obtener_serie_agregada(variable, estacion):
+    """
+    Devuelve {'version', 'Fecha', 'valores'} de la variable agregada por fecha en la estación
+    (archivo '<variable>_<estacion>.csv'), o None si no hay datos.
+    """
+    entrada = obtener_entrada_dataset(f'{variable}_{estacion}.csv')
+    if entrada is None or entrada['df'].index.name != 'Fecha':
+        return None
+
+    clave = (variable, estacion)
+    serie = _SERIES_AGREGADAS.get(clave)
+    acierto = serie is not None and serie['version'] == entrada['hash']
+    registrar_cache('series_agregadas', acierto)
+    if acierto:
+        return serie
+
+    df = entrada['df']
+    arrays = _solo_lectura({
+        'Fecha': df.index.values,
+        'valores': _agregar_sensores(df, AGREGADO_VARIABLE[variable]),
+    })
+    serie = dict(arrays, version=entrada['hash'])
+    with _PARES_LOCK:
+        _SERIES_AGREGADAS[clave] = serie
+    return serie
 
-    except Exception as e:
-        print(f"❌ Error preparando datos para {station_name}: {e}")
-        return pd.DataFrame() # Devolver DataFrame vacío en caso de error
 
-def analyze_flow_level_relationship_for_api(data):
-    """Analizar relación caudal-nivel y preparar datos para API"""
-    if len(data) < 5:
-        return {"error": "Insuficientes datos para análisis"}
+def obtener_par_alineado(estacion, var_x, var_y):
+    """
+    Devuelve los arrays alineados por fecha del par de variables en la estación:
+    {'Fecha': ..., COLUMNA_VARIABLE[var_x]: ..., COLUMNA_VARIABLE[var_y]: ...}, sin NaN,
+    ordenados por fecha y de solo lectura. Devuelve None si falta alguno de los archivos.
+    """
+    serie_x = obtener_serie_agregada(var_x, estacion)
+    serie_y = obtener_serie_agregada(var_y, estacion)
+    if serie_x is None or serie_y is None:
+        return None
+    marcar_etapa('cargar')
+
+    clave = (estacion, var_x, var_y)
+    version = (serie_x['version'], serie_y['version'])
+    par = _PARES.get(clave)
+    acierto = par is not None and par['version'] == version
+    registrar_cache('pares_alineados', acierto)
+    if acierto:
+        marcar_etapa('alinear')
+        return dict(par['datos'])
+
+    # Inner join por fecha sobre índices ordenados (equivalente al pd.merge anterior)
+    fechas, idx_x, idx_y = np.intersect1d(serie_x['Fecha'], serie_y['Fecha'], return_indices=True)
+    x = serie_x['valores'][idx_x]
+    y = serie_y['valores'][idx_y]
+    validos = ~(np.isnan(x) | np.isnan(y))
+    datos = _solo_lectura({
+        'Fecha': fechas[validos],
+        COLUMNA_VARIABLE[var_x]: x[validos],
+        COLUMNA_VARIABLE[var_y]: y[validos],
+    })
+    print(f"📊 Datos alineados ({var_x}-{var_y}) para {estacion}: {len(datos['Fecha'])} registros")
+    marcar_etapa('alinear')
+
+    with _PARES_LOCK:
+        _PARES[clave] = {'version': version, 'datos': datos}
+    return dict(datos)
+
+
+# === Motor genérico de correlación entre variables ===
+ESTACIONES = ['papallacta', 'quijos']
+ETIQUETA_VARIABLE = {
+    'precipitacion': 'Precip',
+    'caudal': 'Caudal',
+    'nivel': 'Nivel',
+    'temperatura': 'Temperatura',
+}
+COLORES_CORRELACION = {
+    'observados': ("rgba(54, 162, 235, 0.6)", "rgba(54, 162, 235, 1)"),
+    'lineal': "rgba(255, 99, 132, 1)",
+    'polinomica': "rgba(75, 192, 192, 1)",
+}
+
+
+def analizar_relacion(data, var_x, var_y, polinomica=True, colores=COLORES_CORRELACION):
+    """
+    Analiza la relación var_x -> var_y sobre los arrays alineados de `data`: correlaciones
+    de Pearson y Spearman, regresión lineal y (opcional) cuadrática, y datos para Chart.js.
+    """
+    etiqueta_x, etiqueta_y = ETIQUETA_VARIABLE[var_x], ETIQUETA_VARIABLE[var_y]
+    x = data[COLUMNA_VARIABLE[var_x]]
+    y = data[COLUMNA_VARIABLE[var_y]]
 
-    caudal = data['Caudal_Prom'].values
-    nivel = data['Nivel_Prom'].values
-    fechas = data['Fecha'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist() # Convertir fechas a string
+    # Eliminar pares NaN/NaN
+    mask = ~(np.isnan(x) | np.isnan(y))
+    x, y = x[mask], y[mask]
+    if len(x) < 5:
+        return {"error": f"Insuficientes datos para análisis de {etiqueta_x}-{etiqueta_y}"}
 
-    # Correlaciones
+    # Cada etapa falla por separado: como en las rutas originales, un error deja sus campos
+    # en None (y sin su curva) en lugar de tumbar todo el gráfico
     try:
-        pearson_corr, pearson_p = stats.pearsonr(caudal, nivel)
-        spearman_corr, spearman_p = stats.spearmanr(caudal, nivel)
+        pearson_corr, pearson_p = modulo_stats().pearsonr(x, y)
+        spearman_corr, spearman_p = modulo_stats().spearmanr(x, y)
     except Exception as e:
-        print(f"⚠️ Error calculando correlaciones: {e}")
+        print(f"⚠️ Error calculando correlaciones {etiqueta_x}-{etiqueta_y}: {e}")
         pearson_corr, pearson_p, spearman_corr, spearman_p = None, None, None, None
 
-    # Regresión Lineal
-    try:
-        X_linear = nivel.reshape(-1, 1)
-        y_linear = caudal
-        linear_model = LinearRegression().fit(X_linear, y_linear)
-        linear_r2 = r2_score(y_linear, linear_model.predict(X_linear))
-        linear_equation = f"Caudal = {linear_model.coef_[0]:.4f} * Nivel + {linear_model.intercept_:.2f}"
-
-        # Preparar datos para la línea de regresión lineal (puntos extremos)
-        nivel_min, nivel_max = np.min(nivel), np.max(nivel)
-        caudal_linear_min = linear_model.predict(np.array([[nivel_min]]))[0]
-        caudal_linear_max = linear_model.predict(np.array([[nivel_max]]))[0]
-        linear_regression_line = {
-            'x': [nivel_min, nivel_max],
-            'y': [caudal_linear_min, caudal_linear_max]
+    fondo_observados, borde_observados = colores['observados']
+    datasets = [
+        {
+            "label": "Datos Observados",
+            "data": [{"x": float(a), "y": float(b)} for a, b in zip(x, y)],
+            "backgroundColor": fondo_observados,
+            "borderColor": borde_observados,
+            "borderWidth": 1,
+            "pointRadius": 3,
+            "showLine": False
         }
-    except Exception as e:
-        print(f"⚠️ Error en regresión lineal: {e}")
-        linear_r2, linear_equation, linear_regression_line = None, None, None
+    ]
+    x_sorted = np.sort(x)
 
-    # Regresión Polinómica (Cuadrática)
+    # Regresión Lineal
     try:
-        poly_features = PolynomialFeatures(degree=2)
-        X_poly = poly_features.fit_transform(nivel.reshape(-1, 1))
-        poly_model = LinearRegression().fit(X_poly, y_linear)
-        poly_r2 = r2_score(y_linear, poly_model.predict(X_poly))
-        # Crear puntos para la curva polinómica
-        nivel_sorted = np.sort(nivel)
-        X_poly_sorted = poly_features.transform(nivel_sorted.reshape(-1, 1))
-        caudal_poly_pred = poly_model.predict(X_poly_sorted)
-        polynomial_regression_curve = {
-            'x': nivel_sorted.tolist(),
-            'y': caudal_poly_pred.tolist()
+        extremos = x_sorted[[0, -1]]
+        linear_fit = ajustar_polinomio(x, y, grado=1)
+        intercepto, pendiente = linear_fit['coeficientes']
+        regresion_lineal = {
+            "r2": linear_fit['r2'],
+            "rmse": linear_fit['rmse'],
+            "ecuacion": f"{etiqueta_y} = {pendiente:.4f} * {etiqueta_x} + {intercepto:.2f}"
         }
-        # Formato simplificado de la ecuación (a*x^2 + b*x + c)
-        # coef_ es [intercept, x, x^2] para PolynomialFeatures
-        coefs = poly_model.coef_
-        intercept = poly_model.intercept_
-        poly_equation = f"Caudal = {coefs[2]:.4f}*Nivel² + {coefs[1]:.4f}*Nivel + {intercept:.2f}"
-    except Exception as e:
-        print(f"⚠️ Error en regresión polinómica: {e}")
-        poly_r2, poly_equation, polynomial_regression_curve = None, None, None
-
-    # Preparar datos para Chart.js
-    chartjs_data = {
-        "datasets": [
-            {
-                "label": "Datos Observados",
-                "data": [{"x": float(n), "y": float(c)} for n, c in zip(nivel, caudal)],
-                "backgroundColor": "rgba(54, 162, 235, 0.6)",
-                "borderColor": "rgba(54, 162, 235, 1)",
-                "borderWidth": 1,
-                "pointRadius": 3,
-                "showLine": False # Solo puntos para datos observados
-            }
-        ]
-    }
-
-    # Añadir línea de regresión lineal si existe
-    if linear_regression_line:
-         chartjs_data["datasets"].append({
-            "label": f"Regresión Lineal (R²={linear_r2:.3f})",
-            "data": [{"x": float(x), "y": float(y)} for x, y in zip(linear_regression_line['x'], linear_regression_line['y'])],
-            "borderColor": "rgba(255, 99, 132, 1)",
+        datasets.append({
+            "label": f"Regresión Lineal (R²={linear_fit['r2']:.3f})",
+            # Una recta queda definida por sus extremos; no hace falta enviar un punto por dato
+            "data": [{"x": float(a), "y": float(b)}
+                     for a, b in zip(extremos, evaluar_polinomio(linear_fit['coeficientes'], extremos))],
+            "borderColor": colores['lineal'],
             "borderWidth": 2,
             "fill": False,
             "showLine": True,
-            "pointRadius": 0, # No mostrar puntos en la línea
-             "borderDash": [] # Línea continua
+            "pointRadius": 0,
+            "borderDash": []
         })
+    except Exception as e:
+        print(f"⚠️ Error en regresión lineal {etiqueta_x}-{etiqueta_y}: {e}")
+        regresion_lineal = None
 
-    # Añadir curva de regresión polinómica si existe
-    if polynomial_regression_curve:
-         chartjs_data["datasets"].append({
-            "label": f"Regresión Polinómica (R²={poly_r2:.3f})",
-            "data": [{"x": float(x), "y": float(y)} for x, y in zip(polynomial_regression_curve['x'], polynomial_regression_curve['y'])],
-            "borderColor": "rgba(75, 192, 192, 1)",
-            "borderWidth": 2,
-            "fill": False,
-            "showLine": True,
-            "pointRadius": 0, # No mostrar puntos en la curva
-            "tension": 0.4 # Suavizar la línea
-        })
-
-
-    # Preparar estadísticas para devolver
     stats_data = {
-        "total_puntos": len(data),
+        "total_puntos": len(x),
         "correlacion_pearson": pearson_corr,
         "p_valor_pearson": pearson_p,
         "correlacion_spearman": spearman_corr,
         "p_valor_spearman": spearman_p,
-        "regresion_lineal": {
-            "r2": linear_r2,
-            "ecuacion": linear_equation
-        } if linear_r2 is not None else None,
-        "regresion_polinomica": {
-            "r2": poly_r2,
-            "ecuacion": poly_equation
-        } if poly_r2 is not None else None
+        "regresion_lineal": regresion_lineal
     }
 
+    # Regresión Polinómica (Cuadrática)
+    if polinomica:
+        try:
+            poly_fit = ajustar_polinomio(x, y, grado=2)
+            c0, c1, c2 = poly_fit['coeficientes']
+            stats_data["regresion_polinomica"] = {
+                "r2": poly_fit['r2'],
+                "rmse": poly_fit['rmse'],
+                "ecuacion": f"{etiqueta_y} = {c2:.4f}*{etiqueta_x}² + {c1:.4f}*{etiqueta_x} + {c0:.2f}"
+            }
+            datasets.append({
+                "label": f"Regresión Polinómica (R²={poly_fit['r2']:.3f})",
+                "data": [{"x": float(a), "y": float(b)}
+                         for a, b in zip(x_sorted, evaluar_polinomio(poly_fit['coeficientes'], x_sorted))],
+                "borderColor": colores['polinomica'],
+                "borderWidth": 2,
+                "fill": False,
+                "showLine": True,
+                "pointRadius": 0,
+                "tension": 0.4
+            })
+        except Exception as e:
+            print(f"⚠️ Error en regresión polinómica {etiqueta_x}-{etiqueta_y}: {e}")
+            stats_data["regresion_polinomica"] = None
+
     return {
         "success": True,
         "estadisticas": stats_data,
-        "chartjs_data": chartjs_data # Datos formateados para Chart.js
+        "chartjs_data": {"datasets": datasets}
     }
 
-# === Fin de Funciones para análisis de correlación caudal-nivel ===
-@app.route('/api/correlacion/<estacion>')
-def api_correlacion(estacion):
-    """API para datos de correlación caudal-nivel"""
+
+# --- Intervalos de confianza bootstrap (ic=95&remuestreos=5000&semilla=0) ---
+BOOTSTRAP_MAX_REMUESTREOS = 20000
+BOOTSTRAP_BLOQUES = 8  # Fijo: el resultado depende de la semilla, no de cuántos procesos haya
+BOOTSTRAP_UMBRAL_POOL = 2_000_000  # remuestreos * pares a partir del cual se usa el pool
+_BOOTSTRAP = OrderedDict()
+_BOOTSTRAP_MAX = 128
+_BOOTSTRAP_LOCK = threading.Lock()
+_pool_bootstrap = None
+
+
+def obtener_pool_bootstrap():
+    """ProcessPoolExecutor compartido, creado la primera vez que se necesita"""
+    global _pool_bootstrap
+    with _BOOTSTRAP_LOCK:
+        if _pool_bootstrap is None:
+            procesos = int(os.getenv('HIDRO_BOOTSTRAP_PROCESOS', min(BOOTSTRAP_BLOQUES, os.cpu_count() or 1)))
+            # Los workers de gunicorn tienen varios hilos: hacer fork de un proceso con locks tomados
+            # por otros hilos (logging, SQLite, _EN_VUELO_LOCK) puede bloquear a los hijos. El
+            # forkserver arranca limpio y solo precarga las rutinas numéricas (no esta app).
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                contexto = multiprocessing.get_context('forkserver')
+                contexto.set_forkserver_preload(['analisis_numerico'])
+            else:
+                contexto = multiprocessing.get_context('spawn')
+            _pool_bootstrap = ProcessPoolExecutor(max_workers=procesos, mp_context=contexto)
+            print(f"🧵 Pool de bootstrap iniciado con {procesos} procesos")
+        return _pool_bootstrap
+
+
+def parametros_bootstrap(args):
+    """
+    Lee ic/remuestreos/semilla de la query. Devuelve None si no se pidió bootstrap
+    (no hay 'ic'), o (ic, remuestreos, semilla). Lanza ValueError con el mensaje para el cliente.
+    """
+    if 'ic' not in args:
+        return None
+    try:
+        ic = float(args.get('ic'))
+        remuestreos = int(args.get('remuestreos', 2000))
+        semilla = int(args.get('semilla', 0))
+    except (TypeError, ValueError):
+        raise ValueError("ic debe ser numérico; remuestreos y semilla deben ser enteros")
+    if not 0 < ic < 100:
+        raise ValueError("ic debe estar entre 0 y 100 (p. ej. 95)")
+    if not 1 <= remuestreos <= BOOTSTRAP_MAX_REMUESTREOS:
+        raise ValueError(f"remuestreos debe estar entre 1 y {BOOTSTRAP_MAX_REMUESTREOS}")
+    if semilla < 0:
+        raise ValueError("semilla debe ser >= 0")
+    return ic, remuestreos, semilla
+
+
+def calcular_bootstrap(estacion, var_x, var_y, datos, ic, remuestreos, semilla):
+    """
+    Intervalos bootstrap de r, pendiente y R² del par alineado. Cacheado por
+    (par, remuestreos, semilla, ic) y versión de los archivos; los lotes grandes van al pool.
+    """
+    version = (obtener_serie_agregada(var_x, estacion)['version'],
+               obtener_serie_agregada(var_y, estacion)['version'])
+    clave = (estacion, var_x, var_y, remuestreos, semilla, ic)
+    with _BOOTSTRAP_LOCK:
+        cache = _BOOTSTRAP.get(clave)
+        acierto = cache is not None and cache['version'] == version
+        registrar_cache('bootstrap', acierto)
+        if acierto:
+            _BOOTSTRAP.move_to_end(clave)
+            return cache['resultado']
+
+    x = datos[COLUMNA_VARIABLE[var_x]]
+    y = datos[COLUMNA_VARIABLE[var_y]]
+    ejecutor = obtener_pool_bootstrap() if remuestreos * len(x) >= BOOTSTRAP_UMBRAL_POOL else None
+    intervalos = bootstrap_regresion(x, y, remuestreos, semilla=semilla, ic=ic,
+                                     bloques=BOOTSTRAP_BLOQUES, ejecutor=ejecutor)
+    resultado = {"ic": ic, "remuestreos": remuestreos, "semilla": semilla, **intervalos}
+
+    with _BOOTSTRAP_LOCK:
+        _BOOTSTRAP[clave] = {'version': version, 'resultado': resultado}
+        while len(_BOOTSTRAP) > _BOOTSTRAP_MAX:
+            _BOOTSTRAP.popitem(last=False)
+    return resultado
+
+
+def responder_correlacion(estacion, var_x, var_y, **opciones):
+    """Valida la petición, obtiene el par alineado (cacheado), lo analiza y responde"""
     estacion = estacion.lower()
-    if estacion not in ['papallacta', 'quijos']:
+    if estacion not in ESTACIONES:
         return jsonify({"error": "Estación no válida. Usa 'papallacta' o 'quijos'."}), 400
+    for variable in (var_x, var_y):
+        if variable not in COLUMNA_VARIABLE:
+            return jsonify({"error": f"Variable '{variable}' no válida. Usa: {', '.join(COLUMNA_VARIABLE)}."}), 400
+    if var_x == var_y:
+        return jsonify({"error": "Las variables deben ser distintas."}), 400
+
+    try:
+        formato = formato_solicitado(request.args)
+        bootstrap = parametros_bootstrap(request.args)
+    except ValueError as ve:
+        return jsonify({"error": str(ve)}), 400
 
     try:
-        # 1. Cargar datos
-        caudal_papallacta, nivel_papallacta, caudal_quijos, nivel_quijos = load_level_flow_data()
-        if caudal_papallacta is None or nivel_papallacta is None or \
-           caudal_quijos is None or nivel_quijos is None:
-            return jsonify({"error": "Error al cargar los datos de caudal o nivel."}), 500
-
-        # 2. Seleccionar datos de la estación solicitada
-        if estacion == 'papallacta':
-            caudal_data = caudal_papallacta
-            nivel_data = nivel_papallacta
-            station_name = "Papallacta"
-        else: # quijos
-            caudal_data = caudal_quijos
-            nivel_data = nivel_quijos
-            station_name = "Quijos"
-
-        # 3. Preparar datos (alinear por fecha)
-        aligned_data = prepare_station_data(caudal_data, nivel_data, station_name)
-        if aligned_data.empty:
+        # 1. Obtener datos alineados por fecha (cacheados por versión de los archivos)
+        station_name = estacion.capitalize()
+        aligned_data = obtener_par_alineado(estacion, var_x, var_y)
+        if aligned_data is None or len(aligned_data['Fecha']) == 0:
             return jsonify({"error": f"No se encontraron datos alineados para {station_name}."}), 404
 
-        # 4. Analizar y preparar para API
-        result = analyze_flow_level_relationship_for_api(aligned_data)
+        # 2. Analizar y preparar para API
+        result = analizar_relacion(aligned_data, var_x, var_y, **opciones)
+        marcar_etapa('ajustar')
         if "error" in result:
-            return jsonify(result), 400 # Devolver error específico del análisis
+            return jsonify(result), 400
+
+        # 3. Intervalos de confianza bootstrap, si se pidieron
+        if bootstrap is not None:
+            result["estadisticas"]["bootstrap"] = calcular_bootstrap(estacion, var_x, var_y, aligned_data, *bootstrap)
+            marcar_etapa('bootstrap')
 
-        # 5. Añadir nombre de la estación al resultado
+        # 4. Añadir nombre de la estación al resultado
         result["estacion"] = station_name
-        return jsonify(result)
+        return responder_resultado(result, formato)
 
     except Exception as e:
-        print(f"Error en /api/correlacion/{estacion}: {e}")
+        print(f"Error en correlación {var_x}-{var_y}/{estacion}: {e}")
+        import traceback
+        traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al procesar {estacion}."}), 500
 
 
-# === Funciones para análisis de correlación Precipitación-Nivel ===
-
-def load_precip_level_data_for_api():
-    """Cargar datos de precipitación y nivel para ambas estaciones"""
-    try:
-        precip_papallacta = safe_read_csv('precipitacion_papallacta.csv')
-        nivel_papallacta = safe_read_csv('nivel_papallacta.csv')
-        precip_quijos = safe_read_csv('precipitacion_quijos.csv')
-        nivel_quijos = safe_read_csv('nivel_quijos.csv')
-        return precip_papallacta, nivel_papallacta, precip_quijos, nivel_quijos
-    except Exception as e:
-        print(f"❌ Error cargando datos para correlación Precipitación-Nivel: {e}")
-        return None, None, None, None
-
-
-def prepare_precip_level_data_for_api(precip_data, nivel_data, station_name):
-    """Preparar datos alineados por fecha para una estación (Precipitación-Nivel)"""
-    try:
-        # --- Procesar Precipitación ---
-        # Sumar todas las columnas de precipitación para obtener el total
-        precip_cols = [col for col in precip_data.columns if col != 'Fecha']
-        if precip_cols:
-            precip_data['Precip_Total'] = precip_data[precip_cols].sum(axis=1, skipna=True)
-        else:
-            print(
-                f"⚠️ No se encontraron columnas de precipitación específicas para {station_name}. Usando todas las numéricas.")
-            numeric_precip_cols = precip_data.select_dtypes(include=[np.number]).columns.tolist()
-            if numeric_precip_cols:
-                precip_data['Precip_Total'] = precip_data[numeric_precip_cols].sum(axis=1, skipna=True)
-            else:
-                raise ValueError(f"No hay datos numéricos de precipitación para {station_name}")
-
-        # --- Procesar Nivel ---
-        # Promediar todas las columnas de nivel
-        nivel_cols = [col for col in nivel_data.columns if col != 'Fecha']
-        if nivel_cols:
-            nivel_data['Nivel_Prom'] = nivel_data[nivel_cols].mean(axis=1, skipna=True)
-        else:
-            print(
-                f"⚠️ No se encontraron columnas de nivel específicas para {station_name}. Usando todas las numéricas.")
-            numeric_nivel_cols = nivel_data.select_dtypes(include=[np.number]).columns.tolist()
-            if numeric_nivel_cols:
-                nivel_data['Nivel_Prom'] = nivel_data[numeric_nivel_cols].mean(axis=1, skipna=True)
-            else:
-                raise ValueError(f"No hay datos numéricos de nivel para {station_name}")
-
-        # --- Asegurar que la columna 'Fecha' sea datetime ---
-        if 'Fecha' in precip_data.columns:
-            precip_data['Fecha'] = pd.to_datetime(precip_data['Fecha'], errors='coerce')
-        if 'Fecha' in nivel_data.columns:
-            nivel_data['Fecha'] = pd.to_datetime(nivel_data['Fecha'], errors='coerce')
-
-        # --- Eliminar filas con NaT en Fecha ---
-        precip_data = precip_data.dropna(subset=['Fecha']).reset_index(drop=True)
-        nivel_data = nivel_data.dropna(subset=['Fecha']).reset_index(drop=True)
-
-        # --- Merge por fecha (inner join para fechas comunes) ---
-        if 'Fecha' in precip_data.columns and 'Fecha' in nivel_data.columns:
-            merged_data = pd.merge(
-                precip_data[['Fecha', 'Precip_Total']],
-                nivel_data[['Fecha', 'Nivel_Prom']],
-                on='Fecha',
-                how='inner'
-            )
-            # Ordenar por fecha
-            merged_data = merged_data.sort_values('Fecha').reset_index(drop=True)
-        else:
-            # Si no hay fechas, alinear por índice (menos ideal)
-            min_len = min(len(precip_data), len(nivel_data))
-            merged_data = pd.DataFrame({
-                'Precip_Total': precip_data['Precip_Total'].iloc[:min_len].reset_index(drop=True),
-                'Nivel_Prom': nivel_data['Nivel_Prom'].iloc[:min_len].reset_index(drop=True)
-            })
+@app.route('/api/correlacion/<var_x>/<var_y>/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion_variables(var_x, var_y, estacion):
+    """
+    API genérica de correlación entre dos variables de una estación (x -> y).
+    Variables: precipitacion, caudal, nivel, temperatura. ?polinomica=0 omite el ajuste cuadrático.
+    """
+    polinomica = request.args.get('polinomica', '1') != '0'
+    return responder_correlacion(estacion, var_x.lower(), var_y.lower(), polinomica=polinomica)
 
-        # --- Eliminar filas con NaN en los valores calculados ---
-        initial_len = len(merged_data)
-        merged_data = merged_data.dropna(subset=['Precip_Total', 'Nivel_Prom']).reset_index(drop=True)
-        final_len = len(merged_data)
-        if initial_len != final_len:
-            print(f"ℹ️ Filas eliminadas por NaN en {station_name}: {initial_len - final_len}")
 
-        print(f"📊 Datos alineados y limpios (Precip-Nivel) para {station_name}: {len(merged_data)} registros")
-        return merged_data
+@app.route('/api/correlacion/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion(estacion):
+    """API para datos de correlación caudal-nivel"""
+    return responder_correlacion(estacion, 'nivel', 'caudal')
 
-    except Exception as e:
-        print(f"❌ Error preparando datos (Precip-Nivel) para {station_name}: {e}")
-        import traceback
-        traceback.print_exc()
-        return pd.DataFrame()
 
+@app.route('/api/correlacion_precip_nivel/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion_precip_nivel(estacion):
+    """API para datos de correlación precipitación-nivel"""
+    return responder_correlacion(estacion, 'precipitacion', 'nivel')
 
-def analyze_precip_level_relationship_for_api(data):
-    """Analizar relación precipitación-nivel y preparar datos para API"""
-    if len(data) < 5:
-        return {"error": "Insuficientes datos para análisis de Precipitación-Nivel"}
 
-    precip = data['Precip_Total'].values
-    nivel = data['Nivel_Prom'].values
-    fechas = data['Fecha'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist() if 'Fecha' in data.columns else None
+@app.route('/api/correlacion_precip_caudal/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion_precip_caudal(estacion):
+    """API para datos de correlación precipitación-caudal"""
+    return responder_correlacion(estacion, 'precipitacion', 'caudal', polinomica=False, colores={
+        'observados': ("rgba(153, 102, 255, 0.6)", "rgba(153, 102, 255, 1)"),  # Color púrpura
+        'lineal': "rgba(255, 159, 64, 1)",  # Color naranja
+    })
 
-    # Eliminar pares NaN/NaN
-    mask = ~(np.isnan(precip) | np.isnan(nivel))
-    precip_clean = precip[mask]
-    nivel_clean = nivel[mask]
 
-    if len(precip_clean) < 5:
-        return {"error": "Insuficientes datos válidos para análisis después de limpieza"}
+# === Matriz de correlaciones entre todos los sensores de una estación ===
+_MATRICES = {}
 
-    try:
-        # Correlaciones
-        pearson_corr, pearson_p = stats.pearsonr(precip_clean, nivel_clean)
-        spearman_corr, spearman_p = stats.spearmanr(precip_clean, nivel_clean)
-
-        # Regresión Lineal
-        linear_model = LinearRegression()
-        linear_model.fit(precip_clean.reshape(-1, 1), nivel_clean)
-        linear_r2 = r2_score(nivel_clean, linear_model.predict(precip_clean.reshape(-1, 1)))
-        linear_rmse = np.sqrt(mean_squared_error(nivel_clean, linear_model.predict(precip_clean.reshape(-1, 1))))
-        linear_equation = f"Nivel = {linear_model.coef_[0]:.4f} * Precip + {linear_model.intercept_:.2f}"
-
-        # Regresión Polinómica (Grado 2, como es común para este tipo de relación)
-        poly_features = PolynomialFeatures(degree=2)
-        X_poly = poly_features.fit_transform(precip_clean.reshape(-1, 1))
-        poly_model = LinearRegression()
-        poly_model.fit(X_poly, nivel_clean)
-        poly_r2 = r2_score(nivel_clean, poly_model.predict(X_poly))
-        poly_rmse = np.sqrt(mean_squared_error(nivel_clean, poly_model.predict(X_poly)))
-
-        # Crear puntos para las líneas de regresión
-        precip_sorted = np.sort(precip_clean)
-
-        # Línea lineal
-        nivel_linear_pred = linear_model.predict(precip_sorted.reshape(-1, 1))
-
-        # Curva polinómica
-        X_poly_sorted = poly_features.transform(precip_sorted.reshape(-1, 1))
-        nivel_poly_pred = poly_model.predict(X_poly_sorted)
 
-        # Preparar datos para Chart.js
-        chartjs_data = {
-            "datasets": [
-                {
-                    "label": "Datos Observados",
-                    "data": [{"x": float(p), "y": float(n)} for p, n in zip(precip_clean, nivel_clean)],
-                    "backgroundColor": "rgba(54, 162, 235, 0.6)",
-                    "borderColor": "rgba(54, 162, 235, 1)",
-                    "borderWidth": 1,
-                    "pointRadius": 3,
-                    "showLine": False
-                },
-                {
-                    "label": f"Regresión Lineal (R²={linear_r2:.3f})",
-                    "data": [{"x": float(p), "y": float(n)} for p, n in zip(precip_sorted, nivel_linear_pred)],
-                    "borderColor": "rgba(255, 99, 132, 1)",
-                    "borderWidth": 2,
-                    "fill": False,
-                    "showLine": True,
-                    "pointRadius": 0,
-                    "borderDash": []
-                },
-                {
-                    "label": f"Regresión Polinómica (R²={poly_r2:.3f})",
-                    "data": [{"x": float(p), "y": float(n)} for p, n in zip(precip_sorted, nivel_poly_pred)],
-                    "borderColor": "rgba(75, 192, 192, 1)",
-                    "borderWidth": 2,
-                    "fill": False,
-                    "showLine": True,
-                    "pointRadius": 0,
-                    "tension": 0.4
-                }
-            ]
-        }
+def _matriz_json(matriz):
+    """Convierte una matriz numérica a listas JSON con None en lugar de NaN"""
+    return [[None if np.isnan(v) else float(v) for v in fila] for fila in np.asarray(matriz, dtype=float)]
 
-        # Preparar estadísticas
-        stats_data = {
-            "total_puntos": len(precip_clean),
-            "correlacion_pearson": pearson_corr,
-            "p_valor_pearson": pearson_p,
-            "correlacion_spearman": spearman_corr,
-            "p_valor_spearman": spearman_p,
-            "regresion_lineal": {
-                "r2": linear_r2,
-                "rmse": linear_rmse,
-                "ecuacion": linear_equation
-            },
-            "regresion_polinomica": {
-                "r2": poly_r2,
-                "rmse": poly_rmse
-                # Coeficientes si se necesitan detallar más
-            }
-        }
 
-        return {
-            "success": True,
-            "estadisticas": stats_data,
-            "chartjs_data": chartjs_data
-        }
-
-    except Exception as e:
-        print(f"⚠️ Error en análisis Precipitación-Nivel: {e}")
-        import traceback
-        traceback.print_exc()
-        return {"error": f"Error al analizar relación Precipitación-Nivel: {str(e)}"}
+def calcular_matriz_correlacion(estacion):
+    """
+    Alinea por fecha todas las columnas de sensores de los archivos de la estación y calcula
+    Pearson y Spearman para cada par en una sola pasada. Cacheado por versión de los archivos.
+    """
+    entradas = {}
+    for variable in COLUMNA_VARIABLE:
+        filename = f'{variable}_{estacion}.csv'
+        if not os.path.isfile(filename):
+            continue  # No todas las estaciones miden todas las variables (p. ej. temperatura)
+        entrada = obtener_entrada_dataset(filename)
+        if entrada is not None and entrada['df'].index.name == 'Fecha' and len(entrada['df'].columns):
+            entradas[variable] = entrada
+    if not entradas:
+        return None
+    marcar_etapa('cargar')
+
+    version = tuple((variable, entrada['hash']) for variable, entrada in entradas.items())
+    cache = _MATRICES.get(estacion)
+    acierto = cache is not None and cache['version'] == version
+    registrar_cache('matrices', acierto)
+    if acierto:
+        return cache['resultado']
+
+    # Outer join por fecha; los sensores se nombran 'variable:sensor' (p. ej. H32 existe en caudal y nivel)
+    marcos = []
+    for variable, entrada in entradas.items():
+        df = entrada['df']
+        df = df[~df.index.duplicated()]
+        marcos.append(df.rename(columns=lambda col: f'{variable}:{col}'))
+    combinado = pd.concat(marcos, axis=1, join='outer').sort_index()
+    marcar_etapa('alinear')
+
+    matrices = matriz_correlaciones(combinado.to_numpy(dtype=float))
+    n = matrices['n']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        t = matrices['pearson'] * np.sqrt((n - 2) / (1 - matrices['pearson'] ** 2))
+    p_valor = 2 * modulo_stats().t.sf(np.abs(t), np.maximum(n - 2, 1))
+    p_valor[np.isnan(matrices['pearson'])] = np.nan
+
+    resultado = {
+        "success": True,
+        "estacion": estacion.capitalize(),
+        "sensores": combinado.columns.tolist(),
+        "n": n.tolist(),
+        "pearson": _matriz_json(matrices['pearson']),
+        "p_valor_pearson": _matriz_json(p_valor),
+        "spearman": _matriz_json(matrices['spearman']),
+    }
+    _MATRICES[estacion] = {'version': version, 'resultado': resultado}
+    marcar_etapa('ajustar')
+    return resultado
 
 
-# === Fin de Funciones para análisis de correlación Precipitación-Nivel ===
-@app.route('/api/correlacion_precip_nivel/<estacion>')
-def api_correlacion_precip_nivel(estacion):
-    """API para datos de correlación precipitación-nivel"""
+@app.route('/api/correlacion/matriz/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion_matriz(estacion):
+    """
+    API de matriz de correlaciones (Pearson y Spearman, NaN-aware) entre todos los sensores
+    de una estación. Spearman rankea cada par sobre sus filas con dato en ambos sensores.
+    """
     estacion = estacion.lower()
-    if estacion not in ['papallacta', 'quijos']:
+    if estacion not in ESTACIONES:
         return jsonify({"error": "Estación no válida. Usa 'papallacta' o 'quijos'."}), 400
-
     try:
-        # 1. Cargar datos
-        precip_papallacta, nivel_papallacta, precip_quijos, nivel_quijos = load_precip_level_data_for_api()
-        if precip_papallacta is None or nivel_papallacta is None or \
-           precip_quijos is None or nivel_quijos is None:
-            return jsonify({"error": "Error al cargar los datos de precipitación o nivel."}), 500
-
-        # 2. Seleccionar datos de la estación solicitada
-        if estacion == 'papallacta':
-            precip_data = precip_papallacta
-            nivel_data = nivel_papallacta
-            station_name = "Papallacta"
-        else: # quijos
-            precip_data = precip_quijos
-            nivel_data = nivel_quijos
-            station_name = "Quijos"
-
-        # 3. Preparar datos (alinear por fecha)
-        aligned_data = prepare_precip_level_data_for_api(precip_data, nivel_data, station_name)
-        if aligned_data.empty:
-            return jsonify({"error": f"No se encontraron datos alineados para {station_name}."}), 404
-
-        # 4. Analizar y preparar para API
-        result = analyze_precip_level_relationship_for_api(aligned_data)
-        if "error" in result:
-            return jsonify(result), 400
-
-        # 5. Añadir nombre de la estación al resultado
-        result["estacion"] = station_name
-        return jsonify(result)
-
+        resultado = calcular_matriz_correlacion(estacion)
+        if resultado is None:
+            return jsonify({"error": f"No se encontraron datos para {estacion.capitalize()}."}), 404
+        return jsonify(resultado)
     except Exception as e:
-        print(f"Error en /api/correlacion_precip_nivel/{estacion}: {e}")
+        print(f"Error en /api/correlacion/matriz/{estacion}: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al procesar {estacion}."}), 500
 
-# === Funciones para análisis de correlación Precipitación-Caudal ===
 
-def load_precip_flow_data_for_api():
-    """Cargar datos de precipitación y caudal para ambas estaciones"""
-    try:
-        precip_papallacta = safe_read_csv('precipitacion_papallacta.csv')
-        caudal_papallacta = safe_read_csv('caudal_papallacta.csv')
-        precip_quijos = safe_read_csv('precipitacion_quijos.csv')
-        caudal_quijos = safe_read_csv('caudal_quijos.csv')
-        return precip_papallacta, caudal_papallacta, precip_quijos, caudal_quijos
-    except Exception as e:
-        print(f"❌ Error cargando datos para correlación Precipitación-Caudal: {e}")
-        return None, None, None, None
+# === Correlación cruzada con retardo precipitación -> caudal/nivel ===
+LAG_MAX_DEFECTO = {'meses': 12, 'días': 365}
+_LAGS = {}
 
-def prepare_precip_flow_data_for_api(precip_data, caudal_data, station_name):
-    """Preparar datos alineados por fecha para una estación (Precipitación-Caudal)"""
-    try:
-        # --- Procesar Precipitación ---
-        # Sumar todas las columnas de precipitación para obtener el total
-        precip_cols = [col for col in precip_data.columns if col != 'Fecha']
-        if precip_cols:
-            precip_data['Precip_Total'] = precip_data[precip_cols].sum(axis=1, skipna=True)
-        else:
-            print(f"⚠️ No se encontraron columnas de precipitación específicas para {station_name}. Usando todas las numéricas.")
-            numeric_precip_cols = precip_data.select_dtypes(include=[np.number]).columns.tolist()
-            if numeric_precip_cols:
-                precip_data['Precip_Total'] = precip_data[numeric_precip_cols].sum(axis=1, skipna=True)
-            else:
-                raise ValueError(f"No hay datos numéricos de precipitación para {station_name}")
-
-        # --- Procesar Caudal ---
-        # Promediar todas las columnas de caudal
-        caudal_cols = [col for col in caudal_data.columns if col != 'Fecha']
-        if caudal_cols:
-            caudal_data['Caudal_Prom'] = caudal_data[caudal_cols].mean(axis=1, skipna=True)
-        else:
-            print(f"⚠️ No se encontraron columnas de caudal específicas para {station_name}. Usando todas las numéricas.")
-            numeric_caudal_cols = caudal_data.select_dtypes(include=[np.number]).columns.tolist()
-            if numeric_caudal_cols:
-                caudal_data['Caudal_Prom'] = caudal_data[numeric_caudal_cols].mean(axis=1, skipna=True)
-            else:
-                raise ValueError(f"No hay datos numéricos de caudal para {station_name}")
-
-        # --- Asegurar que la columna 'Fecha' sea datetime ---
-        if 'Fecha' in precip_data.columns:
-            precip_data['Fecha'] = pd.to_datetime(precip_data['Fecha'], errors='coerce')
-        if 'Fecha' in caudal_data.columns:
-            caudal_data['Fecha'] = pd.to_datetime(caudal_data['Fecha'], errors='coerce')
-
-        # --- Eliminar filas con NaT en Fecha ---
-        precip_data = precip_data.dropna(subset=['Fecha']).reset_index(drop=True)
-        caudal_data = caudal_data.dropna(subset=['Fecha']).reset_index(drop=True)
-
-        # --- Merge por fecha (inner join para fechas comunes) ---
-        if 'Fecha' in precip_data.columns and 'Fecha' in caudal_data.columns:
-            merged_data = pd.merge(
-                precip_data[['Fecha', 'Precip_Total']],
-                caudal_data[['Fecha', 'Caudal_Prom']],
-                on='Fecha',
-                how='inner'
-            )
-            # Ordenar por fecha
-            merged_data = merged_data.sort_values('Fecha').reset_index(drop=True)
-        else:
-            # Si no hay fechas, alinear por índice (menos ideal)
-            min_len = min(len(precip_data), len(caudal_data))
-            merged_data = pd.DataFrame({
-                'Precip_Total': precip_data['Precip_Total'].iloc[:min_len].reset_index(drop=True),
-                'Caudal_Prom': caudal_data['Caudal_Prom'].iloc[:min_len].reset_index(drop=True)
-            })
-
-        # --- Eliminar filas con NaN en los valores calculados ---
-        initial_len = len(merged_data)
-        merged_data = merged_data.dropna(subset=['Precip_Total', 'Caudal_Prom']).reset_index(drop=True)
-        final_len = len(merged_data)
-        if initial_len != final_len:
-            print(f"ℹ️ Filas eliminadas por NaN en {station_name}: {initial_len - final_len}")
-
-        print(f"📊 Datos alineados y limpios (Precip-Caudal) para {station_name}: {len(merged_data)} registros")
-        return merged_data
-
-    except Exception as e:
-        print(f"❌ Error preparando datos (Precip-Caudal) para {station_name}: {e}")
-        import traceback
-        traceback.print_exc()
-        return pd.DataFrame()
 
-def analyze_precip_flow_relationship_for_api(data):
-    """Analizar relación precipitación-caudal y preparar datos para API"""
-    if len(data) < 5:
-        return {"error": "Insuficientes datos para análisis de Precipitación-Caudal"}
+def _unidad_rejilla(*series_fechas):
+    """'meses' si todas las fechas son inicio de mes (series mensuales), 'días' en otro caso"""
+    fechas = pd.DatetimeIndex(np.concatenate(series_fechas))
+    if len(fechas) and (fechas.day == 1).all() and (fechas.normalize() == fechas).all():
+        return 'meses'
+    return 'días'
 
-    precip = data['Precip_Total'].values
-    caudal = data['Caudal_Prom'].values
-    # fechas = data['Fecha'].dt.strftime('%Y-%m-%d %H:%M:%S').tolist() if 'Fecha' in data.columns else None
 
-    # Eliminar pares NaN/NaN
-    mask = ~(np.isnan(precip) | np.isnan(caudal))
-    precip_clean = precip[mask]
-    caudal_clean = caudal[mask]
-
-    if len(precip_clean) < 5:
-        return {"error": "Insuficientes datos válidos para análisis después de limpieza"}
+def _posiciones_rejilla(fechas, unidad):
+    """Posiciones enteras de las fechas en la rejilla regular: meses o días desde 1970"""
+    if unidad == 'meses':
+        fechas = pd.DatetimeIndex(fechas)
+        return np.asarray((fechas.year - 1970) * 12 + fechas.month - 1)
+    return np.asarray(fechas).astype('datetime64[D]').astype(np.int64)
 
-    try:
-        # Correlaciones
-        pearson_corr, pearson_p = stats.pearsonr(precip_clean, caudal_clean)
-        spearman_corr, spearman_p = stats.spearmanr(precip_clean, caudal_clean)
 
-        # Regresión Lineal
-        linear_model = LinearRegression()
-        linear_model.fit(precip_clean.reshape(-1, 1), caudal_clean)
-        linear_r2 = r2_score(caudal_clean, linear_model.predict(precip_clean.reshape(-1, 1)))
-        linear_rmse = np.sqrt(mean_squared_error(caudal_clean, linear_model.predict(precip_clean.reshape(-1, 1))))
-        linear_equation = f"Caudal = {linear_model.coef_[0]:.4f} * Precip + {linear_model.intercept_:.2f}"
+def _sobre_rejilla(posiciones, valores, largo, agregado):
+    """
+    Rejilla de `largo` celdas con los valores en sus posiciones; los que caen en la misma celda
+    (p. ej. datos subdiarios en la rejilla de días) se suman o promedian según `agregado`.
+    Las celdas sin dato quedan en NaN.
+    """
+    suma = np.bincount(posiciones, weights=valores, minlength=largo)
+    conteo = np.bincount(posiciones, minlength=largo)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rejilla = suma / conteo if agregado == 'promedio' else suma
+    rejilla[conteo == 0] = np.nan
+    return rejilla
 
-        # Crear puntos para la línea de regresión
-        precip_sorted = np.sort(precip_clean)
-        caudal_linear_pred = linear_model.predict(precip_sorted.reshape(-1, 1))
 
-        # Preparar datos para Chart.js
-        chartjs_data = {
-            "datasets": [
-                {
-                    "label": "Datos Observados",
-                    "data": [{"x": float(p), "y": float(c)} for p, c in zip(precip_clean, caudal_clean)],
-                    "backgroundColor": "rgba(153, 102, 255, 0.6)", # Color púrpura
-                    "borderColor": "rgba(153, 102, 255, 1)",
-                    "borderWidth": 1,
-                    "pointRadius": 3,
-                    "showLine": False
-                },
-                {
-                    "label": f"Regresión Lineal (R²={linear_r2:.3f})",
-                    "data": [{"x": float(p), "y": float(c)} for p, c in zip(precip_sorted, caudal_linear_pred)],
-                    "borderColor": "rgba(255, 159, 64, 1)", # Color naranja
-                    "borderWidth": 2,
-                    "fill": False,
-                    "showLine": True,
-                    "pointRadius": 0,
-                    "borderDash": []
-                }
-            ]
+def calcular_lag_correlacion(estacion, variable, lag_max=None):
+    """
+    Correlación entre la precipitación en t y `variable` en t + k para k = 0..lag_max, con ambas
+    series sobre una rejilla regular (los huecos quedan como NaN y se enmascaran).
+    Cacheado por estación/variable/lag_max y versión de los archivos.
+    """
+    serie_p = obtener_serie_agregada('precipitacion', estacion)
+    serie_v = obtener_serie_agregada(variable, estacion)
+    if serie_p is None or serie_v is None:
+        return None
+    marcar_etapa('cargar')
+
+    clave = (estacion, variable, lag_max)
+    version = (serie_p['version'], serie_v['version'])
+    cache = _LAGS.get(clave)
+    acierto = cache is not None and cache['version'] == version
+    registrar_cache('lags', acierto)
+    if acierto:
+        return cache['resultado']
+
+    validos_p = ~np.isnan(serie_p['valores'])
+    validos_v = ~np.isnan(serie_v['valores'])
+    if not validos_p.any() or not validos_v.any():
+        return None  # Algún archivo sin filas o con todos los sensores vacíos
+    fechas_p, fechas_v = serie_p['Fecha'][validos_p], serie_v['Fecha'][validos_v]
+
+    unidad = _unidad_rejilla(fechas_p, fechas_v)
+    pos_p = _posiciones_rejilla(fechas_p, unidad)
+    pos_v = _posiciones_rejilla(fechas_v, unidad)
+    inicio = min(pos_p.min(), pos_v.min())
+    largo = int(max(pos_p.max(), pos_v.max()) - inicio + 1)
+    precip = _sobre_rejilla(pos_p - inicio, serie_p['valores'][validos_p], largo, AGREGADO_VARIABLE['precipitacion'])
+    valores = _sobre_rejilla(pos_v - inicio, serie_v['valores'][validos_v], largo, AGREGADO_VARIABLE[variable])
+    marcar_etapa('alinear')
+
+    if lag_max is None:
+        lag_max = LAG_MAX_DEFECTO[unidad]
+    lag_max = min(lag_max, largo - 1)
+    r, n = correlacion_cruzada_enmascarada(precip, valores, lag_max)
+    r[n < 5] = np.nan
+
+    lags = np.arange(lag_max + 1)
+    mejor = None
+    if not np.isnan(r).all():
+        k = int(np.nanargmax(np.abs(r)))
+        mejor = {"lag": k, "correlacion": float(r[k]), "n": int(n[k])}
+
+    etiqueta = ETIQUETA_VARIABLE[variable]
+    correlaciones = [None if np.isnan(v) else float(v) for v in r]
+    resultado = {
+        "success": True,
+        "estacion": estacion.capitalize(),
+        "variable": variable,
+        "unidad_lag": unidad,
+        "lags": lags.tolist(),
+        "correlaciones": correlaciones,
+        "n": n.tolist(),
+        "mejor_lag": mejor,
+        "chartjs_data": {
+            "labels": lags.tolist(),
+            "datasets": [{
+                "label": f"Correlación Precip(t) - {etiqueta}(t + lag)",
+                "data": correlaciones,
+                "backgroundColor": [
+                    "rgba(255, 99, 132, 0.8)" if mejor and k == mejor["lag"] else "rgba(54, 162, 235, 0.6)"
+                    for k in lags
+                ],
+                "borderWidth": 1
+            }]
         }
+    }
+    if len(_LAGS) >= 64:
+        _LAGS.clear()  # lag_max viene del cliente: acotar el caché
+    _LAGS[clave] = {'version': version, 'resultado': resultado}
+    marcar_etapa('ajustar')
+    return resultado
 
-        # Preparar estadísticas
-        stats_data = {
-            "total_puntos": len(precip_clean),
-            "correlacion_pearson": pearson_corr,
-            "p_valor_pearson": pearson_p,
-            "correlacion_spearman": spearman_corr,
-            "p_valor_spearman": spearman_p,
-            "regresion_lineal": {
-                "r2": linear_r2,
-                "rmse": linear_rmse,
-                "ecuacion": linear_equation
-            }
-        }
 
-        return {
-            "success": True,
-            "estadisticas": stats_data,
-            "chartjs_data": chartjs_data
-        }
+@app.route('/api/lag_correlacion/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_lag_correlacion(estacion):
+    """
+    API de correlación cruzada con retardo entre la precipitación y el caudal o nivel.
+    Parámetros: variable=caudal|nivel (por defecto caudal), lag_max=N (en la unidad de la serie).
+    """
+    estacion = estacion.lower()
+    if estacion not in ESTACIONES:
+        return jsonify({"error": "Estación no válida. Usa 'papallacta' o 'quijos'."}), 400
+    variable = request.args.get('variable', 'caudal').lower()
+    if variable not in ('caudal', 'nivel'):
+        return jsonify({"error": "Variable no válida. Usa 'caudal' o 'nivel'."}), 400
+    lag_max = request.args.get('lag_max')
+    if lag_max is not None:
+        try:
+            lag_max = int(lag_max)
+        except ValueError:
+            return jsonify({"error": "lag_max debe ser un entero"}), 400
+        if lag_max < 0:
+            return jsonify({"error": "lag_max debe ser >= 0"}), 400
 
+    try:
+        resultado = calcular_lag_correlacion(estacion, variable, lag_max)
+        if resultado is None:
+            return jsonify({"error": f"No se encontraron datos para {estacion.capitalize()}."}), 404
+        return jsonify(resultado)
     except Exception as e:
-        print(f"⚠️ Error en análisis Precipitación-Caudal: {e}")
+        print(f"Error en /api/lag_correlacion/{estacion}: {e}")
         import traceback
         traceback.print_exc()
-        return {"error": f"Error al analizar relación Precipitación-Caudal: {str(e)}"}
+        return jsonify({"error": f"Error interno del servidor al procesar {estacion}."}), 500
 
-# === Fin de Funciones para análisis de correlación Precipitación-Caudal ===
-@app.route('/api/correlacion_precip_caudal/<estacion>')
-def api_correlacion_precip_caudal(estacion):
-    """API para datos de correlación precipitación-caudal"""
+
+# === Correlación y regresión en ventana móvil ===
+# Par -> (variable x, variable y), igual que las rutas /api/correlacion*
+PARES_CORRELACION = {
+    'caudal_nivel': ('nivel', 'caudal'),
+    'precip_nivel': ('precipitacion', 'nivel'),
+    'precip_caudal': ('precipitacion', 'caudal'),
+}
+
+
+@app.route('/api/correlacion_movil/<estacion>')
+@vuelo_unico
+@medir_etapas
+def api_correlacion_movil(estacion):
+    """
+    API de correlación de Pearson, pendiente y R² en ventana móvil sobre los pares alineados.
+    Parámetros: ventana=N (pares por ventana, por defecto 12), par=caudal_nivel|precip_nivel|precip_caudal.
+    Permite ver si la relación nivel -> caudal (curva de descarga) deriva en el tiempo.
+    """
     estacion = estacion.lower()
-    if estacion not in ['papallacta', 'quijos']:
+    if estacion not in ESTACIONES:
         return jsonify({"error": "Estación no válida. Usa 'papallacta' o 'quijos'."}), 400
-
+    par = request.args.get('par', 'caudal_nivel').lower()
+    if par not in PARES_CORRELACION:
+        return jsonify({"error": f"Par no válido. Usa: {', '.join(PARES_CORRELACION)}."}), 400
     try:
-        # 1. Cargar datos
-        precip_papallacta, caudal_papallacta, precip_quijos, caudal_quijos = load_precip_flow_data_for_api()
-        if precip_papallacta is None or caudal_papallacta is None or \
-           precip_quijos is None or caudal_quijos is None:
-            return jsonify({"error": "Error al cargar los datos de precipitación o caudal."}), 500
-
-        # 2. Seleccionar datos de la estación solicitada
-        if estacion == 'papallacta':
-            precip_data = precip_papallacta
-            caudal_data = caudal_papallacta
-            station_name = "Papallacta"
-        else: # quijos
-            precip_data = precip_quijos
-            caudal_data = caudal_quijos
-            station_name = "Quijos"
-
-        # 3. Preparar datos (alinear por fecha)
-        aligned_data = prepare_precip_flow_data_for_api(precip_data, caudal_data, station_name)
-        if aligned_data.empty:
-            return jsonify({"error": f"No se encontraron datos alineados para {station_name}."}), 404
-
-        # 4. Analizar y preparar para API
-        result = analyze_precip_flow_relationship_for_api(aligned_data)
-        if "error" in result:
-            return jsonify(result), 400
+        ventana = int(request.args.get('ventana', 12))
+    except ValueError:
+        return jsonify({"error": "ventana debe ser un entero"}), 400
+    if ventana < 3:
+        return jsonify({"error": "ventana debe ser >= 3"}), 400
 
-        # 5. Añadir nombre de la estación al resultado
-        result["estacion"] = station_name
-        return jsonify(result)
+    try:
+        var_x, var_y = PARES_CORRELACION[par]
+        datos = obtener_par_alineado(estacion, var_x, var_y)
+        if datos is None or len(datos['Fecha']) == 0:
+            return jsonify({"error": f"No se encontraron datos alineados para {estacion.capitalize()}."}), 404
+        if len(datos['Fecha']) < ventana:
+            return jsonify({"error": f"La ventana ({ventana}) supera los {len(datos['Fecha'])} pares disponibles."}), 400
+
+        movil = regresion_movil(datos[COLUMNA_VARIABLE[var_x]], datos[COLUMNA_VARIABLE[var_y]], ventana)
+        # Cada ventana se etiqueta con la fecha de su último par
+        fechas = pd.DatetimeIndex(datos['Fecha'][ventana - 1:]).strftime('%Y-%m-%d').tolist()
+        series = {clave: [None if np.isnan(v) else float(v) for v in valores] for clave, valores in movil.items()}
+        etiqueta = f"{ETIQUETA_VARIABLE[var_x]}-{ETIQUETA_VARIABLE[var_y]}"
+        marcar_etapa('ajustar')
 
+        return jsonify({
+            "success": True,
+            "estacion": estacion.capitalize(),
+            "par": par,
+            "ventana": ventana,
+            "fechas": fechas,
+            **series,
+            "chartjs_data": {
+                "labels": fechas,
+                "datasets": [
+                    {
+                        "label": f"Pearson r {etiqueta} (ventana {ventana})",
+                        "data": series['r'],
+                        "borderColor": "rgba(54, 162, 235, 1)",
+                        "backgroundColor": "rgba(54, 162, 235, 0.2)",
+                        "fill": False,
+                        "pointRadius": 0,
+                        "yAxisID": "y"
+                    },
+                    {
+                        "label": "R²",
+                        "data": series['r2'],
+                        "borderColor": "rgba(75, 192, 192, 1)",
+                        "fill": False,
+                        "pointRadius": 0,
+                        "yAxisID": "y"
+                    },
+                    {
+                        "label": "Pendiente",
+                        "data": series['pendiente'],
+                        "borderColor": "rgba(255, 99, 132, 1)",
+                        "fill": False,
+                        "pointRadius": 0,
+                        "yAxisID": "y1"
+                    }
+                ]
+            }
+        })
     except Exception as e:
-        print(f"Error en /api/correlacion_precip_caudal/{estacion}: {e}")
+        print(f"Error en /api/correlacion_movil/{estacion}: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Error interno del servidor al procesar {estacion}."}), 500
@@ -1082,6 +2860,8 @@ def api_correlacion_precip_caudal(estacion):
 # ... (resto de tu código) ...
 
 @app.route('/api/contribucion_afluentes')
+@vuelo_unico
+@medir_etapas
 def api_contribucion_afluentes():
     """API para obtener datos de contribución de afluentes al caudal mínimo."""
     try:
@@ -1093,6 +2873,7 @@ def api_contribucion_afluentes():
 
         if caudal_papallacta_df.empty or caudal_quijos_df.empty:
             return jsonify({"error": "No se pudieron cargar los datos de caudal de una o ambas estaciones."}), 500
+        marcar_etapa('cargar')
 
         # 2. Procesar datos: Alinear por fecha y calcular promedios diarios si es necesario
         # Asumimos que los DataFrames tienen una columna 'Fecha' y columnas numéricas de sensores.
@@ -1125,6 +2906,7 @@ def api_contribucion_afluentes():
         if df_combined.empty:
             return jsonify(
                 {"error": "No hay fechas comunes entre los datos de Papallacta y Quijos para comparar."}), 500
+        marcar_etapa('alinear')
 
         # 4. Calcular caudal total de afluentes
         df_combined['Caudal_Total_Afluentes'] = df_combined['Caudal_Prom_Papallacta'] + df_combined[
@@ -1203,6 +2985,7 @@ def api_contribucion_afluentes():
                 "borderWidth": 1
             }]
         }
+        marcar_etapa('ajustar')
 
         # 12. Devolver JSON con todos los resultados
         return jsonify({
@@ -1233,5 +3016,75 @@ def api_contribucion_afluentes():
 
 
 
+# === Fábrica de la aplicación para servidores pre-fork (ver wsgi.py y gunicorn.conf.py) ===
+def precargar_datos():
+    """
+    Carga e indexa todo lo que comparten las peticiones: datasets de las estaciones, payloads
+    de las series del dashboard, series agregadas y pares alineados, y coordenadas de los ríos.
+    """
+    inicio = time.perf_counter()
+    for filename in ARCHIVOS_DATOS:
+        obtener_entrada_dataset(filename)
+    for serie_id in SERIES_DASHBOARD:
+        payload_serie(serie_id)
+    for estacion in ESTACIONES:
+        for var_x, var_y in PARES_CORRELACION.values():
+            obtener_par_alineado(estacion, var_x, var_y)
+    for nombre_archivo in ARCHIVOS_COORDENADAS:
+        obtener_coords(nombre_archivo)
+    print(f"📦 Datos precargados en {(time.perf_counter() - inicio) * 1000:.0f} ms")
+
+
+def cerrar_pools():
+    """Cierra los pools de bootstrap y de análisis (p. ej. al terminar un worker de gunicorn)"""
+    global _pool_bootstrap, _pool_analisis
+    with _BOOTSTRAP_LOCK:
+        pool, _pool_bootstrap = _pool_bootstrap, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+    with _TRABAJOS_LOCK:
+        pool, _pool_analisis = _pool_analisis, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+_APP_PREPARADA = False
+
+
+def crear_app(precargar=True):
+    """
+    Prepara y devuelve la aplicación para un servidor WSGI. No es una factoría: rutas, hooks y
+    cachés viven a nivel de módulo, así que siempre se devuelve la misma instancia global `app`
+    (una por proceso) y llamarla otra vez no vuelve a cargar nada.
+
+    Con `precargar`, los datos se cargan aquí; si el servidor importa la app en el proceso
+    maestro antes de hacer fork (preload_app en gunicorn), los workers heredan esa memoria
+    copy-on-write en lugar de releer los CSV. gc.freeze() saca esos objetos del recolector para
+    que sus pasadas no escriban en las páginas compartidas.
+    """
+    global _APP_PREPARADA
+    if precargar and not _APP_PREPARADA:
+        precargar_datos()
+        gc.freeze()
+        _APP_PREPARADA = True
+    return app
+
+
+@app.route('/api/arranque')
+def api_arranque():
+    """Tiempos de arranque: import de cada módulo pesado (incluidos los diferidos) y total"""
+    return jsonify({
+        "arranque_ms": round(TIEMPO_ARRANQUE_MS, 1),
+        "modulos": [
+            {"modulo": nombre, "ms": round(t['ms'], 1), "diferido": t['diferido']}
+            for nombre, t in TIEMPOS_ARRANQUE.items()
+        ]
+    })
+
+
+TIEMPO_ARRANQUE_MS = (time.perf_counter() - _INICIO_ARRANQUE) * 1000
+print(f"⏱️ app.py cargado en {TIEMPO_ARRANQUE_MS:.0f} ms (" + ", ".join(
+    f"{nombre} {t['ms']:.0f} ms" for nombre, t in TIEMPOS_ARRANQUE.items()) + ")")
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
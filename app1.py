@@ -5,9 +5,7 @@ import os
 from datetime import datetime
 import numpy as np
 from scipy import stats
-from sklearn.linear_model import LinearRegression
-from sklearn.preprocessing import PolynomialFeatures
-from sklearn.metrics import r2_score, mean_squared_error
+from analisis_numerico import ajustar_polinomio, evaluar_polinomio
 # --- Nuevas importaciones para el chatbot ---
 from google import genai
 from dotenv import load_dotenv # <-- Importar load_dotenv
@@ -457,16 +455,14 @@ def analyze_flow_level_relationship_for_api(data):
 
     # Regresión Lineal
     try:
-        X_linear = nivel.reshape(-1, 1)
-        y_linear = caudal
-        linear_model = LinearRegression().fit(X_linear, y_linear)
-        linear_r2 = r2_score(y_linear, linear_model.predict(X_linear))
-        linear_equation = f"Caudal = {linear_model.coef_[0]:.4f} * Nivel + {linear_model.intercept_:.2f}"
+        linear_model = ajustar_polinomio(nivel, caudal, grado=1)
+        linear_r2 = linear_model['r2']
+        intercept, pendiente = linear_model['coeficientes']
+        linear_equation = f"Caudal = {pendiente:.4f} * Nivel + {intercept:.2f}"
 
         # Preparar datos para la línea de regresión lineal (puntos extremos)
         nivel_min, nivel_max = np.min(nivel), np.max(nivel)
-        caudal_linear_min = linear_model.predict(np.array([[nivel_min]]))[0]
-        caudal_linear_max = linear_model.predict(np.array([[nivel_max]]))[0]
+        caudal_linear_min, caudal_linear_max = evaluar_polinomio(linear_model['coeficientes'], [nivel_min, nivel_max])
         linear_regression_line = {
             'x': [nivel_min, nivel_max],
             'y': [caudal_linear_min, caudal_linear_max]
@@ -477,22 +473,19 @@ def analyze_flow_level_relationship_for_api(data):
 
     # Regresión Polinómica (Cuadrática)
     try:
-        poly_features = PolynomialFeatures(degree=2)
-        X_poly = poly_features.fit_transform(nivel.reshape(-1, 1))
-        poly_model = LinearRegression().fit(X_poly, y_linear)
-        poly_r2 = r2_score(y_linear, poly_model.predict(X_poly))
+        poly_model = ajustar_polinomio(nivel, caudal, grado=2)
+        poly_r2 = poly_model['r2']
         # Crear puntos para la curva polinómica
         nivel_sorted = np.sort(nivel)
-        X_poly_sorted = poly_features.transform(nivel_sorted.reshape(-1, 1))
-        caudal_poly_pred = poly_model.predict(X_poly_sorted)
+        caudal_poly_pred = evaluar_polinomio(poly_model['coeficientes'], nivel_sorted)
         polynomial_regression_curve = {
             'x': nivel_sorted.tolist(),
             'y': caudal_poly_pred.tolist()
         }
         # Formato simplificado de la ecuación (a*x^2 + b*x + c)
-        # coef_ es [intercept, x, x^2] para PolynomialFeatures
-        coefs = poly_model.coef_
-        intercept = poly_model.intercept_
+        # coeficientes es [intercept, x, x^2]
+        coefs = poly_model['coeficientes']
+        intercept = coefs[0]
         poly_equation = f"Caudal = {coefs[2]:.4f}*Nivel² + {coefs[1]:.4f}*Nivel + {intercept:.2f}"
     except Exception as e:
         print(f"⚠️ Error en regresión polinómica: {e}")
@@ -721,29 +714,24 @@ def analyze_precip_level_relationship_for_api(data):
         spearman_corr, spearman_p = stats.spearmanr(precip_clean, nivel_clean)
 
         # Regresión Lineal
-        linear_model = LinearRegression()
-        linear_model.fit(precip_clean.reshape(-1, 1), nivel_clean)
-        linear_r2 = r2_score(nivel_clean, linear_model.predict(precip_clean.reshape(-1, 1)))
-        linear_rmse = np.sqrt(mean_squared_error(nivel_clean, linear_model.predict(precip_clean.reshape(-1, 1))))
-        linear_equation = f"Nivel = {linear_model.coef_[0]:.4f} * Precip + {linear_model.intercept_:.2f}"
+        linear_model = ajustar_polinomio(precip_clean, nivel_clean, grado=1)
+        linear_r2 = linear_model['r2']
+        linear_rmse = linear_model['rmse']
+        linear_equation = f"Nivel = {linear_model['coeficientes'][1]:.4f} * Precip + {linear_model['coeficientes'][0]:.2f}"
 
         # Regresión Polinómica (Grado 2, como es común para este tipo de relación)
-        poly_features = PolynomialFeatures(degree=2)
-        X_poly = poly_features.fit_transform(precip_clean.reshape(-1, 1))
-        poly_model = LinearRegression()
-        poly_model.fit(X_poly, nivel_clean)
-        poly_r2 = r2_score(nivel_clean, poly_model.predict(X_poly))
-        poly_rmse = np.sqrt(mean_squared_error(nivel_clean, poly_model.predict(X_poly)))
+        poly_model = ajustar_polinomio(precip_clean, nivel_clean, grado=2)
+        poly_r2 = poly_model['r2']
+        poly_rmse = poly_model['rmse']
 
         # Crear puntos para las líneas de regresión
         precip_sorted = np.sort(precip_clean)
 
         # Línea lineal
-        nivel_linear_pred = linear_model.predict(precip_sorted.reshape(-1, 1))
+        nivel_linear_pred = evaluar_polinomio(linear_model['coeficientes'], precip_sorted)
 
         # Curva polinómica
-        X_poly_sorted = poly_features.transform(precip_sorted.reshape(-1, 1))
-        nivel_poly_pred = poly_model.predict(X_poly_sorted)
+        nivel_poly_pred = evaluar_polinomio(poly_model['coeficientes'], precip_sorted)
 
         # Preparar datos para Chart.js
         chartjs_data = {
@@ -967,15 +955,14 @@ def analyze_precip_flow_relationship_for_api(data):
         spearman_corr, spearman_p = stats.spearmanr(precip_clean, caudal_clean)
 
         # Regresión Lineal
-        linear_model = LinearRegression()
-        linear_model.fit(precip_clean.reshape(-1, 1), caudal_clean)
-        linear_r2 = r2_score(caudal_clean, linear_model.predict(precip_clean.reshape(-1, 1)))
-        linear_rmse = np.sqrt(mean_squared_error(caudal_clean, linear_model.predict(precip_clean.reshape(-1, 1))))
-        linear_equation = f"Caudal = {linear_model.coef_[0]:.4f} * Precip + {linear_model.intercept_:.2f}"
+        linear_model = ajustar_polinomio(precip_clean, caudal_clean, grado=1)
+        linear_r2 = linear_model['r2']
+        linear_rmse = linear_model['rmse']
+        linear_equation = f"Caudal = {linear_model['coeficientes'][1]:.4f} * Precip + {linear_model['coeficientes'][0]:.2f}"
 
         # Crear puntos para la línea de regresión
         precip_sorted = np.sort(precip_clean)
-        caudal_linear_pred = linear_model.predict(precip_sorted.reshape(-1, 1))
+        caudal_linear_pred = evaluar_polinomio(linear_model['coeficientes'], precip_sorted)
 
         # Preparar datos para Chart.js
         chartjs_data = {
@@ -0,0 +1,65 @@
+"""
+Configuración de gunicorn para el dashboard: gunicorn -c gunicorn.conf.py wsgi:app
+
+preload_app importa wsgi.py (y precarga los datos) en el proceso maestro antes de crear los
+workers, que comparten esa memoria copy-on-write. Las variables de entorno permiten ajustar
+la configuración sin editar el archivo.
+"""
+import glob
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+# Los CSV, .col y .txt se abren con rutas relativas al proyecto
+chdir = os.path.dirname(os.path.abspath(__file__))
+
+bind = os.getenv('HIDRO_BIND', f"0.0.0.0:{os.getenv('PORT', '5000')}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Hilos por worker: /api/stream y /api/analizar/stream mantienen conexiones abiertas. app.py
+# reserva a lo sumo 1/4 de los hilos para streams SSE (HIDRO_SSE_MAX_SUSCRIPTORES, con 503 +
+# retry por encima) y 1/2 para análisis IA, así las rutas de datos nunca se quedan sin hilos
+worker_class = 'gthread'
+threads = int(os.getenv('HIDRO_THREADS', 16))
+# app.py deriva de HIDRO_THREADS los cupos de análisis IA para que nunca ocupen todos los hilos
+os.environ.setdefault('HIDRO_THREADS', str(threads))
+# Directorio donde cada worker vuelca sus métricas para que /metrics las sume todas (un scrape
+# llega a un worker cualquiera). Por defecto uno privado y nuevo en cada arranque.
+_METRICAS_PROPIAS = 'HIDRO_METRICAS_DIR' not in os.environ
+if _METRICAS_PROPIAS:
+    os.environ['HIDRO_METRICAS_DIR'] = tempfile.mkdtemp(prefix='hidrologia_metricas_')
+preload_app = True
+# Los análisis IA pueden tardar (ver HIDRO_ANALISIS_TIMEOUT)
+timeout = int(os.getenv('HIDRO_WORKER_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+
+def on_starting(server):
+    """Descarta las métricas de un despliegue anterior si el directorio viene del entorno"""
+    for ruta in glob.glob(os.path.join(os.environ['HIDRO_METRICAS_DIR'], 'metricas_*.json')):
+        os.remove(ruta)
+
+
+def post_fork(server, worker):
+    """El worker empieza con las métricas vacías en lugar de heredar las del maestro"""
+    from app import METRICAS
+    METRICAS.reiniciar()
+
+
+def worker_exit(server, worker):
+    """
+    Cierra el pool de procesos del bootstrap (y el de análisis) del worker que termina y vuelca
+    sus métricas por última vez: su archivo se conserva para que los contadores no retrocedan
+    """
+    from app import METRICAS, cerrar_pools
+    cerrar_pools()
+    METRICAS.volcar()
+
+
+def on_exit(server):
+    if _METRICAS_PROPIAS:
+        shutil.rmtree(os.environ['HIDRO_METRICAS_DIR'], ignore_errors=True)
@@ -0,0 +1,226 @@
+"""
+Métricas del servidor en el formato de texto de Prometheus (se exponen en GET /metrics).
+
+Contadores e histogramas en memoria del proceso. Registrar una observación cuesta un
+bisect y un par de operaciones de diccionario bajo un lock. Con varios workers de gunicorn
+todos comparten el mismo puerto y cada scrape llega a un worker cualquiera, así que con un
+`directorio` cada proceso vuelca periódicamente sus valores a un archivo propio y
+exponer() suma los de todos los procesos (también los de workers ya terminados, para que
+los contadores no retrocedan).
+"""
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+
+# Límites de los buckets de latencia, en segundos
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Límites de los buckets de tamaño de respuesta, en bytes
+BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _formatear(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def _etiquetas(nombres, valores, extra=None):
+    """'{a="x",b="y"}' para los pares de etiquetas (vacío si no hay ninguna)"""
+    pares = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra is not None:
+        pares.append(f'{extra[0]}="{_escapar(extra[1])}"')
+    return '{' + ','.join(pares) + '}' if pares else ''
+
+
+class Contador:
+    """Contador monótono con etiquetas"""
+
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), lock=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = tuple(etiquetas)
+        self._lock = lock or threading.Lock()
+        self._valores = {}
+
+    def inc(self, *valores, cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def valor(self, *valores):
+        return self._valores.get(valores, 0)
+
+    def reiniciar(self):
+        with self._lock:
+            self._valores.clear()
+
+    def datos(self):
+        """Copia de los valores por etiquetas"""
+        with self._lock:
+            return dict(self._valores)
+
+    @staticmethod
+    def combinar(total, datos):
+        for clave, valor in datos.items():
+            total[clave] = total.get(clave, 0) + valor
+
+    def lineas(self, datos=None):
+        valores = sorted((self.datos() if datos is None else datos).items())
+        return [f"{self.nombre}{_etiquetas(self.etiquetas, clave)} {_formatear(v)}" for clave, v in valores]
+
+
+class Histograma:
+    """Histograma con buckets fijos (acumulativos al exponerlos), suma y conteo por etiquetas"""
+
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, buckets, etiquetas=(), lock=None):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.buckets = tuple(sorted(buckets))
+        self.etiquetas = tuple(etiquetas)
+        self._lock = lock or threading.Lock()
+        self._series = {}  # valores de etiquetas -> [conteos por bucket (+Inf al final), suma]
+
+    def observar(self, valor, *valores):
+        indice = bisect.bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * (len(self.buckets) + 1), 0.0]
+            serie[0][indice] += 1
+            serie[1] += valor
+
+    def reiniciar(self):
+        with self._lock:
+            self._series.clear()
+
+    def datos(self):
+        """Copia de [conteos por bucket, suma] por etiquetas"""
+        with self._lock:
+            return {clave: [list(conteos), suma] for clave, (conteos, suma) in self._series.items()}
+
+    @staticmethod
+    def combinar(total, datos):
+        for clave, (conteos, suma) in datos.items():
+            serie = total.get(clave)
+            if serie is None:
+                total[clave] = [list(conteos), suma]
+            else:
+                serie[0] = [a + b for a, b in zip(serie[0], conteos)]
+                serie[1] += suma
+
+    def lineas(self, datos=None):
+        datos = self.datos() if datos is None else datos
+        series = sorted((clave, conteos, suma) for clave, (conteos, suma) in datos.items())
+        lineas = []
+        for clave, conteos, suma in series:
+            acumulado = 0
+            for limite, conteo in zip(self.buckets + (float('inf'),), conteos):
+                acumulado += conteo
+                lineas.append(f"{self.nombre}_bucket{_etiquetas(self.etiquetas, clave, ('le', _formatear(limite)))} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_etiquetas(self.etiquetas, clave)} {_formatear(suma)}")
+            lineas.append(f"{self.nombre}_count{_etiquetas(self.etiquetas, clave)} {acumulado}")
+        return lineas
+
+
+class RegistroMetricas:
+    """
+    Conjunto de métricas del proceso, en el orden en que se declararon. Con `directorio`
+    (uno por despliegue, vacío al arrancar) se agregan las de todos los procesos que vuelcan
+    en él cada `intervalo` segundos.
+    """
+
+    def __init__(self, directorio=None, intervalo=5.0):
+        self._metricas = []
+        self.directorio = directorio
+        self.intervalo = intervalo
+        self._pid_volcado = None
+        self._volcado_lock = threading.Lock()
+
+    def contador(self, nombre, ayuda, etiquetas=()):
+        metrica = Contador(nombre, ayuda, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def histograma(self, nombre, ayuda, buckets, etiquetas=()):
+        metrica = Histograma(nombre, ayuda, buckets, etiquetas)
+        self._metricas.append(metrica)
+        return metrica
+
+    def reiniciar(self):
+        """
+        Vacía todas las métricas. Se llama en cada worker recién creado: con preload_app
+        heredaría lo que registró el maestro y cada archivo volcado lo volvería a sumar.
+        """
+        for metrica in self._metricas:
+            metrica.reiniciar()
+
+    def _archivo(self):
+        return os.path.join(self.directorio, f"metricas_{os.getpid()}.json")
+
+    def volcar(self):
+        """Escribe los valores de este proceso en su archivo del directorio (de forma atómica)"""
+        if not self.directorio:
+            return
+        contenido = {m.nombre: [[list(clave), valor] for clave, valor in m.datos().items()]
+                     for m in self._metricas}
+        archivo = self._archivo()
+        with open(f"{archivo}.tmp", 'w', encoding='utf-8') as destino:
+            json.dump(contenido, destino)
+        os.replace(f"{archivo}.tmp", archivo)
+
+    def iniciar_volcado(self):
+        """
+        Arranca (una vez por proceso) el hilo que vuelca los valores cada `intervalo`.
+        Se llama desde las peticiones: un hilo arrancado en el maestro no sobrevive al fork.
+        """
+        if not self.directorio or self._pid_volcado == os.getpid():
+            return
+        with self._volcado_lock:
+            if self._pid_volcado == os.getpid():
+                return
+            self._pid_volcado = os.getpid()
+            threading.Thread(target=self._volcar_periodicamente, name='volcado-metricas', daemon=True).start()
+
+    def _volcar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo)
+            try:
+                self.volcar()
+            except OSError as e:
+                print(f"⚠️ No se pudieron volcar las métricas: {e}")
+
+    def _datos_agregados(self):
+        """Suma por métrica y etiquetas de los archivos de todos los procesos"""
+        self.volcar()  # Lo de este proceso, al día
+        totales = {m.nombre: {} for m in self._metricas}
+        por_nombre = {m.nombre: m for m in self._metricas}
+        for ruta in glob.glob(os.path.join(self.directorio, 'metricas_*.json')):
+            try:
+                with open(ruta, 'r', encoding='utf-8') as origen:
+                    contenido = json.load(origen)
+            except (OSError, ValueError):
+                continue  # Archivo a medio escribir o borrado entre glob y open
+            for nombre, series in contenido.items():
+                if nombre in por_nombre:
+                    por_nombre[nombre].combinar(totales[nombre], {tuple(clave): valor for clave, valor in series})
+        return totales
+
+    def exponer(self):
+        """Texto en el formato de exposición de Prometheus (text/plain; version=0.0.4)"""
+        totales = self._datos_agregados() if self.directorio else {}
+        lineas = []
+        for metrica in self._metricas:
+            lineas.append(f"# HELP {metrica.nombre} {metrica.ayuda}")
+            lineas.append(f"# TYPE {metrica.nombre} {metrica.tipo}")
+            lineas.extend(metrica.lineas(totales.get(metrica.nombre)))
+        return '\n'.join(lineas) + '\n'
@@ -0,0 +1,164 @@
+"""
+Backends de modelo de lenguaje para el análisis IA del dashboard.
+
+Las rutas /api/analizar* solo usan la interfaz BackendLLM: `nombre`, `generar(prompt)` y
+`generar_stream(prompt)`. El backend se elige con la variable de entorno LLM_BACKEND:
+- 'gemini' (por defecto): Google Gemini, requiere GEMINI_API_KEY.
+- 'stub': respuestas locales deterministas con latencia y tamaño configurables, para
+  pruebas de carga y benchmarks sin red ni cuota.
+"""
+import hashlib
+import os
+import time
+from abc import ABC, abstractmethod
+
+
+class ErrorLLM(Exception):
+    """Error del servicio de modelo de lenguaje (se responde 502 al cliente)"""
+
+
+class BackendLLM(ABC):
+    """Interfaz común de los backends de modelo de lenguaje (un backend incompleto no se puede instanciar)"""
+
+    # Identifica al modelo en las claves de la caché de análisis
+    nombre = None
+
+    @abstractmethod
+    def generar(self, prompt, timeout=None):
+        """Texto completo generado para `prompt` (sin espacios extremos), o None si vino vacío"""
+
+    @abstractmethod
+    def generar_stream(self, prompt, timeout=None):
+        """
+        Generador de fragmentos de texto para `prompt`. Cerrarlo (close()) debe cancelar la
+        generación en curso. Lanza ErrorLLM si se supera `timeout` segundos.
+        """
+
+
+class BackendGemini(BackendLLM):
+    """Google Gemini mediante el SDK google-genai"""
+
+    def __init__(self, api_key, modelo="gemini-2.0-flash"):
+        from google import genai
+        self._errores = genai.errors
+        self.cliente = genai.Client(api_key=api_key)
+        self.nombre = modelo
+
+    @staticmethod
+    def _config(timeout):
+        # La API espera el timeout en milisegundos
+        return {'http_options': {'timeout': int(timeout * 1000)}} if timeout else None
+
+    @staticmethod
+    def _texto(response):
+        """Extrae el texto de una respuesta o fragmento de Gemini, o None"""
+        if hasattr(response, 'text') and response.text:
+            return response.text
+        # Puede que la respuesta tenga una estructura como response.candidates[0].content.parts[0].text
+        candidate = (getattr(response, 'candidates', None) or [None])[0]
+        content = getattr(candidate, 'content', None)
+        part = (getattr(content, 'parts', None) or [None])[0]
+        return getattr(part, 'text', None)
+
+    def generar(self, prompt, timeout=None):
+        try:
+            response = self.cliente.models.generate_content(
+                model=self.nombre, contents=prompt, config=self._config(timeout)
+            )
+        except self._errores.APIError as e:
+            raise ErrorLLM(str(e)) from e
+        texto = self._texto(response)
+        return texto.strip() if texto else None
+
+    def generar_stream(self, prompt, timeout=None):
+        stream = None
+        try:
+            stream = self.cliente.models.generate_content_stream(
+                model=self.nombre, contents=prompt, config=self._config(timeout)
+            )
+            for chunk in stream:
+                texto = self._texto(chunk)
+                if texto:
+                    yield texto
+        except self._errores.APIError as e:
+            raise ErrorLLM(str(e)) from e
+        finally:
+            # Al cerrar este generador (cliente desconectado) se cierra la conexión con Gemini
+            cerrar = getattr(stream, 'close', None)
+            if cerrar is not None:
+                cerrar()
+
+
+class BackendStub(BackendLLM):
+    """
+    Backend local determinista: el texto depende solo del prompt (hash SHA-256), tarda
+    `latencia` segundos en total y mide `caracteres` caracteres, repartidos en `fragmentos`.
+    """
+
+    nombre = 'stub'
+
+    def __init__(self, latencia=1.0, caracteres=1200, fragmentos=20):
+        self.latencia = latencia
+        self.caracteres = caracteres
+        self.fragmentos = max(1, fragmentos)
+
+    def _texto(self, prompt):
+        semilla = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        base = f"Análisis simulado {semilla[:12]}: los datos muestran un comportamiento estable. "
+        repeticiones = self.caracteres // len(base) + 1
+        return (base * repeticiones)[:self.caracteres].strip()
+
+    def generar(self, prompt, timeout=None):
+        if timeout is not None and self.latencia > timeout:
+            time.sleep(timeout)
+            raise ErrorLLM(f"Timeout simulado tras {timeout:g} s")
+        time.sleep(self.latencia)
+        return self._texto(prompt) or None
+
+    def generar_stream(self, prompt, timeout=None):
+        texto = self._texto(prompt)
+        paso = -(-len(texto) // self.fragmentos) or 1
+        espera = self.latencia / self.fragmentos
+        limite = time.monotonic() + timeout if timeout is not None else None
+        for inicio in range(0, len(texto), paso):
+            if limite is not None and time.monotonic() + espera > limite:
+                # Igual que una API real: se corta al cumplirse el timeout, no al final
+                time.sleep(max(0.0, limite - time.monotonic()))
+                raise ErrorLLM(f"Timeout simulado tras {timeout:g} s")
+            time.sleep(espera)
+            yield texto[inicio:inicio + paso]
+
+
+def crear_backend():
+    """
+    Crea el backend indicado por LLM_BACKEND ('gemini' por defecto o 'stub').
+    Devuelve None (y avisa por consola) si no se puede configurar.
+    """
+    tipo = os.getenv('LLM_BACKEND', 'gemini').lower()
+    try:
+        if tipo == 'stub':
+            backend = BackendStub(
+                latencia=float(os.getenv('LLM_STUB_LATENCIA', 1.0)),
+                caracteres=int(os.getenv('LLM_STUB_CARACTERES', 1200)),
+                fragmentos=int(os.getenv('LLM_STUB_FRAGMENTOS', 20)),
+            )
+            print(f"Backend LLM simulado (stub): latencia {backend.latencia:g} s, {backend.caracteres} caracteres.")
+            return backend
+        if tipo != 'gemini':
+            raise ValueError(f"LLM_BACKEND='{tipo}' no es válido (usa 'gemini' o 'stub')")
+
+        # Intenta obtener la clave API desde las variables de entorno
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("La variable de entorno GEMINI_API_KEY no está definida en el archivo .env")
+        backend = BackendGemini(api_key, modelo=os.getenv('GEMINI_MODEL', "gemini-2.0-flash"))
+        print("Cliente de Gemini configurado correctamente.")  # Log de confirmación
+        return backend
+
+    except ValueError as ve:
+        # Error específico si la variable no está en .env
+        print(f"ADVERTENCIA: {ve}. El análisis con IA no estará disponible.")
+    except Exception as e:
+        # Otros errores de configuración
+        print(f"ADVERTENCIA: Error al configurar el backend de IA: {e}. El análisis con IA no estará disponible.")
+    return None
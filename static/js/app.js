@@ -326,10 +326,40 @@ document.addEventListener('DOMContentLoaded', function() {
     loadCharts();
 });
 
+// Series del dashboard que se piden juntas a /api/series
+const SERIES_DASHBOARD_IDS = [
+    'stats',
+    'precipitacion_quijos', 'caudal_quijos', 'nivel_quijos',
+    'precipitacion_papallacta', 'caudal_papallacta', 'nivel_papallacta'
+];
+let seriesLote = null;
+let seriesLoteIds = [];
+let seriesLoteTiempo = 0;
+
+// Pide un lote de series a /api/series
+function pedirLoteSeries(ids) {
+    seriesLoteTiempo = Date.now();
+    seriesLoteIds = ids;
+    seriesLote = fetch('/api/series?ids=' + ids.join(','))
+        .then(response => response.json());
+}
+
+// Devuelve una serie del lote; todas las gráficas de un mismo refresco comparten una sola petición
+function obtenerSerie(id) {
+    if (!seriesLote || Date.now() - seriesLoteTiempo > 5000 || !seriesLoteIds.includes(id)) {
+        pedirLoteSeries(SERIES_DASHBOARD_IDS);
+    }
+    return seriesLote.then(lote => {
+        if (!lote[id]) {
+            throw new Error(lote.error || `Serie ${id} no disponible`);
+        }
+        return lote[id];
+    });
+}
+
 // Load statistics
 function loadStats() {
-    fetch('/api/stats')
-        .then(response => response.json())
+    obtenerSerie('stats')
         .then(data => {
             if (data.total_registros) {
                 const totalRegistros = Object.values(data.total_registros).reduce((a, b) => a + b, 0);
@@ -361,8 +391,7 @@ function loadCharts() {
 
 // Load precipitación chart
 function loadPrecipitacionQuijosChart() {
-    fetch('/api/precipitacion')
-        .then(response => response.json())
+    obtenerSerie('precipitacion_quijos')
         .then(data => {
             const ctx = document.getElementById('precipitacionQuijosChart').getContext('2d');
 
@@ -416,8 +445,7 @@ function loadPrecipitacionQuijosChart() {
 
 // Load caudal chart
 function loadCaudalQuijosChart() {
-    fetch('/api/caudal')
-        .then(response => response.json())
+    obtenerSerie('caudal_quijos')
         .then(data => {
             const ctx = document.getElementById('caudalQuijosChart').getContext('2d');
 
@@ -471,8 +499,7 @@ function loadCaudalQuijosChart() {
 
 // Load nivel chart
 function loadNivelQuijosChart() {
-    fetch('/api/nivel')
-        .then(response => response.json())
+    obtenerSerie('nivel_quijos')
         .then(data => {
             const ctx = document.getElementById('nivelQuijosChart').getContext('2d');
 
@@ -525,8 +552,7 @@ function loadNivelQuijosChart() {
 }
 
 function loadPrecipitacionPapallactaChart() {
-    fetch('/api/precipitacion_papallacta')
-        .then(response => response.json())
+    obtenerSerie('precipitacion_papallacta')
         .then(data => {
             const ctx = document.getElementById('precipitacionPapallactaChart').getContext('2d');
 
@@ -558,8 +584,7 @@ function loadPrecipitacionPapallactaChart() {
 }
 
 function loadCaudalPapallactaChart() {
-    fetch('/api/caudal_papallacta')
-        .then(response => response.json())
+    obtenerSerie('caudal_papallacta')
         .then(data => {
             const ctx = document.getElementById('caudalPapallactaChart').getContext('2d');
 
@@ -591,8 +616,7 @@ function loadCaudalPapallactaChart() {
 }
 
 function loadNivelPapallactaChart() {
-    fetch('/api/nivel_papallacta')
-        .then(response => response.json())
+    obtenerSerie('nivel_papallacta')
         .then(data => {
             const ctx = document.getElementById('nivelPapallactaChart').getContext('2d');
 
@@ -625,8 +649,7 @@ function loadNivelPapallactaChart() {
 
 // Load summary chart
 function loadSummaryChart() {
-    fetch('/api/stats')
-        .then(response => response.json())
+    obtenerSerie('stats')
         .then(data => {
             const ctx = document.getElementById('summaryChart').getContext('2d');
 
@@ -721,8 +744,91 @@ function refreshData() {
     loadCharts();
 }
 
-// Auto refresh every 5 minutes
-setInterval(refreshData, 300000);
+// Gráficos que dependen de cada CSV: la serie misma, las correlaciones que la usan
+// (/api/correlacion es nivel-caudal) y, para el caudal, la contribución de afluentes
+const dependientesSerie = {
+    precipitacion_quijos: [loadPrecipitacionQuijosChart, loadCorrelacionPrecipNivelQuijosChart,
+        loadCorrelacionPrecipCaudalQuijosChart],
+    caudal_quijos: [loadCaudalQuijosChart, loadCorrelacionQuijosChart,
+        loadCorrelacionPrecipCaudalQuijosChart, loadContribucionAfluentes],
+    nivel_quijos: [loadNivelQuijosChart, loadCorrelacionQuijosChart, loadCorrelacionPrecipNivelQuijosChart],
+    precipitacion_papallacta: [loadPrecipitacionPapallactaChart, loadCorrelacionPrecipNivelPapallactaChart,
+        loadCorrelacionPrecipCaudalPapallactaChart],
+    caudal_papallacta: [loadCaudalPapallactaChart, loadCorrelacionPapallactaChart,
+        loadCorrelacionPrecipCaudalPapallactaChart, loadContribucionAfluentes],
+    nivel_papallacta: [loadNivelPapallactaChart, loadCorrelacionPapallactaChart,
+        loadCorrelacionPrecipNivelPapallactaChart]
+};
+const etagsSeries = {};
+
+// Vuelve a pedir la serie que cambió y redibuja todo lo que depende de ella (y las estadísticas)
+function actualizarSerie(id) {
+    if (!dependientesSerie[id]) {
+        return;
+    }
+    pedirLoteSeries([id, 'stats']);
+    dependientesSerie[id].forEach(cargar => cargar());
+    loadStats();
+    // El resumen usa los totales de 'stats'; solo existe si la página tiene su canvas
+    if (document.getElementById('summaryChart')) {
+        loadSummaryChart();
+    }
+}
+
+// Refresco completo cada 5 minutos mientras no haya stream (sin soporte SSE o con el cupo lleno)
+let sondeoRespaldo = null;
+
+function iniciarSondeoRespaldo() {
+    if (!sondeoRespaldo) {
+        sondeoRespaldo = setInterval(refreshData, 300000);
+    }
+}
+
+function detenerSondeoRespaldo() {
+    if (sondeoRespaldo) {
+        clearInterval(sondeoRespaldo);
+        sondeoRespaldo = null;
+    }
+}
+
+// Escucha /api/stream: el servidor avisa qué serie cambió y con qué ETag
+function iniciarStreamDatos() {
+    const fuente = new EventSource('/api/stream');
+    fuente.onopen = detenerSondeoRespaldo;
+    // 'estado' llega al conectar (y al reconectar): se recargan las series que cambiaron mientras tanto
+    fuente.addEventListener('estado', event => {
+        const estado = JSON.parse(event.data);
+        Object.entries(estado).forEach(([id, etag]) => {
+            if (etagsSeries[id] && etagsSeries[id] !== etag) {
+                actualizarSerie(id);
+            }
+            etagsSeries[id] = etag;
+        });
+    });
+    fuente.addEventListener('dataset', event => {
+        const cambio = JSON.parse(event.data);
+        if (etagsSeries[cambio.id] !== cambio.etag) {
+            etagsSeries[cambio.id] = cambio.etag;
+            actualizarSerie(cambio.id);
+        }
+    });
+    // Si el servidor rechaza la conexión (503 con el cupo de streams lleno) EventSource no
+    // reintenta solo: mientras tanto se refresca cada 5 minutos y se vuelve a intentar el stream
+    // más tarde, con algo de azar para no llegar todos juntos
+    fuente.onerror = () => {
+        if (fuente.readyState === EventSource.CLOSED) {
+            iniciarSondeoRespaldo();
+            setTimeout(iniciarStreamDatos, 60000 + Math.random() * 30000);
+        }
+    };
+}
+
+// Actualización automática: notificaciones del servidor o, si no hay stream, cada 5 minutos
+if (window.EventSource) {
+    iniciarStreamDatos();
+} else {
+    iniciarSondeoRespaldo();
+}
 
 // --- Añade este código JavaScript al final del bloque extra_js ---
 console.log("Inicializando funcionalidad del Chatbot IA...");
@@ -770,12 +876,24 @@ function mostrarMensajeEnChat(mensaje, tipo='info') {
     chatMessages.scrollTop = chatMessages.scrollHeight;
 }
 
+// Gráficos que el servidor resume por sí mismo (GRAFICOS_ANALISIS en app.py): no hace falta enviar sus datos
+const GRAFICOS_RESUMEN_SERVIDOR = new Set([
+    'precipitacionChart', 'precipitacionPapallactaChart',
+    'caudalChart', 'caudalPapallactaChart',
+    'nivelChart', 'nivelPapallactaChart',
+    'correlacionPapallactaChart', 'correlacionQuijosChart',
+    'correlacionPrecipNivelPapallactaChart', 'correlacionPrecipNivelQuijosChart',
+    'correlacionPrecipCaudalPapallactaChart', 'correlacionPrecipCaudalQuijosChart'
+]);
+
 // Función para solicitar análisis al backend
 async function solicitarAnalisis(nombreGrafico, seccion) {
     console.log(`Solicitando análisis para el gráfico: ${nombreGrafico} en la sección: ${seccion}`);
 
-    const datos = obtenerDatosGrafico(nombreGrafico);
-    if (!datos) {
+    // Los gráficos del dashboard se resumen en el servidor; solo se envían los datos de los demás
+    const resumenEnServidor = GRAFICOS_RESUMEN_SERVIDOR.has(nombreGrafico);
+    const datos = resumenEnServidor ? undefined : obtenerDatosGrafico(nombreGrafico);
+    if (!resumenEnServidor && !datos) {
         mostrarMensajeEnChat('No se pudieron obtener los datos del gráfico seleccionado.', 'error');
         return;
     }
@@ -989,7 +1107,14 @@ document.addEventListener('DOMContentLoaded', function() {
             const closeBtn = document.getElementById('closeModalBtn');
             const closeFooterBtn = document.getElementById('closeModalFooterBtn'); // Nuevo botón
 
-            const closeModal = () => toggleCustomModal(false);
+            const closeModal = () => {
+                // Cerrar el modal abandona el análisis: se corta el stream y el servidor deja de generarlo
+                if (analisisEnCurso) {
+                    analisisEnCurso.abort();
+                    analisisEnCurso = null;
+                }
+                toggleCustomModal(false);
+            };
 
             if (closeBtn) {
                 closeBtn.addEventListener('click', closeModal);
@@ -1076,13 +1201,43 @@ document.addEventListener('DOMContentLoaded', function() {
             chatMessages.appendChild(mensajeElemento);
             // Hacer scroll hacia abajo
             chatMessages.scrollTop = chatMessages.scrollHeight;
+            return mensajeElemento;
+        }
+
+        // Lee un cuerpo text/event-stream con fetch + ReadableStream y llama a alEvento(evento, datos) por evento
+        async function leerEventosSSE(response, alEvento) {
+            const lector = response.body.getReader();
+            const decodificador = new TextDecoder();
+            let pendiente = '';
+            while (true) {
+                const { value, done } = await lector.read();
+                if (done) break;
+                pendiente += decodificador.decode(value, { stream: true });
+                let corte;
+                while ((corte = pendiente.indexOf('\n\n')) !== -1) {
+                    const bloque = pendiente.slice(0, corte);
+                    pendiente = pendiente.slice(corte + 2);
+                    let evento = 'message';
+                    let datos = '';
+                    bloque.split('\n').forEach(linea => {
+                        if (linea.startsWith('event:')) evento = linea.slice(6).trim();
+                        else if (linea.startsWith('data:')) datos += linea.slice(5).trim();
+                    });
+                    if (datos) alEvento(evento, JSON.parse(datos));
+                }
+            }
         }
 
+        // AbortController del análisis que se está mostrando en el modal
+        let analisisEnCurso = null;
+
         // Función modificada para solicitar análisis y mostrar el modal personalizado
         async function solicitarAnalisis(nombreGrafico, seccion) {
             console.log(`Solicitando análisis para el gráfico: ${nombreGrafico} en la sección: ${seccion}`);
-            const datos = obtenerDatosGrafico(nombreGrafico);
-            if (!datos) {
+            // Los gráficos del dashboard se resumen en el servidor; solo se envían los datos de los demás
+            const resumenEnServidor = GRAFICOS_RESUMEN_SERVIDOR.has(nombreGrafico);
+            const datos = resumenEnServidor ? undefined : obtenerDatosGrafico(nombreGrafico);
+            if (!resumenEnServidor && !datos) {
                 mostrarMensajeEnChat('No se pudieron obtener los datos del gráfico seleccionado.', 'error');
                 return;
             }
@@ -1100,9 +1255,18 @@ document.addEventListener('DOMContentLoaded', function() {
             mostrarMensajeEnChat('Enviando datos al asistente IA... <span class="spinner-border" role="status" aria-hidden="true"></span>', 'info');
             toggleCustomModal(true); // Mostrar el modal
 
+            // Un análisis nuevo reemplaza al anterior si todavía seguía llegando
+            if (analisisEnCurso) {
+                analisisEnCurso.abort();
+            }
+            const controlador = new AbortController();
+            analisisEnCurso = controlador;
+
             try {
-                const response = await fetch('/api/analizar', {
+                // Streaming: el texto se muestra a medida que lo genera el modelo
+                const response = await fetch('/api/analizar/stream', {
                     method: 'POST',
+                    signal: controlador.signal,
                     headers: {
                         'Content-Type': 'application/json',
                     },
@@ -1119,29 +1283,49 @@ document.addEventListener('DOMContentLoaded', function() {
                         errorMsg = 'El servicio de análisis IA no está disponible. ¿Se configuró correctamente la clave API?';
                     } else if (response.status === 400) {
                         errorMsg = 'Datos enviados al servidor incompletos o inválidos.';
+                    } else if (response.status === 429) {
+                        errorMsg = 'Hay demasiados análisis en curso. Inténtalo de nuevo en unos segundos.';
                     } else {
                         errorMsg = `Error del servidor: ${response.status} - ${response.statusText}`;
                     }
                     throw new Error(errorMsg);
                 }
 
-                const data = await response.json();
-                if (data.error) {
-                    throw new Error(data.error);
-                }
+                let analisis = '';
+                let mensajeAnalisis = null;
+                let errorStream = null;
+                await leerEventosSSE(response, (evento, datosEvento) => {
+                    if (evento === 'fragmento') {
+                        if (!mensajeAnalisis) {
+                            if (chatMessages) chatMessages.innerHTML = ''; // Quitar el mensaje de carga
+                            mensajeAnalisis = mostrarMensajeEnChat(`<strong>Análisis para ${nombreGrafico}:</strong><br><span class="texto-analisis"></span>`, 'success');
+                        }
+                        analisis += datosEvento.texto;
+                        mensajeAnalisis.querySelector('.texto-analisis').innerHTML = analisis.trim().replace(/\n/g, '<br>');
+                        if (chatMessages) chatMessages.scrollTop = chatMessages.scrollHeight;
+                    } else if (evento === 'error') {
+                        errorStream = datosEvento.error;
+                    }
+                });
 
-                if (data.analisis) {
-                    mostrarMensajeEnChat(`<strong>Análisis para ${nombreGrafico}:</strong><br>${data.analisis.replace(/\n/g, '<br>')}`, 'success');
-                    // Opcional: Mostrar el input para más preguntas si el análisis fue exitoso
-                    // document.getElementById('chat-input-group').style.display = 'flex';
-                } else {
+                if (errorStream) {
+                    throw new Error(errorStream);
+                }
+                if (!analisis) {
                     mostrarMensajeEnChat('El servidor respondió, pero no se recibió un análisis.', 'error');
                 }
             } catch (error) {
+                if (controlador.signal.aborted) {
+                    return; // El usuario cerró el modal o pidió otro análisis
+                }
                 console.error('Error al solicitar análisis:', error);
                 mostrarMensajeEnChat(`Error: ${error.message}`, 'error');
                 // Opcional: Ocultar el input si hay error
                 // document.getElementById('chat-input-group').style.display = 'none';
+            } finally {
+                if (analisisEnCurso === controlador) {
+                    analisisEnCurso = null;
+                }
             }
         }
 
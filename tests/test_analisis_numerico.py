@@ -0,0 +1,167 @@
+"""
+Pruebas de las rutinas de analisis_numerico contra implementaciones de referencia
+(np.polyfit, scipy.stats, np.correlate o bucles directos) sobre arrays chicos con NaN.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+from scipy import stats
+
+from analisis_numerico import (
+    ajustar_polinomio, evaluar_polinomio, pearson_enmascarado, spearman_enmascarado,
+    matriz_correlaciones, _correlacion_fft, correlacion_cruzada_enmascarada, regresion_movil,
+    bootstrap_bloque, bootstrap_regresion
+)
+
+
+@pytest.fixture
+def datos():
+    rng = np.random.default_rng(42)
+    x = rng.uniform(1.0, 5.0, 40)
+    y = 3.0 + 2.0 * x - 0.4 * x ** 2 + rng.normal(0, 0.3, 40)
+    return x, y
+
+
+@pytest.fixture
+def matriz_con_huecos():
+    rng = np.random.default_rng(7)
+    matriz = rng.normal(size=(50, 4))
+    matriz[:, 1] += 0.8 * matriz[:, 0]
+    matriz[:, 3] = np.round(matriz[:, 3])  # Empates para Spearman
+    matriz[rng.random(matriz.shape) < 0.25] = np.nan
+    return matriz
+
+
+@pytest.mark.parametrize('grado', [1, 2])
+def test_ajustar_polinomio_coincide_con_polyfit(datos, grado):
+    x, y = datos
+    ajuste = ajustar_polinomio(x, y, grado=grado)
+    esperado = np.polyfit(x, y, grado)[::-1]  # polyfit devuelve de mayor a menor grado
+    np.testing.assert_allclose(ajuste['coeficientes'], esperado, rtol=1e-8, atol=1e-10)
+
+    prediccion = np.polyval(esperado[::-1], x)
+    sse = ((y - prediccion) ** 2).sum()
+    assert ajuste['r2'] == pytest.approx(1 - sse / ((y - y.mean()) ** 2).sum(), rel=1e-10)
+    assert ajuste['rmse'] == pytest.approx(np.sqrt(sse / len(x)), rel=1e-10)
+    np.testing.assert_allclose(evaluar_polinomio(ajuste['coeficientes'], x), prediccion, rtol=1e-10)
+
+
+def test_ajustar_polinomio_y_constante():
+    ajuste = ajustar_polinomio([1.0, 2.0, 3.0], [5.0, 5.0, 5.0])
+    np.testing.assert_allclose(ajuste['coeficientes'], [5.0, 0.0], atol=1e-12)
+    assert ajuste['r2'] == 1.0
+
+
+def test_ajustar_polinomio_sin_datos():
+    with pytest.raises(ValueError):
+        ajustar_polinomio([], [])
+
+
+def _pares_validos(matriz, i, j):
+    mascara = ~np.isnan(matriz[:, i]) & ~np.isnan(matriz[:, j])
+    return matriz[mascara, i], matriz[mascara, j]
+
+
+def test_pearson_enmascarado_coincide_con_pearsonr(matriz_con_huecos):
+    r, n = pearson_enmascarado(matriz_con_huecos)
+    k = matriz_con_huecos.shape[1]
+    for i in range(k):
+        for j in range(k):
+            a, b = _pares_validos(matriz_con_huecos, i, j)
+            assert n[i, j] == len(a)
+            assert r[i, j] == pytest.approx(stats.pearsonr(a, b)[0], abs=1e-12)
+
+
+def test_spearman_enmascarado_coincide_con_spearmanr(matriz_con_huecos):
+    r = spearman_enmascarado(matriz_con_huecos)
+    k = matriz_con_huecos.shape[1]
+    for i in range(k):
+        for j in range(k):
+            a, b = _pares_validos(matriz_con_huecos, i, j)
+            assert r[i, j] == pytest.approx(stats.spearmanr(a, b)[0], abs=1e-12)
+
+
+def test_matriz_correlaciones_pocos_pares_y_varianza_nula():
+    matriz = np.array([
+        [1.0, np.nan, 2.0],
+        [2.0, np.nan, 2.0],
+        [3.0, 1.0, 2.0],
+        [4.0, 2.0, 2.0],
+    ])
+    resultado = matriz_correlaciones(matriz)
+    assert np.isnan(resultado['pearson'][0, 1])   # solo 2 pares
+    assert np.isnan(resultado['spearman'][0, 1])
+    assert np.isnan(resultado['pearson'][0, 2])   # columna constante
+    assert np.isnan(resultado['spearman'][0, 2])
+    assert resultado['n'][0, 1] == 2
+
+
+def test_correlacion_fft_coincide_con_correlate():
+    rng = np.random.default_rng(3)
+    a, b = rng.normal(size=30), rng.normal(size=30)
+    largo_fft = 1 << (2 * len(a) - 1).bit_length()
+    lag_max = 10
+    # np.correlate(b, a, 'full')[len(a) - 1 + k] = Σ_t a[t] * b[t + k]
+    esperado = np.correlate(b, a, 'full')[len(a) - 1:len(a) + lag_max]
+    np.testing.assert_allclose(_correlacion_fft(a, b, largo_fft, lag_max), esperado, atol=1e-10)
+
+
+def test_correlacion_cruzada_enmascarada_coincide_con_bucle():
+    rng = np.random.default_rng(5)
+    x = rng.normal(size=60)
+    y = np.roll(x, 3) + rng.normal(0, 0.5, 60)
+    x[rng.random(60) < 0.2] = np.nan
+    y[rng.random(60) < 0.2] = np.nan
+    lag_max = 8
+
+    r, n = correlacion_cruzada_enmascarada(x, y, lag_max)
+    for k in range(lag_max + 1):
+        a, b = x[:len(x) - k], y[k:]
+        mascara = ~np.isnan(a) & ~np.isnan(b)
+        assert n[k] == mascara.sum()
+        assert r[k] == pytest.approx(stats.pearsonr(a[mascara], b[mascara])[0], abs=1e-9)
+    assert int(np.nanargmax(r)) == 3
+
+
+def test_regresion_movil_coincide_con_bucle(datos):
+    x, y = datos
+    ventana = 7
+    movil = regresion_movil(x, y, ventana)
+    assert len(movil['r']) == len(x) - ventana + 1
+    for inicio in range(len(x) - ventana + 1):
+        a, b = x[inicio:inicio + ventana], y[inicio:inicio + ventana]
+        r = stats.pearsonr(a, b)[0]
+        assert movil['r'][inicio] == pytest.approx(r, abs=1e-9)
+        assert movil['pendiente'][inicio] == pytest.approx(np.polyfit(a, b, 1)[0], rel=1e-8)
+        assert movil['r2'][inicio] == pytest.approx(r ** 2, abs=1e-9)
+
+
+def test_regresion_movil_ventana_constante():
+    x = np.array([1.0, 1.0, 1.0, 2.0, 3.0])
+    y = np.array([1.0, 2.0, 3.0, 4.0, 5.0])
+    movil = regresion_movil(x, y, 3)
+    assert np.isnan(movil['r'][0]) and np.isnan(movil['pendiente'][0])
+    assert not np.isnan(movil['r'][2])
+
+
+def test_bootstrap_bloque_coincide_con_remuestras_directas(datos):
+    x, y = datos
+    resultado = bootstrap_bloque(x, y, 5, semilla=11)
+    rng = np.random.default_rng(11)
+    indices = rng.integers(0, len(x), size=(5, len(x)))
+    for fila, idx in enumerate(indices):
+        assert resultado['r'][fila] == pytest.approx(stats.pearsonr(x[idx], y[idx])[0], abs=1e-12)
+        assert resultado['pendiente'][fila] == pytest.approx(np.polyfit(x[idx], y[idx], 1)[0], rel=1e-9)
+
+
+def test_bootstrap_regresion_no_depende_del_ejecutor(datos):
+    x, y = datos
+    serie = bootstrap_regresion(x, y, 400, semilla=1, ic=90, bloques=4)
+    with ThreadPoolExecutor(max_workers=2) as ejecutor:
+        paralelo = bootstrap_regresion(x, y, 400, semilla=1, ic=90, bloques=4, ejecutor=ejecutor)
+    assert serie == paralelo
+
+    pendiente = np.polyfit(x, y, 1)[0]
+    assert serie['pendiente']['inferior'] <= pendiente <= serie['pendiente']['superior']
+    assert serie['r']['error_estandar'] > 0
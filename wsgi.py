@@ -0,0 +1,11 @@
+"""
+Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Los datos se cargan una vez al importar este módulo (en el proceso maestro, con preload_app).
+crear_app() devuelve la instancia global de app.py (no construye una nueva).
+"""
+from app import crear_app
+
+app = crear_app()